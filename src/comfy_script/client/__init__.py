@@ -1,4 +1,6 @@
 from __future__ import annotations
+import atexit
+import contextlib
 from dataclasses import dataclass
 from enum import IntEnum
 from io import BytesIO
@@ -7,8 +9,10 @@ import os
 from pathlib import PurePath
 import struct
 import sys
+import threading
 import traceback
-from typing import Callable
+import urllib.parse
+from typing import Any, AsyncIterator, Callable, Coroutine, Iterable, TypeVar
 
 import asyncio
 from warnings import warn
@@ -19,12 +23,17 @@ from yarl import URL
 
 nest_asyncio2.apply()
 
+T = TypeVar('T')
+
 class Client:
     def __init__(
         self,
         base_url: str | URL = 'http://127.0.0.1:8188/',
         *,
-        session_factory: Callable[[], aiohttp.ClientSession] = aiohttp.ClientSession
+        session_factory: Callable[[], aiohttp.ClientSession] = aiohttp.ClientSession,
+        pool: bool = True,
+        connection_limit: int = 100,
+        keepalive_timeout: float = 60,
     ):
         '''
         - `base_url`: The base URL of the ComfyUI server API.
@@ -34,11 +43,28 @@ class Client:
         - `session_factory`: A callable factory that returns a new [`aiohttp.ClientSession`](https://docs.aiohttp.org/en/latest/client_reference.html#aiohttp.ClientSession) object. 
 
           e.g. `lambda: aiohttp.ClientSession(auth=aiohttp.BasicAuth('Aladdin', 'open sesame'))`
+
+        - `pool`: Keep a long-lived session per event loop and reuse its connections across requests. See `pooled_session()`.
+
+        - `connection_limit`, `keepalive_timeout`: Connection limits of pooled sessions. Only used with the default `session_factory`; custom factories should configure their own connector.
         '''
         self.base_url = self._normalize_base_url(base_url)
 
         # Do not pass base_url to ClientSession, as it only supports absolute URLs without path part
         self._session_factory = session_factory
+
+        self._pool = pool
+        self._connection_limit = connection_limit
+        self._keepalive_timeout = keepalive_timeout
+        self._sessions: dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+        self._sessions_lock = threading.Lock()
+        self._atexit_registered = False
+
+        self.stats = ClientStats()
+        '''Connection statistics of pooled sessions.'''
+
+        self.node_set: NodeSet | None = None
+        '''The node set of the server, fetched on first use by `get_node_set()` or `check_prompt()`.'''
         
     def _normalize_base_url(self, base_url: str | URL):
         if base_url is None:
@@ -52,9 +78,323 @@ class Client:
         return base_url
     
     def session(self) -> aiohttp.ClientSession:
-        '''Because `aiohttp.ClientSession` is not event-loop-safe (thread-safe), a new session should be created for each request to avoid potential issues. Also, `aiohttp.ClientSession` cannot be closed in a sync manner.'''
+        '''Create a new session. The caller is responsible for closing it.
+
+        Internal requests use `pooled_session()` instead, which reuses connections.'''
         return self._session_factory()
 
+    def _new_pooled_session(self) -> aiohttp.ClientSession:
+        if self._session_factory is not aiohttp.ClientSession:
+            return self._session_factory()
+
+        stats = self.stats
+        trace_config = aiohttp.TraceConfig()
+        async def on_connection_create_end(session, context, params):
+            stats.connections_opened += 1
+        async def on_connection_reuseconn(session, context, params):
+            stats.connections_reused += 1
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self._connection_limit, keepalive_timeout=self._keepalive_timeout),
+            trace_configs=[trace_config],
+        )
+
+    def _get_pooled_session(self) -> aiohttp.ClientSession:
+        # `aiohttp.ClientSession` is not event-loop-safe (thread-safe), so sessions are keyed by event loop
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is not None and not session.closed:
+            return session
+        
+        with self._sessions_lock:
+            # Sessions of closed loops cannot be used anymore
+            stale = [(l, self._sessions.pop(l)) for l in [l for l in self._sessions if l.is_closed()]]
+
+            session = self._new_pooled_session()
+            self._sessions[loop] = session
+            self.stats.sessions_created += 1
+
+            if not self._atexit_registered:
+                atexit.register(self.close)
+                self._atexit_registered = True
+        for stale_loop, stale_session in stale:
+            self._discard_session(stale_loop, stale_session)
+        return session
+
+    @staticmethod
+    def _discard_session(loop: asyncio.AbstractEventLoop, session: aiohttp.ClientSession) -> None:
+        '''Close a session of another loop without waiting for it.'''
+        if session.closed:
+            return
+        if not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(lambda: loop.create_task(session.close()))
+                return
+            except RuntimeError:
+                # Closed in the meantime
+                pass
+        # The session cannot be awaited in a closed loop. Closing the connector drops its connections and marks the session as closed.
+        try:
+            session.connector._close()
+        except Exception as e:
+            print(f'ComfyScript: Failed to close session: {e}')
+
+    @contextlib.asynccontextmanager
+    async def pooled_session(self) -> AsyncIterator[aiohttp.ClientSession]:
+        '''
+        Get the long-lived session of the current event loop. The session is kept open after exiting the context, so that connections can be reused by later requests.
+
+        If `pool` is `False`, a new session is created and closed instead.
+
+        Example:
+        ```
+        async with client.client.pooled_session() as session:
+            async with session.get(f'{client.client.base_url}object_info') as response:
+                ...
+        ```
+        '''
+        if not self._pool:
+            async with self.session() as session:
+                yield session
+            return
+        yield self._get_pooled_session()
+
+    async def _close(self) -> None:
+        '''Close the pooled session of the current event loop.'''
+        loop = asyncio.get_running_loop()
+        with self._sessions_lock:
+            session = self._sessions.pop(loop, None)
+        if session is not None:
+            await session.close()
+
+    def close(self) -> None:
+        '''Close all pooled sessions. The client can still be used after closing, new sessions will be created on demand.'''
+        with self._sessions_lock:
+            sessions = list(self._sessions.items())
+            self._sessions.clear()
+
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        for loop, session in sessions:
+            if session.closed:
+                continue
+            if loop.is_closed():
+                self._discard_session(loop, session)
+                continue
+            try:
+                if loop.is_running() and loop is not running_loop:
+                    # e.g. the watch thread
+                    asyncio.run_coroutine_threadsafe(session.close(), loop).result(timeout=5)
+                else:
+                    loop.run_until_complete(session.close())
+            except Exception as e:
+                print(f'ComfyScript: Failed to close session: {e}')
+
+    async def _get_object_info(self, node_class: str | None = None) -> dict:
+        '''
+        - `node_class`: Only get the info of this node.
+        '''
+        async with self.pooled_session() as session:
+            # http://127.0.0.1:8188/object_info
+            url = f'{self.base_url}object_info'
+            if node_class is not None:
+                url += f'/{urllib.parse.quote(node_class, safe="")}'
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return await response.json()
+                else:
+                    raise Exception(f'ComfyScript: Failed to get nodes info: {await response_to_str(response)}')
+
+    async def _get_node_set(self, refresh: bool = False) -> NodeSet:
+        if self.node_set is None or refresh:
+            self.node_set = NodeSet(await self._get_object_info())
+        return self.node_set
+
+    def get_node_set(self, refresh: bool = False) -> NodeSet:
+        '''
+        Get the node set of the server, which is fetched once and then kept in `node_set`.
+
+        - `refresh`: Fetch the node set again, e.g. after the server is restarted.
+        '''
+        return event_loop_thread.run(self._get_node_set(refresh))
+
+    async def _check_prompt(self, prompt: dict) -> list[Incompatibility]:
+        node_set = await self._get_node_set()
+        incompatibilities = node_set.check_prompt(prompt)
+
+        # Enum values (e.g. uploaded images of `LoadImage`) may have changed since the node set was fetched
+        stale = { i.class_type for i in incompatibilities if i.input is not None and node_set._should_refresh(i.class_type) }
+        if stale:
+            for class_type in stale:
+                node_set.update(await self._get_object_info(class_type))
+            incompatibilities = node_set.check_prompt(prompt)
+        return incompatibilities
+
+    def check_prompt(self, prompt: dict) -> list[Incompatibility]:
+        '''
+        Check an API-format prompt against the node set of the server, without posting it. An empty list is returned if the prompt is compatible.
+
+        Only node types and values of enum inputs are checked. See `compat.NodeSet.check_prompt()`.
+        '''
+        return event_loop_thread.run(self._check_prompt(prompt))
+
+class EventLoopThread:
+    '''
+    A long-lived event loop running in a daemon thread.
+
+    Synchronous APIs (e.g. `queue.put()`, `task.wait()`) run their async counterparts on this loop by `run()`, instead of running a new loop for each call. The thread is started on first use.
+    '''
+
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                # Allow `asyncio.run()` in callbacks running on the loop
+                nest_asyncio2.apply(loop)
+                started = threading.Event()
+                def run_forever():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(started.set)
+                    loop.run_forever()
+                self._thread = threading.Thread(target=run_forever, name='ComfyScript event loop', daemon=True)
+                self._thread.start()
+                started.wait()
+                self._loop = loop
+            return self._loop
+
+    def run(self, coro: Coroutine[Any, Any, T], loop: asyncio.AbstractEventLoop | None = None) -> T:
+        '''
+        Run `coro` on the loop and wait for the result.
+
+        - `loop`: Only run on this loop if it is the long-lived loop, e.g. to wait for a `Task` created on other loops. Otherwise, `coro` is run by `asyncio.run()`.
+        '''
+        if loop is None:
+            loop = self.loop
+        if loop is not self._loop or threading.current_thread() is self._thread:
+            # Waiting in the loop's own thread would deadlock
+            return asyncio.run(coro)
+
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        try:
+            return future.result()
+        except BaseException:
+            # e.g. KeyboardInterrupt
+            future.cancel()
+            raise
+
+event_loop_thread = EventLoopThread()
+'''The global event loop used by synchronous APIs.'''
+
+@dataclass
+class ClientStats:
+    sessions_created: int = 0
+    connections_opened: int = 0
+    '''Number of new connections (TCP connect and TLS handshake).'''
+    connections_reused: int = 0
+    '''Number of requests served by keep-alive connections.'''
+
+    def __str__(self) -> str:
+        return f'Sessions: {self.sessions_created}, connections opened: {self.connections_opened}, reused: {self.connections_reused}'
+
+class ClientPool:
+    '''
+    Clients of multiple ComfyUI servers. Pass it to `load()` to dispatch prompts queued by `queue.put()` to the least loaded server.
+
+    The first client is the primary client, which is used to load nodes.
+
+    Example:
+    ```
+    load(ClientPool(['http://127.0.0.1:8188/', 'http://127.0.0.1:8189/']))
+    ```
+    '''
+
+    def __init__(self, clients: Iterable[Client | str | URL], *, check_prompts: bool = True):
+        '''
+        - `check_prompts`: Only dispatch a prompt to servers whose node sets are compatible with it, i.e. have all its node types and enum values. Servers with the same `NodeSet.fingerprint` are only checked once. See `Client.check_prompt()`.
+        '''
+        self.clients: list[Client] = [c if isinstance(c, Client) else Client(c) for c in clients]
+        if not self.clients:
+            raise ValueError('ComfyScript: ClientPool requires at least one client')
+        self.check_prompts = check_prompts
+        self.queue_remaining: dict[Client, int] = { c: 0 for c in self.clients }
+        '''The number of remaining prompts on each server, reported by the websocket of the server.'''
+        self._dispatched: dict[Client, int] = { c: 0 for c in self.clients }
+        '''Prompts dispatched since the last report of `queue_remaining`.'''
+        self._lock = threading.Lock()
+
+    @property
+    def primary(self) -> Client:
+        return self.clients[0]
+
+    def load(self, c: Client) -> int:
+        '''The estimated number of remaining prompts on the server.'''
+        return self.queue_remaining[c] + self._dispatched[c]
+
+    def least_loaded(self, clients: Iterable[Client] | None = None, *, reserve: bool = False) -> Client:
+        '''
+        - `clients`: Only choose from these clients. All clients by default.
+        - `reserve`: Count a prompt as dispatched to the chosen client, so that concurrent callers see its load before the prompt is posted. Use `_cancel_dispatched()` if the prompt fails to be posted.
+
+        Ties are broken by the order of the clients.
+        '''
+        with self._lock:
+            c = min(clients if clients is not None else self.clients, key=self.load)
+            if reserve:
+                self._dispatched[c] += 1
+            return c
+
+    async def _get_compatible_clients(self, prompt: dict) -> tuple[list[Client], list[Incompatibility]]:
+        '''Return the compatible clients, and the incompatibilities of the first incompatible client.'''
+        # Fetch missing node sets concurrently
+        await asyncio.gather(*(c._get_node_set() for c in self.clients if c.node_set is None), return_exceptions=True)
+
+        compatible = []
+        first_incompatibilities = []
+        checked: dict[str, list[Incompatibility]] = {}
+        for c in self.clients:
+            if c.node_set is None:
+                # Let the server validate the prompt
+                compatible.append(c)
+                continue
+            incompatibilities = checked.get(c.node_set.fingerprint)
+            if incompatibilities is None:
+                incompatibilities = await c._check_prompt(prompt)
+                checked[c.node_set.fingerprint] = incompatibilities
+            if not incompatibilities:
+                compatible.append(c)
+            elif not first_incompatibilities:
+                first_incompatibilities = incompatibilities
+        return compatible, first_incompatibilities
+
+    def _set_dispatched(self, c: Client) -> None:
+        with self._lock:
+            self._dispatched[c] += 1
+
+    def _cancel_dispatched(self, c: Client) -> None:
+        with self._lock:
+            # May have been reset by `_set_queue_remaining()`
+            if self._dispatched[c] > 0:
+                self._dispatched[c] -= 1
+
+    def _set_queue_remaining(self, c: Client, queue_remaining: int) -> None:
+        with self._lock:
+            self.queue_remaining[c] = queue_remaining
+            self._dispatched[c] = 0
+
+    def close(self) -> None:
+        for c in self.clients:
+            c.close()
+
 client: Client = Client()
 '''The global client object.'''
 
@@ -65,8 +405,11 @@ async def response_to_str(response: aiohttp.ClientResponse) -> str:
         msg = str(e)
     return f'{response}{msg}'
 
-async def _get_nodes_info() -> dict:
+async def _get_nodes_info(*, cache: bool = False, refresh: bool = False) -> dict:
     '''
+    - `cache`: Use the on-disk snapshot of the nodes info if available, and revalidate it in the background. See `cache.NodesInfoCache` for details. No effect with standalone runtime.
+    - `refresh`: Ignore the snapshot and download the nodes info from the server. The snapshot will still be updated if `cache` is `True`.
+
     When used with standalone runtime:
     - The result may contain tuples intead of lists.
     '''
@@ -106,20 +449,21 @@ async def _get_nodes_info() -> dict:
                 traceback.print_exc()
         return out
 
-    async with client.session() as session:
-        # http://127.0.0.1:8188/object_info
-        async with session.get(f'{client.base_url}object_info') as response:
-            if response.status == 200:
-                return await response.json()
-            else:
-                raise Exception(f'ComfyScript: Failed to get nodes info: {await response_to_str(response)}')
+    if cache:
+        from .cache import nodes_info_cache
+        return await nodes_info_cache.get(client, refresh)
+
+    return await client._get_object_info()
 
-def get_nodes_info() -> dict:
+def get_nodes_info(*, cache: bool = False, refresh: bool = False) -> dict:
     '''
+    - `cache`: Use the on-disk snapshot of the nodes info if available, and revalidate it in the background. See `cache.NodesInfoCache` for details. No effect with standalone runtime.
+    - `refresh`: Ignore the snapshot and download the nodes info from the server. The snapshot will still be updated if `cache` is `True`.
+
     When used with standalone runtime:
     - The result may contain tuples intead of lists.
     '''
-    return asyncio.run(_get_nodes_info())
+    return event_loop_thread.run(_get_nodes_info(cache=cache, refresh=refresh))
 
 async def _get_embeddings() -> list[str]:
     folder_paths = sys.modules.get('folder_paths')
@@ -127,7 +471,7 @@ async def _get_embeddings() -> list[str]:
         embeddings = folder_paths.get_filename_list("embeddings")
         return list(map(lambda a: os.path.splitext(a)[0], embeddings))
     
-    async with client.session() as session:
+    async with client.pooled_session() as session:
         # http://127.0.0.1:8188/embeddings
         async with session.get(f'{client.base_url}embeddings') as response:
             if response.status == 200:
@@ -136,7 +480,7 @@ async def _get_embeddings() -> list[str]:
                 raise Exception(f'ComfyScript: Failed to get embeddings: {await response_to_str(response)}')
 
 def get_embeddings() -> list[str]:
-    return asyncio.run(_get_embeddings())
+    return event_loop_thread.run(_get_embeddings())
 
 class WorkflowJSONEncoder(json.JSONEncoder):
     def default(self, o):
@@ -149,6 +493,8 @@ class BinaryEventTypes(IntEnum):
     PREVIEW_IMAGE = 1
     UNENCODED_PREVIEW_IMAGE = 2
     '''Only used internally in ComfyUI.'''
+    COMFY_SCRIPT_IMAGE = 0x43530001
+    '''Sent by `ComfyScriptSendImage` node. See `comfy_script.nodes.image`.'''
 
 @dataclass
 class BinaryEvent:
@@ -167,9 +513,11 @@ class BinaryEvent:
         data = data[4:]
         return BinaryEvent(type, data)
     
-    def to_object(self) -> Image.Image | bytes:
+    def to_object(self) -> Image.Image | _SentImage | BinaryEvent:
         if self.type == BinaryEventTypes.PREVIEW_IMAGE:
             return _PreviewImage.from_bytes(self.data).image
+        elif self.type == BinaryEventTypes.COMFY_SCRIPT_IMAGE:
+            return _SentImage.from_bytes(self.data)
         return self
 
 class _PreviewImageFormat(IntEnum):
@@ -196,9 +544,39 @@ class _PreviewImage:
 
         return _PreviewImage(format, image)
 
+@dataclass
+class _SentImage:
+    prompt_id: str
+    node: str
+    index: int
+    image: Image.Image
+
+    _MODES = {1: 'L', 3: 'RGB', 4: 'RGBA'}
+
+    @staticmethod
+    def from_bytes(data: bytes) -> _SentImage:
+        # See comfy_script.nodes.image.ComfyScriptSendImage
+        header_len = struct.unpack('>I', data[:4])[0]
+        header = json.loads(data[4:4 + header_len])
+        payload = data[4 + header_len:]
+        if header['format'] == 'raw':
+            image = Image.frombytes(_SentImage._MODES[header['channels']], (header['width'], header['height']), payload)
+        else:
+            image = Image.open(BytesIO(payload))
+            image.load()
+        return _SentImage(header['prompt_id'], header['node'], header['index'], image)
+
+from . import cache
+from . import compat
+from .compat import NodeSet, Incompatibility
+
 __all__ = [
     'client',
     'Client',
+    'ClientStats',
+    'ClientPool',
+    'EventLoopThread',
+    'event_loop_thread',
     '_get_nodes_info',
     'get_nodes_info',
     '_get_embeddings',
@@ -0,0 +1,189 @@
+'''On-disk caches of server data, e.g. `/object_info`.'''
+from __future__ import annotations
+from dataclasses import dataclass
+import hashlib
+import json
+import os
+from pathlib import Path
+import sys
+import threading
+
+import asyncio
+
+def cache_dir() -> Path:
+    '''
+    The directory to store caches.
+
+    `COMFY_SCRIPT_CACHE_DIR` if set, otherwise `comfy_script` in the user cache directory (`%LOCALAPPDATA%` on Windows, `$XDG_CACHE_HOME` or `~/.cache` on others).
+    '''
+    dir = os.environ.get('COMFY_SCRIPT_CACHE_DIR')
+    if dir:
+        return Path(dir)
+    if sys.platform == 'win32' and os.environ.get('LOCALAPPDATA'):
+        return Path(os.environ['LOCALAPPDATA']) / 'comfy_script' / 'Cache'
+    xdg = os.environ.get('XDG_CACHE_HOME')
+    if xdg:
+        return Path(xdg) / 'comfy_script'
+    return Path.home() / '.cache' / 'comfy_script'
+
+def _hash(data: bytes | str) -> str:
+    if isinstance(data, str):
+        data = data.encode('utf8')
+    return hashlib.sha256(data).hexdigest()
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+@dataclass
+class NodesInfoSnapshot:
+    nodes_info: dict
+    hash: str
+    '''SHA-256 of the raw `/object_info` response.'''
+    node_set_hash: str
+    '''SHA-256 of the sorted node names.'''
+    etag: str | None
+    size: int
+    '''Size of the raw response in bytes.'''
+
+    @staticmethod
+    def from_bytes(raw: bytes, etag: str | None = None) -> NodesInfoSnapshot:
+        nodes_info = json.loads(raw)
+        return NodesInfoSnapshot(
+            nodes_info=nodes_info,
+            hash=_hash(raw),
+            node_set_hash=_hash('\n'.join(sorted(nodes_info))),
+            etag=etag,
+            size=len(raw),
+        )
+
+@dataclass
+class NodesInfoCacheStats:
+    hits: int = 0
+    misses: int = 0
+    bytes_saved: int = 0
+    '''Bytes not downloaded because the server confirmed the snapshot with `304 Not Modified`. Servers without `ETag` (e.g. ComfyUI) always send the whole nodes info for revalidation, so nothing is saved, but `load()` still does not wait for it.'''
+    unchanged: int = 0
+    '''Background revalidations that found the snapshot up to date.'''
+    changed: int = 0
+    '''Background revalidations that found the nodes info changed on the server.'''
+
+    def __str__(self) -> str:
+        return f'Hits: {self.hits}, misses: {self.misses}, bytes saved: {self.bytes_saved}, revalidated: {self.unchanged} unchanged, {self.changed} changed'
+
+class NodesInfoCache:
+    '''
+    Persistent cache of `/object_info`, keyed by the base URL of the server.
+
+    A cached snapshot is returned immediately and revalidated in a background thread. If the server returns an `ETag`, revalidation uses `If-None-Match`; otherwise the downloaded content is compared by hash. If the nodes info has changed, the snapshot is updated and will be used by the next `load()`.
+    '''
+
+    def __init__(self, dir: Path | None = None):
+        self._dir = dir
+        self.stats = NodesInfoCacheStats()
+        self.last_snapshot: NodesInfoSnapshot | None = None
+        '''The snapshot returned by the last `get()`.'''
+
+    def _paths(self, base_url: str) -> tuple[Path, Path]:
+        dir = self._dir if self._dir is not None else cache_dir()
+        key = _hash(base_url)[:16]
+        return dir / f'object_info-{key}.json', dir / f'object_info-{key}.meta.json'
+
+    def load(self, base_url: str) -> NodesInfoSnapshot | None:
+        path, meta_path = self._paths(base_url)
+        try:
+            meta = json.loads(meta_path.read_bytes())
+            raw = path.read_bytes()
+            if meta.get('base_url') != base_url or _hash(raw) != meta.get('hash'):
+                return None
+            return NodesInfoSnapshot.from_bytes(raw, meta.get('etag'))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f'ComfyScript: Failed to load nodes info cache: {e}')
+            return None
+
+    def save(self, base_url: str, raw: bytes, etag: str | None = None) -> NodesInfoSnapshot:
+        snapshot = NodesInfoSnapshot.from_bytes(raw, etag)
+        path, meta_path = self._paths(base_url)
+        try:
+            _write_atomic(path, raw)
+            _write_atomic(meta_path, json.dumps({
+                'base_url': base_url,
+                'hash': snapshot.hash,
+                'node_set_hash': snapshot.node_set_hash,
+                'etag': etag,
+                'size': snapshot.size,
+            }, indent=2).encode('utf8'))
+        except Exception as e:
+            print(f'ComfyScript: Failed to save nodes info cache: {e}')
+        return snapshot
+
+    @staticmethod
+    async def _fetch(c: Client, snapshot: NodesInfoSnapshot | None = None) -> tuple[bytes | None, str | None]:
+        '''Return `(None, etag)` if the snapshot is not modified.'''
+        headers = {}
+        if snapshot is not None and snapshot.etag is not None:
+            headers['If-None-Match'] = snapshot.etag
+        async with c.pooled_session() as session:
+            # http://127.0.0.1:8188/object_info
+            async with session.get(f'{c.base_url}object_info', headers=headers) as response:
+                if response.status == 304:
+                    return None, snapshot.etag
+                elif response.status == 200:
+                    return await response.read(), response.headers.get('ETag')
+                else:
+                    raise Exception(f'ComfyScript: Failed to get nodes info: {await response_to_str(response)}')
+
+    async def _revalidate(self, c: Client, snapshot: NodesInfoSnapshot) -> None:
+        try:
+            raw, etag = await self._fetch(c, snapshot)
+            if raw is None or _hash(raw) == snapshot.hash:
+                if raw is None:
+                    self.stats.bytes_saved += snapshot.size
+                self.stats.unchanged += 1
+                if raw is not None and etag != snapshot.etag:
+                    self.save(c.base_url, raw, etag)
+                return
+            self.stats.changed += 1
+            new_snapshot = self.save(c.base_url, raw, etag)
+            if new_snapshot.node_set_hash != snapshot.node_set_hash:
+                added = len(new_snapshot.nodes_info.keys() - snapshot.nodes_info.keys())
+                removed = len(snapshot.nodes_info.keys() - new_snapshot.nodes_info.keys())
+                print(f'ComfyScript: Nodes on the server have changed ({added} added, {removed} removed), call `load()` again to use them')
+            else:
+                print(f'ComfyScript: Nodes info on the server has changed, call `load()` again to use it')
+        except Exception as e:
+            print(f'ComfyScript: Failed to revalidate nodes info cache: {e}')
+        finally:
+            await c._close()
+
+    async def get(self, c: Client, refresh: bool = False) -> dict:
+        '''
+        - `refresh`: Ignore the snapshot and download the nodes info from the server.
+        '''
+        snapshot = None if refresh else self.load(c.base_url)
+        if snapshot is not None:
+            self.stats.hits += 1
+            threading.Thread(target=asyncio.run, args=(self._revalidate(c, snapshot),), daemon=True).start()
+        else:
+            self.stats.misses += 1
+            raw, etag = await self._fetch(c)
+            snapshot = self.save(c.base_url, raw, etag)
+        self.last_snapshot = snapshot
+        return snapshot.nodes_info
+
+nodes_info_cache = NodesInfoCache()
+'''The global nodes info cache.'''
+
+from . import Client, response_to_str
+
+__all__ = [
+    'cache_dir',
+    'NodesInfoSnapshot',
+    'NodesInfoCacheStats',
+    'NodesInfoCache',
+    'nodes_info_cache',
+]
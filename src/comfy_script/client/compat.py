@@ -0,0 +1,169 @@
+'''Compatibility of API-format prompts with the node sets of servers.'''
+from __future__ import annotations
+from dataclasses import dataclass
+import hashlib
+import inspect
+from pathlib import PurePath
+import time
+from typing import Any, Iterator
+
+@dataclass
+class Incompatibility:
+    node_id: str
+    class_type: str
+    input: str | None = None
+    '''`None` if the node does not exist on the server.'''
+    value: Any = None
+
+    @property
+    def message(self) -> str:
+        if self.input is None:
+            return f'Node {self.class_type} does not exist'
+        return f'{self.value!r} is not a valid value of {self.class_type}.{self.input}'
+
+    def __str__(self) -> str:
+        return f'{self.node_id}: {self.message}'
+
+def _get_custom_validated(info: dict) -> frozenset[str] | None:
+    '''
+    Standalone runtime: Inputs validated by the node itself (`VALIDATE_INPUTS`) are not validated by ComfyUI.
+
+    `None` if all inputs are validated by the node.
+    '''
+    validate_inputs = getattr(info.get('_cls'), 'VALIDATE_INPUTS', None)
+    if validate_inputs is None:
+        return frozenset()
+    spec = inspect.getfullargspec(validate_inputs)
+    if spec.varkw is not None:
+        return None
+    return frozenset(spec.args)
+
+def _iter_input_specs(info: dict) -> Iterator[tuple[str, str, Any, dict]]:
+    '''Yield `(group, name, type_info, config)` of each input. `type_info` is `None` if the spec is malformed.'''
+    inputs = info.get('input') or {}
+    for group in ('required', 'optional'):
+        for name, spec in (inputs.get(group) or {}).items():
+            if not isinstance(spec, (list, tuple)) or not spec:
+                yield group, name, None, {}
+                continue
+            config = spec[1] if len(spec) > 1 and isinstance(spec[1], dict) else {}
+            yield group, name, spec[0], config
+
+def _get_enum(type_info: Any, config: dict) -> frozenset | None:
+    '''`None` if the input is not an enum or its values are unhashable.'''
+    # Standalone runtime: Some nodes may use tuple for enum values
+    if isinstance(type_info, (list, tuple)):
+        options = type_info
+    # v3 schema
+    elif type_info == 'COMBO' and 'options' in config:
+        options = config['options']
+    else:
+        return None
+    try:
+        return frozenset(options)
+    except TypeError:
+        return None
+
+def _in_enum(value: Any, enum: frozenset) -> bool:
+    # Paths are serialized as str
+    if isinstance(value, PurePath):
+        value = str(value)
+    try:
+        return value in enum
+    except TypeError:
+        return False
+
+def _get_enums(info: dict) -> dict[str, frozenset]:
+    enums = {}
+    custom_validated = _get_custom_validated(info)
+    if custom_validated is None:
+        return enums
+    for _group, name, type_info, config in _iter_input_specs(info):
+        if name in custom_validated:
+            continue
+        enum = _get_enum(type_info, config)
+        if enum is not None:
+            enums[name] = enum
+    return enums
+
+class NodeSet:
+    '''
+    The node set of a server compiled from its `/object_info`, i.e. node types and the values of their enum inputs.
+
+    Only the parts needed by `check_prompt()` are kept, which is much smaller than the nodes info.
+    '''
+
+    refresh_interval: float = 10
+    '''The minimum interval in seconds between refreshes of a node type by `Client._check_prompt()`.'''
+
+    def __init__(self, nodes_info: dict):
+        self._enums: dict[str, dict[str, frozenset]] = {}
+        self._refreshed: dict[str, float] = {}
+        self.fingerprint = ''
+        '''A compact hash of the node set. Servers with the same fingerprint accept the same prompts, as far as `check_prompt()` is concerned.'''
+        self.update(nodes_info)
+
+    def update(self, nodes_info: dict) -> None:
+        '''Add or replace node types, e.g. with the response of `/object_info/{node_class}`.'''
+        for class_type, info in nodes_info.items():
+            self._enums[class_type] = _get_enums(info)
+        self.fingerprint = self._fingerprint()
+
+    def _fingerprint(self) -> str:
+        h = hashlib.sha256()
+        for class_type in sorted(self._enums):
+            h.update(class_type.encode('utf8'))
+            h.update(b'\0')
+            enums = self._enums[class_type]
+            for input in sorted(enums):
+                h.update(input.encode('utf8'))
+                h.update(b'\1')
+                h.update('\1'.join(sorted(map(repr, enums[input]))).encode('utf8'))
+                h.update(b'\2')
+        return h.hexdigest()[:16]
+
+    def __contains__(self, class_type: str) -> bool:
+        return class_type in self._enums
+
+    def __len__(self) -> int:
+        return len(self._enums)
+
+    def check_prompt(self, prompt: dict) -> list[Incompatibility]:
+        '''
+        Check that all node types of an API-format prompt exist, and values of enum inputs are valid. Other inputs are not checked.
+        '''
+        incompatibilities = []
+        enums = self._enums
+        for node_id, node in prompt.items():
+            class_type = node['class_type']
+            node_enums = enums.get(class_type)
+            if node_enums is None:
+                incompatibilities.append(Incompatibility(node_id, class_type))
+                continue
+            if not node_enums:
+                continue
+            inputs = node.get('inputs', {})
+            for input, values in node_enums.items():
+                value = inputs.get(input, _missing)
+                # Links
+                if value is _missing or isinstance(value, list):
+                    continue
+                if not _in_enum(value, values):
+                    incompatibilities.append(Incompatibility(node_id, class_type, input, value))
+        return incompatibilities
+
+    def _should_refresh(self, class_type: str) -> bool:
+        '''Enum values like `LoadImage.image` can change after the node set is fetched.'''
+        now = time.monotonic()
+        last = self._refreshed.get(class_type)
+        if last is not None and now - last < self.refresh_interval:
+            return False
+        self._refreshed[class_type] = now
+        return True
+
+_missing = object()
+
+__all__ = [
+    'Incompatibility',
+    'NodeSet',
+]
@@ -4,8 +4,14 @@ __all__ = ['NODE_CLASS_MAPPINGS', 'NODE_DISPLAY_NAME_MAPPINGS']
 
 success = True
 
-NODE_CLASS_MAPPINGS = {}
-NODE_DISPLAY_NAME_MAPPINGS = {}
+from .image import ComfyScriptSendImage
+
+NODE_CLASS_MAPPINGS = {
+    'ComfyScriptSendImage': ComfyScriptSendImage,
+}
+NODE_DISPLAY_NAME_MAPPINGS = {
+    'ComfyScriptSendImage': 'Send Image (ComfyScript)',
+}
 
 from pathlib import Path
 
@@ -0,0 +1,65 @@
+import io
+import json
+import struct
+
+SEND_IMAGE_EVENT = 0x43530001
+'''See `comfy_script.client.BinaryEventTypes.COMFY_SCRIPT_IMAGE`. `comfy_script.client` is not imported here to avoid patching asyncio in the server.'''
+
+class ComfyScriptSendImage:
+    '''
+    Send images to the client over the websocket, without saving them to the output/temp directory.
+
+    Each image is sent as a binary event: a big-endian `uint32` header length, a JSON header (`prompt_id`, `node`, `index`, `format`, `width`, `height`, `channels`) and the image data, which is either `uint8` pixels in HWC order (`raw`) or PNG with the lowest compression level (`png`).
+    '''
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            'required': {
+                'images': ('IMAGE',),
+                'format': (['raw', 'png'],),
+            },
+            'hidden': {
+                'unique_id': 'UNIQUE_ID',
+            },
+        }
+
+    RETURN_TYPES = ()
+    FUNCTION = 'send_images'
+    OUTPUT_NODE = True
+    CATEGORY = 'ComfyScript'
+
+    @classmethod
+    def IS_CHANGED(s, images, format='raw', unique_id=None):
+        # Images are sent as a side effect, so the node must be executed even if its cached output could be used
+        return float('nan')
+
+    def send_images(self, images, format='raw', unique_id=None):
+        import numpy as np
+        from server import PromptServer
+
+        server = PromptServer.instance
+        results = []
+        for i, image in enumerate(images):
+            array = np.clip(255. * image.cpu().numpy(), 0, 255).astype(np.uint8)
+            height, width, channels = array.shape
+            if format == 'png':
+                from PIL import Image
+
+                f = io.BytesIO()
+                Image.fromarray(array[..., 0] if channels == 1 else array).save(f, 'PNG', compress_level=1)
+                payload = f.getvalue()
+            else:
+                payload = array.tobytes()
+            header = json.dumps({
+                'prompt_id': server.last_prompt_id,
+                'node': unique_id,
+                'index': i,
+                'format': format,
+                'width': width,
+                'height': height,
+                'channels': channels,
+            }).encode('utf8')
+            server.send_sync(SEND_IMAGE_EVENT, struct.pack('>I', len(header)) + header + payload, server.client_id)
+            results.append({'index': i, 'width': width, 'height': height})
+        return {'ui': {'comfy_script_images': results}}
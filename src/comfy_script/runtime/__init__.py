@@ -1,28 +1,38 @@
 from __future__ import annotations
+from collections import OrderedDict
+import concurrent.futures
 import inspect
 import json
 from pathlib import Path
 import sys
 import threading
+import time
 import traceback
-from typing import Callable, Iterable
+from typing import Any, AsyncIterator, Callable, Iterable, Iterator, Literal, TypeVar
 import uuid
 from warnings import warn
 import dataclasses
+from functools import partial
 
 import asyncio
 import nest_asyncio2
 import aiohttp
 from PIL import Image
 
+# Used by `queue`
+from . import events
+from . import scheduling
+
 nest_asyncio2.apply()
 
+T = TypeVar('T')
+
 _client_id = str(uuid.uuid4())
 _save_script_source = True
 
-def load(comfyui: str | Client | Path = None, args: ComfyUIArgs | None = None, vars: dict | None = None, watch: bool = True, save_script_source: bool = True):
+def load(comfyui: str | Client | ClientPool | Path = None, args: ComfyUIArgs | None = None, vars: dict | None = None, watch: bool = True, save_script_source: bool = True, *, cache: bool = False, refresh: bool = False, lazy: bool = False):
     '''
-    - `comfyui`: The base URL of the ComfyUI server API, or a `Client` object, or a path to the ComfyUI directory, or `'comfyui'` to use the [`comfyui` package](https://github.com/comfyanonymous/ComfyUI/pull/298).
+    - `comfyui`: The base URL of the ComfyUI server API, or a `Client` object, or a `ClientPool` object to use multiple servers, or a path to the ComfyUI directory, or `'comfyui'` to use the [`comfyui` package](https://github.com/comfyanonymous/ComfyUI/pull/298).
 
       If not specified, the following ones will be tried in order:
       1. Local server API: http://127.0.0.1:8188/
@@ -30,18 +40,32 @@ def load(comfyui: str | Client | Path = None, args: ComfyUIArgs | None = None, v
       3. `comfyui` package
     
     - `args`: CLI arguments to be passed to ComfyUI, if the value of `comfyui` is not an API. See `ComfyUIArgs` for details.
+
+    - `cache`: Load the nodes info from the on-disk snapshot of the last `load()` and revalidate it in the background. See `client.cache.NodesInfoCache` for details.
+
+      The loaded nodes and type stubs are also cached, keyed by the hash of the nodes info, so a warm `load()` does not need to generate them again.
+
+    - `refresh`: Download the nodes info from the server even if `cache` is enabled.
+
+    - `lazy`: Create each node and its enums on first access, instead of creating all nodes when loading. Nodes are not imported by `from comfy_script.runtime.nodes import *` or put into `vars` until accessed, so they should be imported explicitly (e.g. `from comfy_script.runtime.nodes import CheckpointLoaderSimple, KSampler`) or accessed by `node.get()`.
     '''
-    asyncio.run(_load(comfyui, args, vars, watch, save_script_source))
+    client.event_loop_thread.run(_load(comfyui, args, vars, watch, save_script_source, cache=cache, refresh=refresh, lazy=lazy))
 
-async def _load(comfyui: str | Client | Path = None, args: ComfyUIArgs | None = None, vars: dict | None = None, watch: bool = True, save_script_source: bool = True):
+async def _load(comfyui: str | Client | ClientPool | Path = None, args: ComfyUIArgs | None = None, vars: dict | None = None, watch: bool = True, save_script_source: bool = True, *, cache: bool = False, refresh: bool = False, lazy: bool = False):
     global _save_script_source, queue
 
     _save_script_source = save_script_source
 
+    if not isinstance(comfyui, client.ClientPool):
+        queue.pool = None
+
     nodes_info = None
     if comfyui is None:
         try:
-            nodes_info = await client._get_nodes_info()
+            if cache:
+                # A snapshot doesn't mean the server is available
+                await client._get_embeddings()
+            nodes_info = await client._get_nodes_info(cache=cache, refresh=refresh)
             if comfyui_base_url != client.client.base_url:
                 print(f'ComfyScript: Using ComfyUI from {client.client.base_url}')
         except Exception as e:
@@ -53,15 +77,31 @@ async def _load(comfyui: str | Client | Path = None, args: ComfyUIArgs | None =
         client.client = client.Client(comfyui)
     elif isinstance(comfyui, client.Client):
         client.client = comfyui
+    elif isinstance(comfyui, client.ClientPool):
+        client.client = comfyui.primary
+        queue.pool = comfyui
+        # Servers may have been restarted with other nodes
+        for c in comfyui.clients:
+            c.node_set = None
     else:
         start_comfyui(comfyui, args)
     
     if nodes_info is None:
-        nodes_info = await client._get_nodes_info()
+        nodes_info = await client._get_nodes_info(cache=cache, refresh=refresh)
     print(f'Nodes: {len(nodes_info)}')
+    queue.validator = validation.PromptValidator(nodes_info)
+    queue._output_node_types = frozenset(name for name, info in nodes_info.items() if info.get('output_node'))
+    if queue.pool is not None and queue.pool.check_prompts and queue.pool.primary is client.client:
+        client.client.node_set = client.NodeSet(nodes_info)
+
+    nodes_info_hash = None
+    if cache:
+        snapshot = client.cache.nodes_info_cache.last_snapshot
+        if snapshot is not None and snapshot.nodes_info is nodes_info:
+            nodes_info_hash = snapshot.hash
 
     node.nodes.clear()
-    await nodes.load(nodes_info, vars, nodes=node.nodes)
+    await nodes.load(nodes_info, vars, nodes=node.nodes, nodes_info_hash=nodes_info_hash, lazy=lazy)
     
     # TODO: Stop watch if watch turns to False
     if watch:
@@ -409,20 +449,179 @@ def join_comfyui():
     while prompt_queue.get_tasks_remaining() != 0:
         time.sleep(0.1)
 
+@dataclasses.dataclass
+class _WatchState:
+    loop: asyncio.AbstractEventLoop
+    lock: asyncio.Lock
+    '''Messages are handled in order, including replayed ones.'''
+    executing: bool = False
+    progress_data: dict | None = None
+    pbar: Any = None
+
+    def update_pbar(self, value: int, max: int) -> None:
+        from tqdm.auto import tqdm
+
+        # TODO: Move to callback
+        # TODO: Node
+        if value == 1:
+            if self.pbar is not None:
+                self.pbar.close()
+            self.pbar = tqdm(initial=value, total=max)
+        else:
+            # value may not start with 1
+            # e.g. start watch in the middle, CivitAICheckpointLoader
+            if self.pbar is None:
+                self.pbar = tqdm(initial=value, total=max)
+            self.pbar.update(value - self.pbar.n)
+            if value == max:
+                self.pbar.close()
+                self.pbar = None
+
 class TaskQueue:
+    _task_message_types = frozenset(('execution_start', 'execution_cached', 'executing', 'executed', 'execution_error', 'execution_interrupted'))
+    _max_early_prompts = 256
+    _max_early_messages = 100
+
     def __init__(self):
         self._tasks = {}
-        self._watch_thread = None
+        self._watch_future: concurrent.futures.Future | None = None
         self._queue_empty_callback = None
         self._queue_remaining_callbacks = [self._when_empty_callback]
         self._watch_display_node = False
         self._watch_display_node_preview = False
         self._watch_display_task = False
+        self._history_tasks: set[asyncio.Task] = set()
         self.queue_remaining = 0
-
-    async def _get_history(self, prompt_id: str) -> dict | None:
-        async with client.client.session() as session:
-            async with session.get(f'{client.client.base_url}history/{prompt_id}') as response:
+        '''The total number of remaining prompts on the watched servers.'''
+        self._server_queue_remaining: dict[client.Client, int] = {}
+        self.pool: client.ClientPool | None = None
+        '''If set, prompts are dispatched to the least loaded server of the pool. Set by `load()`.'''
+        self._subscriptions = events.EventSubscriptions()
+        self._tasks_lock = threading.Lock()
+        self._early_messages: OrderedDict[str, list[dict]] = OrderedDict()
+        '''Messages of prompts whose tasks are not registered yet.'''
+        self._watch_states: dict[client.Client, _WatchState] = {}
+        self.validator: validation.PromptValidator | None = None
+        '''Created from the nodes info by `load()`.'''
+        self._output_node_types: frozenset[str] = frozenset()
+        '''Set by `load()`.'''
+        self.validate_prompts = False
+        '''Validate prompts by `validator` before posting them. Invalid prompts raise `QueueError` without a request to the server.
+
+        Inputs of nodes with custom validation (`VALIDATE_INPUTS`) are only known with the standalone runtime. With the client runtime, such inputs (e.g. uploaded images of `LoadImage`) may be rejected by mistake, so validation is disabled by default.'''
+        self.max_in_flight: int | None = None
+        '''If set, `put()` waits (blocks, or awaits with `_put()`) while the number of prompts in flight (`in_flight`) reaches it, so that a producer cannot flood the servers' queues.
+
+        Requires the queue to be watched (`start_watch()`), since `queue_remaining` is updated by the watcher. Otherwise, it is ignored.'''
+        self.low_watermark: int | None = None
+        '''Once `max_in_flight` is reached, `put()` waits until the number of prompts in flight falls to this number, so that prompts are posted in bursts instead of one by one. `max_in_flight - 1` by default.'''
+        self._in_flight_lock = threading.Lock()
+        self._posting = 0
+        self._dispatched: dict[client.Client, int] = {}
+        '''Prompts posted since the last `status` message of each server, which may not be counted in `queue_remaining` yet.'''
+        self._throttled = False
+        self.scheduler = scheduling.Scheduler()
+        '''Decides which prompt is posted next when `max_in_flight` is reached, by the job classes and tenants passed to `put()`.'''
+        self.batcher: batching.Batcher | None = None
+        '''If set, `put_many()` merges prompts that only differ in batchable inputs (e.g. seeds) into one prompt, and splits the results back to the task of each workflow. See `batching.Batcher`.'''
+
+    def _clients(self) -> list[client.Client]:
+        return self.pool.clients if self.pool is not None else [client.client]
+
+    def _update_queue_remaining(self, c: client.Client, queue_remaining: int) -> bool:
+        '''Return whether the total `queue_remaining` is changed.'''
+        with self._in_flight_lock:
+            self._server_queue_remaining[c] = queue_remaining
+            self._dispatched.pop(c, None)
+            if self.pool is not None and c in self.pool.queue_remaining:
+                self.pool._set_queue_remaining(c, queue_remaining)
+            total = sum(self._server_queue_remaining.values())
+            changed = total != self.queue_remaining
+            self.queue_remaining = total
+            granted = self._grant_in_flight()
+        for pending in granted:
+            events._wake((pending.loop, pending.future))
+        return changed
+
+    @property
+    def in_flight(self) -> int:
+        '''The number of prompts in flight: `queue_remaining`, plus prompts being posted or posted since the last `status` message of their servers.'''
+        return self.queue_remaining + self._posting + sum(self._dispatched.values())
+
+    def _can_post(self) -> bool:
+        '''Must be called with `_in_flight_lock`.'''
+        max_in_flight = self.max_in_flight
+        if max_in_flight is None or not self._watch_states:
+            return True
+        in_flight = self.in_flight
+        if self._throttled:
+            low_watermark = self.low_watermark if self.low_watermark is not None else max_in_flight - 1
+            if in_flight > low_watermark:
+                return False
+            self._throttled = False
+        return in_flight < max_in_flight
+
+    def _set_throttled(self) -> None:
+        if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+            self._throttled = True
+
+    def _grant_in_flight(self) -> list[scheduling._Pending]:
+        '''Grant slots to pending prompts in the order of `scheduler`. Must be called with `_in_flight_lock`.'''
+        granted = []
+        while len(self.scheduler) and self._can_post():
+            granted.append(self.scheduler._pop())
+            self._posting += 1
+            self._set_throttled()
+        return granted
+
+    async def _acquire_in_flight(self, job_class: str = 'default', tenant: str | None = None) -> None:
+        '''Wait until a prompt can be posted without exceeding `max_in_flight`.'''
+        with self._in_flight_lock:
+            can_post = self._can_post()
+            # Do not overtake pending prompts
+            if can_post and not len(self.scheduler):
+                self._posting += 1
+                self._set_throttled()
+                return
+            if not can_post:
+                self._throttled = True
+            loop = asyncio.get_running_loop()
+            pending = scheduling._Pending(job_class, tenant, loop, loop.create_future())
+            self.scheduler._push(pending)
+            granted = self._grant_in_flight()
+        for other in granted:
+            events._wake((other.loop, other.future))
+        try:
+            await pending.future
+        except asyncio.CancelledError:
+            granted = []
+            with self._in_flight_lock:
+                if not self.scheduler._remove(pending):
+                    # Granted after being cancelled
+                    self._posting -= 1
+                    granted = self._grant_in_flight()
+            for other in granted:
+                events._wake((other.loop, other.future))
+            raise
+
+    def _release_in_flight(self, c: client.Client | None) -> None:
+        '''
+        - `c`: The server the prompt is posted to. `None` if the prompt failed to be posted.
+        '''
+        with self._in_flight_lock:
+            self._posting -= 1
+            # `queue_remaining` of unwatched servers is not tracked
+            if c is not None and c in self._watch_states:
+                self._dispatched[c] = self._dispatched.get(c, 0) + 1
+            granted = self._grant_in_flight()
+        for pending in granted:
+            events._wake((pending.loop, pending.future))
+
+    async def _get_history(self, prompt_id: str, c: client.Client | None = None) -> dict | None:
+        if c is None:
+            c = client.client
+        async with c.pooled_session() as session:
+            async with session.get(f'{c.base_url}history/{prompt_id}') as response:
                 if response.status == 200:
                     json = await response.json()
                     # print(json)
@@ -430,106 +629,218 @@ class TaskQueue:
                 else:
                     print(f'ComfyScript: Failed to get history: {await client.response_to_str(response)}')
 
-    async def _watch(self):
-        from tqdm.auto import tqdm
-        pbar = None
+    async def _set_results_from_history(self, task: Task) -> None:
+        outputs = {}
+        try:
+            history = await self._get_history(task.prompt_id, task.client)
+            if history is not None:
+                outputs = history['outputs']
+        except Exception as e:
+            print(f'ComfyScript: Failed to get history: {e}')
+        await task._set_results_threadsafe(outputs, self._watch_display_task)
+        if self._watch_display_task:
+            print(f'Queue remaining: {self.queue_remaining}')
+
+    async def _finish_task(self, task: Task) -> None:
+        if task._has_all_outputs():
+            # Outputs have been assembled from `executed` messages
+            await task._set_results_threadsafe({}, self._watch_display_task)
+            if self._watch_display_task:
+                print(f'Queue remaining: {self.queue_remaining}')
+        else:
+            # Do not block messages of other tasks
+            history_task = asyncio.create_task(self._set_results_from_history(task))
+            self._history_tasks.add(history_task)
+            history_task.add_done_callback(self._history_tasks.discard)
+
+    def _register_task(self, task: Task) -> None:
+        with self._tasks_lock:
+            self._tasks[task.prompt_id] = task
+            early = task.prompt_id in self._early_messages
+        if early:
+            # Messages received before the response of `/prompt`, e.g. of prompts whose outputs are all cached
+            state = self._watch_states.get(task.client)
+            if state is not None and not state.loop.is_closed():
+                asyncio.run_coroutine_threadsafe(self._replay_early_messages(task.client, state, task.prompt_id), state.loop)
+
+    def _get_task(self, prompt_id: str | None, msg: dict | None) -> tuple[Task | None, list[dict] | None]:
+        '''
+        Return the task and its early messages to be replayed before `msg`.
+
+        - `msg`: If the task is unknown, buffer the message in case the task is being registered.
+        '''
+        if prompt_id is None:
+            return None, None
+        with self._tasks_lock:
+            task = self._tasks.get(prompt_id)
+            if task is not None:
+                return task, self._early_messages.pop(prompt_id, None)
+            if msg is not None:
+                early = self._early_messages.get(prompt_id)
+                if early is None:
+                    early = self._early_messages[prompt_id] = []
+                    if len(self._early_messages) > self._max_early_prompts:
+                        # Most likely messages of finished tasks
+                        self._early_messages.popitem(last=False)
+                if len(early) < self._max_early_messages:
+                    early.append(msg)
+            return None, None
+
+    async def _replay_early_messages(self, c: client.Client, state: _WatchState, prompt_id: str) -> None:
+        async with state.lock:
+            task, early = self._get_task(prompt_id, None)
+            for msg in early or ():
+                await self._handle_task_message(c, task, msg)
+
+    async def _handle_task_message(self, c: client.Client, task: Task, msg: dict) -> None:
+        '''Handle a message of a task known by this queue.'''
+        type = msg['type']
+        data = msg['data']
+        if type == 'execution_start':
+            task.status = 'running'
+        elif type == 'execution_cached':
+            task.cached_nodes = data['nodes']
+        elif type == 'executing':
+            if data['node'] is None:
+                with self._tasks_lock:
+                    self._tasks.pop(task.prompt_id, None)
+                task.status = 'success'
+                await self._finish_task(task)
+        elif type in ('execution_error', 'execution_interrupted'):
+            # Followed by `executing` with `node: None` on recent servers, but old servers and custom executors may not send it
+            with self._tasks_lock:
+                self._tasks.pop(task.prompt_id, None)
+            if type == 'execution_error':
+                await task._set_error_threadsafe(ExecutionError(task, data))
+            else:
+                task.status = 'interrupted'
+                await self._finish_task(task)
+        elif type == 'executed':
+            output = task._attach_sent_images(data['node'], data['output'])
+            await task._set_result_threadsafe(data['node'], output, self._watch_display_node)
+            if self._watch_display_node:
+                print(f'Queue remaining: {self.queue_remaining}')
+        elif type == 'progress':
+            task._set_node_progress(TaskProgress(task=task, node_id=data.get('node'), value=data['value'], max=data['max'], _display=True))
+        elif type == 'comfy_script_image':
+            # Not a server message, see `_handle_binary()`
+            task._sent_images.setdefault(data.node, {})[data.index] = data.image
+
+    async def _handle_message(self, c: client.Client, state: _WatchState, msg: dict) -> None:
+        type = msg['type']
+        data = msg.get('data')
+        prompt_id = data.get('prompt_id') if isinstance(data, dict) else None
+        task, early = self._get_task(prompt_id, msg if type in self._task_message_types else None)
+        for early_msg in early or ():
+            await self._handle_task_message(c, task, early_msg)
+        event_task = task
+
+        if type == 'status':
+            queue_remaining = data['status']['exec_info']['queue_remaining']
+            if self._update_queue_remaining(c, queue_remaining):
+                if not state.executing:
+                    for callback in self._queue_remaining_callbacks:
+                        callback(self.queue_remaining)
+                print(f'Queue remaining: {self.queue_remaining}')
+        elif type == 'execution_start':
+            state.executing = True
+        elif type == 'executing' and data['node'] is None:
+            if task is not None:
+                await self._handle_task_message(c, task, msg)
+                event_task, task = task, None
+
+            if self._server_queue_remaining[c] == 0:
+                with self._tasks_lock:
+                    unexecuted_tasks = [t for t in self._tasks.values() if t.client is c]
+                    for unexecuted_task in unexecuted_tasks:
+                        del self._tasks[unexecuted_task.prompt_id]
+                for unexecuted_task in unexecuted_tasks:
+                    print(f'ComfyScript: The queue is empty but {unexecuted_task} has not been executed')
+                    unexecuted_task.status = 'cancelled'
+                    await unexecuted_task._set_results_threadsafe({})
+
+            for callback in self._queue_remaining_callbacks:
+                callback(self.queue_remaining)
+            state.executing = False
+        elif type == 'progress':
+            # See ComfyUI::main.hijack_progress
+            # 'prompt_id', 'node': https://github.com/comfyanonymous/ComfyUI/issues/2425
+            state.progress_data = data
+            if prompt_id is None:
+                warn(f'Cannot get progress node, please update the ComfyUI server to at least 66831eb6e96cd974fb2d0fc4f299b23c6af16685 (2024-01-02)')
+            state.update_pbar(data['value'], data['max'])
+
+        # None if queued by other clients
+        if task is not None:
+            await self._handle_task_message(c, task, msg)
+
+        if self._subscriptions:
+            node = data.get('node', data.get('node_id')) if isinstance(data, dict) else None
+            await self._subscriptions.publish(c, type, data, prompt_id, node, event_task)
+
+    async def _handle_binary(self, c: client.Client, state: _WatchState, msg_data: bytes) -> None:
+        event = client.BinaryEvent.from_bytes(msg_data)
+        if event.type == client.BinaryEventTypes.COMFY_SCRIPT_IMAGE:
+            sent = event.to_object()
+            msg = {'type': 'comfy_script_image', 'data': sent}
+            task, early = self._get_task(sent.prompt_id, msg)
+            for early_msg in early or ():
+                await self._handle_task_message(c, task, early_msg)
+            if task is not None:
+                await self._handle_task_message(c, task, msg)
+        elif event.type == client.BinaryEventTypes.PREVIEW_IMAGE:
+            progress_data = state.progress_data or {}
+            prompt_id = progress_data.get('prompt_id')
+            preview = event.to_object()
+            task, _ = self._get_task(prompt_id, None)
+            if prompt_id is None:
+                warn(f'Cannot get preview node, please update the ComfyUI server to at least 66831eb6e96cd974fb2d0fc4f299b23c6af16685 (2024-01-02)')
+            elif task is not None:
+                task._set_node_preview(progress_data['node'], preview, self._watch_display_node_preview)
+            if self._subscriptions:
+                await self._subscriptions.publish(c, 'preview', preview, prompt_id, progress_data.get('node'), task)
+
+    async def _watch(self, c: client.Client | None = None):
+        '''
+        - `c`: The client of the server to watch. `client.client` by default.
 
+        Messages are routed to their tasks by `prompt_id`. Messages of a prompt received before its task is registered (i.e. before the response of `/prompt`) are buffered and replayed on registration.
+        '''
+        state = _WatchState(asyncio.get_running_loop(), asyncio.Lock())
+        try:
+            await self._watch_forever(c, state)
+        finally:
+            # Cancelled
+            self._unwatch(state)
+
+    def _unwatch(self, state: _WatchState) -> None:
+        '''Forget the servers watched with `state`, whose `queue_remaining` will not be updated anymore.'''
+        with self._in_flight_lock:
+            for c in [c for c, s in self._watch_states.items() if s is state]:
+                del self._watch_states[c]
+                self._server_queue_remaining.pop(c, None)
+                self._dispatched.pop(c, None)
+            self.queue_remaining = sum(self._server_queue_remaining.values())
+
+    async def _watch_forever(self, c: client.Client | None, state: _WatchState):
         while True:
             try:
-                async with client.client.session() as session:
-                    async with session.ws_connect(f'{client.client.base_url}ws', params={'clientId': _client_id}) as ws:
-                        self.queue_remaining = 0
-                        executing = False
-                        progress_data = None
+                watch_client = c if c is not None else client.client
+                self._watch_states[watch_client] = state
+                async with watch_client.pooled_session() as session:
+                    async with session.ws_connect(f'{watch_client.base_url}ws', params={'clientId': _client_id}, max_msg_size=0) as ws:
+                        self._update_queue_remaining(watch_client, 0)
+                        state.executing = False
+                        state.progress_data = None
                         async for msg in ws:
                             # print(msg.type)
                             if msg.type == aiohttp.WSMsgType.TEXT:
-                                msg = msg.json()
-                                # print(msg)
-                                if msg['type'] == 'status':
-                                    data = msg['data']
-                                    queue_remaining = data['status']['exec_info']['queue_remaining']
-                                    if self.queue_remaining != queue_remaining:
-                                        self.queue_remaining = queue_remaining
-                                        if not executing:
-                                            for callback in self._queue_remaining_callbacks:
-                                                callback(self.queue_remaining)
-                                        print(f'Queue remaining: {self.queue_remaining}')
-                                elif msg['type'] == 'execution_start':
-                                    executing = True
-                                elif msg['type'] == 'executing':
-                                    data = msg['data']
-                                    if data['node'] is None:
-                                        prompt_id = data['prompt_id']
-                                        task: Task = self._tasks.get(prompt_id)
-                                        if task is not None:
-                                            del self._tasks[prompt_id]
-
-                                        if self.queue_remaining == 0:
-                                            for task in self._tasks.values():
-                                                print(f'ComfyScript: The queue is empty but {task} has not been executed')
-                                                await task._set_results_threadsafe({})
-                                            self._tasks.clear()
-                                        
-                                        for callback in self._queue_remaining_callbacks:
-                                            callback(self.queue_remaining)
-                                        executing = False
-
-                                        history = await self._get_history(prompt_id)
-                                        outputs = {}
-                                        if history is not None:
-                                            outputs = history['outputs']
-                                        await task._set_results_threadsafe(outputs, self._watch_display_task)
-                                        if self._watch_display_task:
-                                            print(f'Queue remaining: {self.queue_remaining}')
-                                elif msg['type'] == 'executed':
-                                    data = msg['data']
-                                    prompt_id = data['prompt_id']
-                                    task: Task = self._tasks.get(prompt_id)
-                                    if task is not None:
-                                        await task._set_result_threadsafe(data['node'], data['output'], self._watch_display_node)
-                                        if self._watch_display_node:
-                                            print(f'Queue remaining: {self.queue_remaining}')
-                                elif msg['type'] == 'progress':
-                                    # See ComfyUI::main.hijack_progress
-                                    # 'prompt_id', 'node': https://github.com/comfyanonymous/ComfyUI/issues/2425
-                                    progress_data = msg['data']
-
-                                    value = progress_data['value']
-                                    max = progress_data['max']
-
-                                    prompt_id = progress_data.get('prompt_id')
-                                    node = progress_data.get('node')
-                                    if prompt_id is not None:
-                                        task: Task = self._tasks.get(prompt_id)
-                                        task._set_node_progress(TaskProgress(task=task, node_id=node, value=value, max=max, _display=True))
-                                    else:
-                                        warn(f'Cannot get progress node, please update the ComfyUI server to at least 66831eb6e96cd974fb2d0fc4f299b23c6af16685 (2024-01-02)')
-
-                                    # TODO: Move to callback
-                                    # TODO: Node
-                                    if value == 1:
-                                        if pbar is not None:
-                                            pbar.close()
-                                        pbar = tqdm(initial=value, total=max)
-                                    else:
-                                        # value may not start with 1
-                                        # e.g. start watch in the middle, CivitAICheckpointLoader
-                                        if pbar is None:
-                                            pbar = tqdm(initial=value, total=max)
-                                        pbar.update(value - pbar.n)
-                                        if value == max:
-                                            pbar.close()
-                                            pbar = None
+                                # print(msg.data)
+                                async with state.lock:
+                                    await self._handle_message(watch_client, state, msg.json())
                             elif msg.type == aiohttp.WSMsgType.BINARY:
-                                event = client.BinaryEvent.from_bytes(msg.data)
-                                if event.type == client.BinaryEventTypes.PREVIEW_IMAGE:
-                                    prompt_id = progress_data.get('prompt_id')
-                                    if prompt_id is not None:
-                                        task: Task = self._tasks.get(prompt_id)
-                                        task._set_node_preview(progress_data['node'], event.to_object(), self._watch_display_node_preview)
-                                    else:
-                                        warn(f'Cannot get preview node, please update the ComfyUI server to at least 66831eb6e96cd974fb2d0fc4f299b23c6af16685 (2024-01-02)')
+                                async with state.lock:
+                                    await self._handle_binary(watch_client, state, msg.data)
                             elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
                                 break
             except Exception as e:
@@ -583,9 +894,38 @@ class TaskQueue:
             except ImportError:
                 print('ComfyScript: IPython is not available, cannot display task results')
 
-        if self._watch_thread is None:
-            self._watch_thread = threading.Thread(target=asyncio.run, args=(queue._watch(),), daemon=True)
-            self._watch_thread.start()
+        if self._watch_future is None:
+            # Watch on the loop of the synchronous APIs, so that messages are handled on the loop of their tasks
+            if self.pool is None:
+                self._watch_future = asyncio.run_coroutine_threadsafe(self._watch(), client.event_loop_thread.loop)
+            else:
+                async def watch_all():
+                    await asyncio.gather(*[self._watch(c) for c in self.pool.clients])
+                self._watch_future = asyncio.run_coroutine_threadsafe(watch_all(), client.event_loop_thread.loop)
+
+    def subscribe(self, types: Iterable[str] | None = None, *, tasks: Iterable[Task] | None = None, maxsize: int = 1000, overflow: events.Overflow = 'drop_oldest') -> events.EventSubscription:
+        '''
+        Subscribe to events of the watched servers. See `events.Event` for event types.
+
+        - `types`: Only receive events of these types. All events by default.
+        - `tasks`: Only receive events of these tasks. Events of all prompts (including ones queued by other clients) and events without prompts (e.g. `'status'`) by default.
+        - `maxsize`: The maximum number of buffered events.
+        - `overflow`: What to do if the buffer is full:
+          - `'drop_oldest'`: Drop the oldest buffered event. Suitable for dashboards.
+          - `'drop_newest'`: Drop the new event.
+          - `'block'`: Stop reading the websocket until there is space. No events are lost, but a slow subscriber delays all tasks.
+
+        The watch thread must be started, which `load()` does by default.
+
+        Example:
+        ```
+        async with queue.subscribe(['progress', 'executed']) as events:
+            async for event in events:
+                print(event.type, event.task, event.node)
+        ```
+        '''
+        prompt_ids = [task.prompt_id for task in tasks] if tasks is not None else None
+        return self._subscriptions.subscribe(types, prompt_ids=prompt_ids, maxsize=maxsize, overflow=overflow)
 
     def add_queue_remaining_callback(self, callback: Callable[[int], None]):
         self.remove_queue_remaining_callback(callback)
@@ -615,22 +955,72 @@ class TaskQueue:
         if task is not None:
             self._watch_display_task = task
 
-    async def _put(self, workflow: data.NodeOutput | Iterable[data.NodeOutput] | Workflow, source = None) -> Task | None:
-        global _client_id
-        
+    @staticmethod
+    def _get_prompt_and_id(workflow: data.NodeOutput | Iterable[data.NodeOutput] | Workflow) -> (dict, data.IdManager):
         if isinstance(workflow, data.NodeOutput) or isinstance(workflow, Iterable):
-            prompt, id = Workflow(outputs=workflow)._get_prompt_and_id()
+            return Workflow(outputs=workflow)._get_prompt_and_id()
         elif isinstance(workflow, Workflow):
-            prompt, id = workflow._get_prompt_and_id()
+            return workflow._get_prompt_and_id()
         else:
             raise TypeError(f'ComfyScript: Invalid workflow type: {workflow}')
-        # print(prompt)
 
-        # Empty prompt (no output nodes)
-        if not prompt:
-            return None
+    async def _choose_client(self, prompt: dict) -> client.Client:
+        '''
+        Raise `QueueError` if no server in the pool is compatible with the prompt.
 
-        async with client.client.session() as session:
+        The chosen server of the pool is reserved, so that concurrent posts see its load. `pool._cancel_dispatched()` must be called if the prompt fails to be posted.
+        '''
+        if self.pool is None:
+            return client.client
+        if not self.pool.check_prompts:
+            return self.pool.least_loaded(reserve=True)
+
+        clients, incompatibilities = await self.pool._get_compatible_clients(prompt)
+        if not clients:
+            raise QueueError.from_incompatibilities(incompatibilities)
+        return self.pool.least_loaded(clients, reserve=True)
+
+    async def _post_prompt(self, prompt: dict, id: data.IdManager, source = None, *, job_class: str = 'default', tenant: str | None = None) -> Task:
+        '''Raise `QueueError` if the prompt is invalid or the server rejects it.'''
+        self.scheduler._check_class(job_class)
+        if self.validate_prompts and self.validator is not None:
+            errors = self.validator.validate(prompt)
+            if errors:
+                raise QueueError.from_prompt_errors('prompt_outputs_failed_validation', 'Prompt outputs failed validation', errors)
+        submitted = time.monotonic()
+        await self._acquire_in_flight(job_class, tenant)
+        stats = self.scheduler._get_stats(job_class)
+        stats._add_wait(time.monotonic() - submitted)
+        posted = None
+        try:
+            c = await self._choose_client(prompt)
+            try:
+                task = await self._post_prompt_to(c, prompt, id, source)
+            except BaseException:
+                if self.pool is not None:
+                    self.pool._cancel_dispatched(c)
+                raise
+            posted = c
+        finally:
+            self._release_in_flight(posted)
+        task.job_class = job_class
+        task.tenant = tenant
+        task._latency = (stats, submitted)
+        task._output_ids = self._get_output_ids(prompt)
+        self._register_task(task)
+        return task
+
+    def _get_output_ids(self, prompt: dict) -> frozenset[str]:
+        '''Ids of the output nodes of a prompt: nodes of output node types, and nodes not linked by other nodes.'''
+        linked = set()
+        for node in prompt.values():
+            for value in node.get('inputs', {}).values():
+                if isinstance(value, list) and len(value) == 2 and isinstance(value[1], int) and value[0] in prompt:
+                    linked.add(value[0])
+        return frozenset(node_id for node_id, node in prompt.items() if node_id not in linked or node['class_type'] in self._output_node_types)
+
+    async def _post_prompt_to(self, c: client.Client, prompt: dict, id: data.IdManager, source = None) -> Task:
+        async with c.pooled_session() as session:
             extra_data = {}
             if _save_script_source:
                 extra_data = {
@@ -638,7 +1028,7 @@ class TaskQueue:
                         'ComfyScriptSource': source
                     }
                 }
-            async with session.post(f'{client.client.base_url}prompt', json={
+            async with session.post(f'{c.base_url}prompt', json={
                 'prompt': prompt,
                 'extra_data': extra_data,
                 'client_id': _client_id,
@@ -646,18 +1036,259 @@ class TaskQueue:
                 if response.status == 200:
                     response = await response.json()
                     # print(response)
-                    task = Task(response['prompt_id'], response['number'], id)
-                    self._tasks[task.prompt_id] = task
-                    return task
+                    return Task(response['prompt_id'], response['number'], id, c)
                 else:
-                    print(f'ComfyScript: Failed to queue prompt: {response}{await client.response_to_str(response)}')
+                    raise await QueueError.from_response(response)
+
+    async def _put(self, workflow: data.NodeOutput | Iterable[data.NodeOutput] | Workflow, source = None, *, job_class: str = 'default', tenant: str | None = None) -> Task | None:
+        prompt, id = self._get_prompt_and_id(workflow)
+        # print(prompt)
+
+        # Empty prompt (no output nodes)
+        if not prompt:
+            return None
+
+        try:
+            return await self._post_prompt(prompt, id, source, job_class=job_class, tenant=tenant)
+        except QueueError as e:
+            print(f'ComfyScript: Failed to queue prompt: {e}')
     
-    def put(self, workflow: data.NodeOutput | Iterable[data.NodeOutput] | Workflow, source = None) -> Task | None:
+    def put(self, workflow: data.NodeOutput | Iterable[data.NodeOutput] | Workflow, source = None, *, job_class: str = 'default', tenant: str | None = None) -> Task | None:
+        '''
+        - `job_class`: One of `scheduler.classes`, e.g. `'interactive'` or `'batch'`. Prompts of higher priority classes are posted first when `max_in_flight` is reached.
+        - `tenant`: Prompts of different tenants in the same job class are posted in turns.
+        '''
+        if source is None:
+            outer = inspect.currentframe().f_back
+            source = ''.join(inspect.findsource(outer)[0])
+        return client.event_loop_thread.run(self._put(workflow, source, job_class=job_class, tenant=tenant))
+
+    async def _put_many(
+        self,
+        workflows: Iterable[data.NodeOutput | Iterable[data.NodeOutput] | Workflow],
+        source = None,
+        *,
+        concurrency: int = 8,
+        return_exceptions: bool = True,
+        job_class: str = 'default',
+        tenant: str | None = None,
+    ) -> list[Task | None | Exception]:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def put(workflow) -> Task | None:
+            async with semaphore:
+                prompt, id = self._get_prompt_and_id(workflow)
+                if not prompt:
+                    return None
+                return await self._post_prompt(prompt, id, source, job_class=job_class, tenant=tenant)
+        
+        if self.batcher is None:
+            return await asyncio.gather(*[put(workflow) for workflow in workflows], return_exceptions=return_exceptions)
+
+        results: list[Task | None | Exception] = []
+        prompts: list[tuple[int, dict, data.IdManager]] = []
+        for workflow in workflows:
+            results.append(None)
+            try:
+                prompt, id = self._get_prompt_and_id(workflow)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results[-1] = e
+                continue
+            if prompt:
+                prompts.append((len(results) - 1, prompt, id))
+
+        async def put_batch(group: list[tuple[int, dict, data.IdManager]]) -> None:
+            async with semaphore:
+                try:
+                    if len(group) == 1:
+                        _, prompt, id = group[0]
+                        tasks = [await self._post_prompt(prompt, id, source, job_class=job_class, tenant=tenant)]
+                    else:
+                        tasks = await self._post_batch(self.batcher.merge([prompt for _, prompt, _ in group]), [id for _, _, id in group], source, job_class=job_class, tenant=tenant)
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    tasks = [e] * len(group)
+            for (i, _, _), task in zip(group, tasks):
+                results[i] = task
+
+        groups = self.batcher.group([prompt for _, prompt, _ in prompts])
+        await asyncio.gather(*[put_batch([prompts[i] for i in group]) for group in groups])
+        return results
+
+    async def _post_batch(self, batch: batching.Batch, ids: list[data.IdManager], source = None, *, job_class: str = 'default', tenant: str | None = None) -> list[Task]:
+        '''Post a merged prompt, and return a task for each of the prompts, which is resolved with its part of the outputs.'''
+        merged = await self._post_prompt(batch.prompt, ids[0], source, job_class=job_class, tenant=tenant)
+        tasks = []
+        for id in ids:
+            task = Task(merged.prompt_id, merged.number, id, merged.client)
+            task.job_class = job_class
+            task.tenant = tenant
+            tasks.append(task)
+
+        # Outputs of `executed` messages received before are set here, later ones by the merged task
+        with merged._lock:
+            merged._batch = (batch, tasks)
+            outputs = dict(merged._new_outputs)
+            latency = None
+            if not merged._resolved:
+                # Counted by the tasks of the prompts instead
+                latency, merged._latency = merged._latency, None
+        for task in tasks:
+            task._latency = latency
+        if outputs:
+            await Task._set_batch_results(merged._batch, outputs)
+
+        def resolve(merged: Task) -> None:
+            for i, task in enumerate(tasks):
+                id_map = batch.id_maps[i]
+                error = None
+                if merged.error is not None:
+                    error = ExecutionError(task, merged.error.data | {'node_id': id_map.get(merged.error.node_id, merged.error.node_id)})
+                with task._lock:
+                    task._new_outputs = batch.split(merged._new_outputs, i)
+                task.cached_nodes = [id_map[node_id] for node_id in merged.cached_nodes if node_id in id_map]
+                task.status = merged.status
+                task.error = error
+                task._resolve(error)
+        merged._add_resolve_callback(resolve)
+        return tasks
+
+    def put_many(
+        self,
+        workflows: Iterable[data.NodeOutput | Iterable[data.NodeOutput] | Workflow],
+        concurrency: int = 8,
+        *,
+        return_exceptions: bool = True,
+        source = None,
+        job_class: str = 'default',
+        tenant: str | None = None,
+    ) -> list[Task | None | Exception]:
+        '''
+        Put multiple workflows into the queue, with at most `concurrency` prompts being built and posted at the same time.
+
+        Returns a list with the same order as `workflows`. Each item is:
+        - `Task` if the workflow is queued.
+        - `None` if the workflow is empty (no output nodes).
+        - The exception (e.g. `QueueError`) if `return_exceptions` is `True` and the workflow failed to queue. Otherwise, the first exception will be raised.
+
+        Note that prompts are posted concurrently, so the execution order on the server may differ from the list order. Use `Task.number` for the actual order.
+
+        If `batcher` is set, workflows merged into one prompt share the same `Task.prompt_id` and `Task.number`, and their tasks are only resolved when the merged prompt is finished.
+
+        `job_class` and `tenant` are the same as `put()`. Prompts held locally by `scheduler` also count towards `concurrency`.
+
+        Example:
+        ```
+        tasks = queue.put_many(
+            [SaveImage(VAEDecode(KSampler(model, seed, ...), vae)) for seed in range(100)],
+            concurrency=16
+        )
+        for task in tasks:
+            if isinstance(task, Exception):
+                print(task)
+        ```
+        '''
         if source is None:
             outer = inspect.currentframe().f_back
             source = ''.join(inspect.findsource(outer)[0])
-        return asyncio.run(self._put(workflow, source))
+        return client.event_loop_thread.run(self._put_many(workflows, source, concurrency=concurrency, return_exceptions=return_exceptions, job_class=job_class, tenant=tenant))
     
+    async def _gather(self, tasks: Iterable[Task | None | Exception], *, return_exceptions: bool = False) -> list[list[data.Result] | None | BaseException]:
+        async def wait(task):
+            if isinstance(task, Task):
+                return await task._wait()
+            if isinstance(task, BaseException):
+                raise task
+            return task
+        return await asyncio.gather(*[wait(task) for task in tasks], return_exceptions=return_exceptions)
+
+    def gather(self, tasks: Iterable[Task | None | Exception], *, return_exceptions: bool = False) -> list[list[data.Result] | None | BaseException]:
+        '''
+        Wait for all tasks and return their results in the same order as `tasks`.
+
+        - `return_exceptions`: Return exceptions (e.g. `ExecutionError`) as results instead of raising the first one.
+
+        `None` and exceptions returned by `put_many()` can be passed directly, and are returned (or raised) as is.
+        '''
+        return client.event_loop_thread.run(self._gather(tasks, return_exceptions=return_exceptions))
+
+    async def _as_completed(self, tasks: Iterable[Task | None | Exception]) -> AsyncIterator[Task]:
+        futures = { task._future(): task for task in tasks if isinstance(task, Task) }
+        pending = set(futures)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for fut in done:
+                yield futures[fut]
+
+    def as_completed(self, tasks: Iterable[Task | None | Exception]) -> Iterator[Task]:
+        '''
+        Yield tasks as they finish, instead of waiting them in order. `task.wait()` then returns the results (or raises `ExecutionError`) immediately.
+
+        Items that are not tasks (e.g. `None` and exceptions returned by `put_many()`) are ignored.
+
+        Example:
+        ```
+        tasks = queue.put_many(workflows)
+        for task in queue.as_completed(tasks):
+            print(task, task.status)
+        ```
+        '''
+        return _iterate_sync(self._as_completed(tasks))
+
+    async def _stream(self, tasks: Iterable[Task | None | Exception], *, return_exceptions: bool = False) -> AsyncIterator[tuple[Task, str, data.Result | ExecutionError]]:
+        tasks = [task for task in tasks if isinstance(task, Task)]
+        loop = asyncio.get_running_loop()
+        # Tasks that may have new outputs
+        ready: asyncio.Queue[Task] = asyncio.Queue()
+        for task in tasks:
+            ready.put_nowait(task)
+        yielded = { task: set() for task in tasks }
+        remaining = set(tasks)
+
+        while remaining:
+            task = await ready.get()
+            if task not in remaining:
+                continue
+            with task._lock:
+                outputs = [(node_id, output) for node_id, output in task._new_outputs.items() if node_id not in yielded[task]]
+                resolved = task._resolved
+                if not outputs and not resolved:
+                    fut = loop.create_future()
+                    fut.add_done_callback(lambda _, task=task: ready.put_nowait(task))
+                    task._output_waiters.append((loop, fut))
+            for node_id, output in outputs:
+                yielded[task].add(node_id)
+                yield task, node_id, data.Result.from_output(output, task.client)
+            if outputs:
+                ready.put_nowait(task)
+            elif resolved:
+                remaining.discard(task)
+                if task.error is not None:
+                    if not return_exceptions:
+                        raise task.error
+                    yield task, task.error.node_id, task.error
+
+    def stream(self, tasks: Iterable[Task | None | Exception], *, return_exceptions: bool = False) -> Iterator[tuple[Task, str, data.Result | ExecutionError]]:
+        '''
+        Yield `(task, node_id, result)` as each output node of the tasks finishes, for pipelined processing of the outputs.
+
+        - `return_exceptions`: If a task fails, yield `(task, error.node_id, error)` instead of raising the `ExecutionError`. Outputs executed before the error are still yielded.
+
+        Items that are not tasks (e.g. `None` and exceptions returned by `put_many()`) are ignored. Outputs are driven by `executed` messages, and by the history for outputs without messages (e.g. of cached nodes on old servers).
+
+        Example:
+        ```
+        tasks = queue.put_many(SaveImage(image, f'{seed}') for seed in seeds)
+        for task, node_id, result in queue.stream(tasks):
+            if isinstance(result, ImageBatchResult):
+                upload(result.wait(raw=True))
+        ```
+        '''
+        return _iterate_sync(self._stream(tasks, return_exceptions=return_exceptions))
+
     def __iadd__(self, workflow: data.NodeOutput | Iterable[data.NodeOutput] | Workflow):
         outer = inspect.currentframe().f_back
         source = ''.join(inspect.findsource(outer)[0])
@@ -703,14 +1334,14 @@ class TaskQueue:
                 try:
                     result = callback(wf)
                     if result is not False:
-                        asyncio.run(wf._exit(source))
+                        client.event_loop_thread.run(wf._exit(source))
                     else:
                         # Clear the output hook
-                        asyncio.run(wf._exit(source, False))
+                        client.event_loop_thread.run(wf._exit(source, False))
                     return result
                 except Exception as e:
                     # Clear the output hook
-                    asyncio.run(wf._exit(source, e))
+                    client.event_loop_thread.run(wf._exit(source, e))
 
                     msg = 'when_empty callback raised an exception:'
                     warn(msg)
@@ -722,34 +1353,131 @@ class TaskQueue:
 
     def cancel_current(self):
         '''Interrupt the current task'''
-        return asyncio.run(self._cancel_current())
+        return client.event_loop_thread.run(self._cancel_current())
     async def _cancel_current(self):
-        async with client.client.session() as session:
-            async with session.post(f'{client.client.base_url}interrupt', json={
-                'client_id': _client_id,
-            }) as response:
-                if response.status != 200:
-                    print(f'ComfyScript: Failed to interrupt current task: {await client.response_to_str(response)}')
+        for c in self._clients():
+            async with c.pooled_session() as session:
+                async with session.post(f'{c.base_url}interrupt', json={
+                    'client_id': _client_id,
+                }) as response:
+                    if response.status != 200:
+                        print(f'ComfyScript: Failed to interrupt current task: {await client.response_to_str(response)}')
 
     def cancel_remaining(self):
         '''Clear the queue'''
-        return asyncio.run(self._cancel_remaining())
+        return client.event_loop_thread.run(self._cancel_remaining())
     async def _cancel_remaining(self):
-        async with client.client.session() as session:
-            async with session.post(f'{client.client.base_url}queue', json={
-                'clear': True,
-                'client_id': _client_id,
-            }) as response:
-                if response.status != 200:
-                    print(f'ComfyScript: Failed to clear queue: {await client.response_to_str(response)}')
+        for c in self._clients():
+            async with c.pooled_session() as session:
+                async with session.post(f'{c.base_url}queue', json={
+                    'clear': True,
+                    'client_id': _client_id,
+                }) as response:
+                    if response.status != 200:
+                        print(f'ComfyScript: Failed to clear queue: {await client.response_to_str(response)}')
 
     def cancel_all(self):
         '''Interrupt the current task and clear the queue'''
-        return asyncio.run(self._cancel_all())
+        return client.event_loop_thread.run(self._cancel_all())
     async def _cancel_all(self):
         await self._cancel_remaining()
         await self._cancel_current()
 
+class QueueError(Exception):
+    '''The server failed to queue a prompt.'''
+
+    def __init__(self, msg: str, status: int | None = None, error: dict | None = None, node_errors: dict | None = None):
+        super().__init__(msg)
+        self.status = status
+        self.error = error
+        '''e.g. `{'type': 'prompt_outputs_failed_validation', 'message': 'Prompt outputs failed validation', ...}`'''
+        self.node_errors = node_errors
+        '''Validation errors keyed by node id.'''
+
+    @staticmethod
+    async def from_response(response: aiohttp.ClientResponse) -> QueueError:
+        error = None
+        node_errors = None
+        try:
+            json = await response.json()
+            if isinstance(json, dict):
+                error = json.get('error')
+                node_errors = json.get('node_errors')
+        except Exception:
+            pass
+        return QueueError(await client.response_to_str(response), response.status, error, node_errors)
+
+    @staticmethod
+    def from_prompt_errors(type: str, message: str, errors: list[validation.PromptError]) -> QueueError:
+        '''Errors found before posting the prompt, in the format of the server.'''
+        error = {
+            'type': type,
+            'message': message,
+        }
+        node_errors = {}
+        for e in errors:
+            node_errors.setdefault(e.node_id, {
+                'errors': [],
+                'class_type': e.class_type,
+            })['errors'].append({
+                'type': e.type,
+                'message': e.message,
+                'details': e.input or '',
+            })
+        msg = '\n'.join([f'{message}:'] + [f'  {e}' for e in errors])
+        return QueueError(msg, None, error, node_errors)
+
+    @staticmethod
+    def from_incompatibilities(incompatibilities: list[client.Incompatibility]) -> QueueError:
+        '''Errors found by `client.ClientPool(check_prompts=True)` before posting the prompt.'''
+        errors = [
+            validation.PromptError(i.node_id, i.class_type, 'node_not_found' if i.input is None else 'value_not_in_list', i.message, i.input)
+            for i in incompatibilities
+        ]
+        return QueueError.from_prompt_errors('prompt_incompatible', 'No server is compatible with the prompt', errors)
+
+class ExecutionError(Exception):
+    '''The server failed to execute a prompt, from an `execution_error` message.'''
+
+    def __init__(self, task: Task, data: dict):
+        self.task = task
+        self.node_id: str | None = data.get('node_id')
+        self.node_type: str | None = data.get('node_type')
+        self.exception_type: str | None = data.get('exception_type')
+        '''e.g. `'torch.OutOfMemoryError'`'''
+        self.exception_message: str | None = data.get('exception_message')
+        self.traceback: list[str] = data.get('traceback') or []
+        '''The formatted traceback on the server.'''
+        self.executed: list[str] = data.get('executed') or []
+        '''Ids of the nodes executed before the error.'''
+        self.data = data
+        super().__init__(f'{task} failed at {self.node_type} ({self.node_id}): {self.exception_type}: {self.exception_message}')
+
+def _iterate_sync(iterator: AsyncIterator[T]) -> Iterator[T]:
+    '''Iterate an async iterator on `client.event_loop_thread`.'''
+    async def next():
+        return await iterator.__anext__()
+    try:
+        while True:
+            try:
+                yield client.event_loop_thread.run(next())
+            except StopAsyncIteration:
+                return
+    finally:
+        aclose = getattr(iterator, 'aclose', None)
+        if aclose is not None:
+            client.event_loop_thread.run(aclose())
+
+def _set_future(fut: asyncio.Future, outputs: dict, error: ExecutionError | None) -> None:
+    if fut.done():
+        return
+    if error is None:
+        fut.set_result(outputs)
+    else:
+        fut.set_exception(error)
+        # Tasks that are never waited should not log "Future exception was never retrieved"
+        fut.exception()
+
 @dataclasses.dataclass
 class TaskProgress:
     task: Task
@@ -765,16 +1493,45 @@ class TaskProgress:
     _display: bool
 
 class Task:
-    def __init__(self, prompt_id: str, number: int, id: data.IdManager):
+    def __init__(self, prompt_id: str, number: int, id: data.IdManager, c: client.Client | None = None):
         self.prompt_id = prompt_id
         self.number = number
         self._id = id
+        self.client = c if c is not None else client.client
+        '''The client of the server that owns the prompt.'''
+        self.cached_nodes: list[str] = []
+        '''Ids of the nodes that were not executed because their outputs were cached by the server.'''
+        self._output_ids: frozenset[str] | None = None
+        '''Ids of the output nodes of the prompt. `None` if unknown.'''
+        self.status: Literal['queued', 'running', 'success', 'error', 'interrupted', 'cancelled'] = 'queued'
+        '''
+        - `'error'`: Waiting the task raises `ExecutionError`.
+        - `'interrupted'`: The task is resolved with the outputs of the nodes executed before the interruption.
+        - `'cancelled'`: The task was removed from the queue before being executed.
+        '''
+        self.error: ExecutionError | None = None
+        self.job_class: str = 'default'
+        '''See `TaskQueue.put()`.'''
+        self.tenant: str | None = None
+        self._latency: tuple[scheduling.LatencyStats, float] | None = None
+        '''The stats of the job class and the time of `put()`.'''
+        self._sent_images: dict[str, dict[int, Image.Image]] = {}
+        '''Images sent by `ComfyScriptSendImage` nodes, before their `executed` messages.'''
         self._new_outputs: dict[str, dict | None] = {}
-        # TODO: Only create event if there are more than one outputs?
-        self._event = asyncio.Event()
         self._fut = asyncio.Future()
+        '''Resolved in the loop that created the task. Other loops wait on their own futures, see `_future()`.'''
+        self._lock = threading.Lock()
+        self._resolved = False
+        self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        '''Futures of other loops waiting for the task.'''
+        self._output_waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        '''Futures waiting for new outputs.'''
         self._node_progress_callbacks: list[Callable[[TaskProgress], None]] = []
         self._node_preview_callbacks: list[Callable[[Task, str, Image.Image]]] = []
+        self._resolve_callbacks: list[Callable[[Task], None]] = []
+        '''Called in the watch thread after the task is resolved.'''
+        self._batch: tuple[batching.Batch, list[Task]] | None = None
+        '''The batch of a merged prompt and the tasks of its prompts, which receive their parts of the outputs, progress and previews. See `TaskQueue._post_batch()`.'''
 
     def __str__(self):
         return f'Task {self.number} ({self.prompt_id})'
@@ -782,13 +1539,44 @@ class Task:
     def __repr__(self):
         return f'Task(n={self.number}, id={self.prompt_id})'
     
+    def _attach_sent_images(self, node_id: str, output: dict | None) -> dict | None:
+        '''Attach images sent over the websocket to the output of `ComfyScriptSendImage`.'''
+        if not isinstance(output, dict) or 'comfy_script_images' not in output:
+            return output
+        images = self._sent_images.pop(node_id, {})
+        return output | {
+            'comfy_script_images': [image | {'image': images.get(image['index'])} for image in output['comfy_script_images']]
+        }
+
+    def _has_all_outputs(self) -> bool:
+        '''
+        Whether all outputs have been received from `executed` messages.
+
+        Old versions of ComfyUI do not send `executed` messages for cached nodes, and messages may be missed if the task is executed before watching. In such cases outputs have to be fetched from the history.
+        '''
+        if not self._new_outputs:
+            return False
+        # Cached non-output nodes (e.g. loaders) have no outputs
+        output_ids = self._output_ids
+        return all(node_id in self._new_outputs for node_id in self.cached_nodes if output_ids is None or node_id in output_ids)
+
     def _set_node_progress(self, progress: TaskProgress):
         for callback in self._node_progress_callbacks:
             callback(progress)
+        if self._batch is not None:
+            batch, tasks = self._batch
+            for id_map, task in zip(batch.id_maps, tasks):
+                if progress.node_id in id_map:
+                    task._set_node_progress(dataclasses.replace(progress, task=task, node_id=id_map[progress.node_id], _display=False))
 
     def _set_node_preview(self, node_id: str, preview: Image.Image, display: bool):
         for callback in self._node_preview_callbacks:
             callback(self, node_id, preview)
+        if self._batch is not None:
+            batch, tasks = self._batch
+            for id_map, task in zip(batch.id_maps, tasks):
+                if node_id in id_map:
+                    task._set_node_preview(id_map[node_id], preview, False)
         
         if display:
             from IPython.display import display
@@ -797,33 +1585,40 @@ class Task:
     
     async def _set_result_threadsafe(self, node_id: str, output: dict | None, display_result: bool = False) -> None:
         # print('_set_result_threadsafe', node_id, output)
-        self._new_outputs[node_id] = output
-
-        def set_once(event=self._event):
-            event.set()
-            event.clear()
-        self.get_loop().call_soon_threadsafe(set_once)
+        with self._lock:
+            self._new_outputs[node_id] = output
+            waiters, self._output_waiters = self._output_waiters, []
+            batch = self._batch
+        for loop, fut in waiters:
+            events.waker.call_soon(loop, partial(events._set_result, fut))
+        if batch is not None:
+            await self._set_batch_results(batch, {node_id: output})
 
         if display_result:
             from IPython.display import display
 
             display(clear=True)
-            result = data.Result.from_output(output)
+            result = data.Result.from_output(output, self.client)
             if isinstance(result, data.ImageBatchResult):
                 await Images(result)._display()
             else:
                 display(result)
     
+    @staticmethod
+    async def _set_batch_results(batch: tuple[batching.Batch, list[Task]], outputs: dict[str, dict | None]) -> None:
+        batch, tasks = batch
+        for i, task in enumerate(tasks):
+            for node_id, output in batch.split(outputs, i).items():
+                await task._set_result_threadsafe(node_id, output)
+
     async def _set_results_threadsafe(self, outputs: dict[str, dict | None], display_result: bool = False) -> None:
         # print('_set_results_threadsafe', outputs)
         # ComfyUI will skip node outputs None in outputs
-        outputs = self._new_outputs | outputs
-        self._new_outputs = outputs
-
-        def f(self=self):
-            self._fut.set_result(self._new_outputs)
-            self._event.set()
-        self.get_loop().call_soon_threadsafe(f)
+        # Outputs from messages take precedence, as they may contain sent images
+        with self._lock:
+            outputs = outputs | self._new_outputs
+            self._new_outputs = outputs
+        self._resolve()
         if display_result:
             from IPython.display import display
 
@@ -831,7 +1626,7 @@ class Task:
             others = []
             # TODO: Sort by the parsed id
             for _id, output in sorted(outputs.items(), key=lambda item: item[0]):
-                result = data.Result.from_output(output)
+                result = data.Result.from_output(output, self.client)
                 if isinstance(result, data.ImageBatchResult):
                     image_batches.append(result)
                 else:
@@ -843,44 +1638,98 @@ class Task:
             if others:
                 display(*others)
     
+    async def _set_error_threadsafe(self, error: ExecutionError) -> None:
+        self.status = 'error'
+        self.error = error
+        print(f'ComfyScript: {error}')
+        self._resolve(error)
+
+    def _resolve(self, error: ExecutionError | None = None) -> None:
+        '''Resolve the futures of all loops, with one wakeup per loop.'''
+        with self._lock:
+            if self._resolved:
+                return
+            self._resolved = True
+            waiters = [(self.get_loop(), self._fut)] + self._waiters + self._output_waiters
+            self._waiters = []
+            self._output_waiters = []
+        if self._latency is not None:
+            stats, submitted = self._latency
+            stats._add_latency(time.monotonic() - submitted)
+        for callback in self._resolve_callbacks:
+            callback(self)
+        for loop, fut in waiters:
+            events.waker.call_soon(loop, partial(_set_future, fut, self._new_outputs, error))
+
+    def _add_resolve_callback(self, callback: Callable[[Task], None]) -> None:
+        '''Call `callback` immediately if the task is already resolved.'''
+        with self._lock:
+            if not self._resolved:
+                self._resolve_callbacks.append(callback)
+                return
+        callback(self)
+
+    def _future(self) -> asyncio.Future:
+        '''A future of the task in the running loop.'''
+        loop = asyncio.get_running_loop()
+        if loop is self.get_loop():
+            return self._fut
+        fut = loop.create_future()
+        with self._lock:
+            if not self._resolved:
+                self._waiters.append((loop, fut))
+                return fut
+        _set_future(fut, self._new_outputs, self.error)
+        return fut
+
     async def _wait(self) -> list[data.Result]:
         '''`Task` can be directly awaited like `await task`. This method is for internal use only.'''
 
-        outputs: dict = await self._fut
-        return [data.Result.from_output(output) for output in outputs.values()]
+        outputs: dict = await self._future()
+        return [data.Result.from_output(output, self.client) for output in outputs.values()]
     
     def __await__(self) -> list[data.Result]:
         return self._wait().__await__()
 
     def wait(self) -> list[data.Result]:
-        return asyncio.run(self)
+        '''Raise `ExecutionError` if the task failed.'''
+        return client.event_loop_thread.run(self._wait())
     
     async def result(self, output: data.NodeOutput) -> data.Result | None:
         '''
         `None` if the task has been cancelled.
+
+        Raise `ExecutionError` if the task failed before the output was executed.
         '''
         id = self._id.get_id(output.node_prompt)
         if id is None:
             return None
         
-        while not self._fut.done():
-            if id in self._new_outputs:
-                output: dict | None = self._new_outputs[id]
-                return data.Result.from_output(output)
-            # print(self._event.is_set())
-            await self._event.wait()
-
-        outputs: dict = await self._fut
-        if id in outputs:
-            output: dict | None = outputs[id]
-            return data.Result.from_output(output)
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                # Including outputs executed before an error
+                if id in self._new_outputs:
+                    output: dict | None = self._new_outputs[id]
+                    break
+                if self._resolved:
+                    output = None
+                    break
+                fut = loop.create_future()
+                self._output_waiters.append((loop, fut))
+            await fut
+        if output is not None or id in self._new_outputs:
+            return data.Result.from_output(output, self.client)
+
+        # Raise the error, if any
+        await self._future()
         return None
     
     def wait_result(self, output: data.NodeOutput) -> data.Result | None:
         '''
         `None` if the task has been cancelled.
         '''
-        return asyncio.run(self.result(output))
+        return client.event_loop_thread.run(self.result(output))
 
     # def wait(self):
     #     return asyncio.run(self._wait())
@@ -942,13 +1791,17 @@ class Task:
     def remove_preview_callback(self, callback: Callable[[Task, str, Image.Image], None]):
         self._node_preview_callbacks.remove(callback)
 
+    def subscribe(self, types: Iterable[str] | None = None, *, maxsize: int = 1000, overflow: events.Overflow = 'drop_oldest') -> events.EventSubscription:
+        '''Subscribe to events of this task. See `TaskQueue.subscribe()`.'''
+        return queue.subscribe(types, tasks=[self], maxsize=maxsize, overflow=overflow)
+
     def done(self) -> bool:
         """Return True if the task is done.
 
         Done means either that a result / exception are available, or that the
         task was cancelled.
         """
-        return self._fut.done()
+        return self._resolved
     
     def add_done_callback(self, callback, *, context = None) -> None:
         """Add a callback to be run when the task becomes done.
@@ -1069,7 +1922,7 @@ class Workflow:
     def queue(self, source = None) -> Task | None:
         outer = inspect.currentframe().f_back
         source = ''.join(inspect.findsource(outer)[0])
-        return asyncio.run(self._queue(source))
+        return client.event_loop_thread.run(self._queue(source))
 
     async def __aenter__(self) -> Workflow:
         return self.__enter__()
@@ -1097,25 +1950,30 @@ class Workflow:
     def __exit__(self, exc_type, exc_value, traceback):
         outer = inspect.currentframe().f_back
         source = ''.join(inspect.findsource(outer)[0])
-        asyncio.run(self._exit(source, exc_type, exc_value, traceback))
+        client.event_loop_thread.run(self._exit(source, exc_type, exc_value, traceback))
 
 queue = TaskQueue()
 
 from .. import client
-from ..client import Client
+from ..client import Client, ClientPool
 from . import node
 from . import nodes
 from . import data
 from .data import *
 from . import util
+from . import validation
+from . import batching
 from .run import ComfyUIArgs
 
 __all__ = [
     'load',
     'Client',
+    'ClientPool',
     'ComfyUIArgs',
     'start_comfyui',
     'TaskQueue',
+    'QueueError',
+    'ExecutionError',
     'TaskProgress',
     'queue',
     'Task',
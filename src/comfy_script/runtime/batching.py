@@ -0,0 +1,232 @@
+'''Automatic batching of prompts that only differ in batchable inputs.'''
+from __future__ import annotations
+import copy
+from dataclasses import dataclass
+import json
+
+@dataclass
+class Batch:
+    '''A prompt merged from `len(id_maps)` prompts by `Batcher.merge()`.'''
+    prompt: dict
+    id_maps: list[dict[str, str]]
+    '''Node ids of `prompt` to node ids of each merged prompt. The node ids may differ if they are content-addressed. Nodes of other branches are not included.'''
+    branches: list[int]
+    '''The branch of each merged prompt. Prompts with the same batchable inputs share a branch.'''
+    batched: frozenset[str] = frozenset()
+    '''Nodes of `prompt` downstream of a `LatentBatch` join, whose outputs are concatenated in the order of branches.'''
+
+    def __len__(self) -> int:
+        return len(self.id_maps)
+
+    def _split_output(self, output: dict | None, i: int) -> dict | None:
+        if not isinstance(output, dict):
+            return output
+        n = max(self.branches) + 1
+        branch = self.branches[i]
+        split = {}
+        for key, value in output.items():
+            # e.g. `images` of `SaveImage`. Other values (e.g. `animated`) are shared.
+            if isinstance(value, list) and value and len(value) % n == 0:
+                size = len(value) // n
+                value = value[branch * size:(branch + 1) * size]
+            split[key] = value
+        return split
+
+    def split(self, outputs: dict[str, dict | None], i: int) -> dict[str, dict | None]:
+        '''Split the outputs of the merged prompt into the outputs of the `i`-th prompt, keyed by its node ids.'''
+        id_map = self.id_maps[i]
+        return {
+            id_map[node_id]: self._split_output(output, i) if node_id in self.batched else output
+            for node_id, output in outputs.items()
+            if node_id in id_map
+        }
+
+class Batcher:
+    '''
+    Merge prompts that are structurally identical and only differ in batchable inputs (e.g. seeds) into one prompt.
+
+    Nodes whose batchable inputs differ (e.g. samplers) get one branch per distinct value, so each prompt still gets the same images as running it alone. The `LATENT` outputs of the branches are joined with `LatentBatch`, so the nodes after them (e.g. `VAEDecode` and `SaveImage`) run once with the whole batch, and their outputs are split back to each prompt. Nodes that cannot take a joined batch (e.g. other samplers downstream) are branched as well.
+
+    Prompts without `batch_size` inputs are not merged, as the size of joined batches is unknown.
+    '''
+
+    def __init__(self, max_batch_size: int = 8, batchable_inputs: dict[str, set[str]] | None = None, latent_outputs: dict[str, set[int]] | None = None):
+        '''
+        - `max_batch_size`: The maximum size of joined batches, i.e. the sum of `batch_size` of merged prompts.
+        - `batchable_inputs`: Inputs of each node type that merged prompts can differ in. Sampler seeds by default.
+        - `latent_outputs`: Slots of `LATENT` outputs of each node type, which can be joined with `LatentBatch`. Outputs of samplers by default.
+        '''
+        self.max_batch_size = max_batch_size
+        if batchable_inputs is None:
+            batchable_inputs = {
+                'KSampler': {'seed'},
+                'KSamplerAdvanced': {'noise_seed'},
+                'SamplerCustom': {'noise_seed'},
+                'RandomNoise': {'noise_seed'},
+            }
+        self.batchable_inputs = { class_type: frozenset(inputs) for class_type, inputs in batchable_inputs.items() }
+        if latent_outputs is None:
+            latent_outputs = {
+                'KSampler': {0},
+                'KSamplerAdvanced': {0},
+                'SamplerCustom': {0, 1},
+                'SamplerCustomAdvanced': {0, 1},
+            }
+        self.latent_outputs = { class_type: frozenset(slots) for class_type, slots in latent_outputs.items() }
+
+    def _key(self, prompt: dict) -> tuple[str | None, int]:
+        '''Return the structure of the prompt without batchable inputs, and its maximum `batch_size`.'''
+        positions = { node_id: i for i, node_id in enumerate(prompt) }
+        nodes = []
+        batch_size = 0
+        for node in prompt.values():
+            class_type = node['class_type']
+            batchable = self.batchable_inputs.get(class_type, ())
+            inputs = {}
+            for name, value in node.get('inputs', {}).items():
+                if isinstance(value, list) and len(value) == 2 and value[0] in positions:
+                    # Links, by positions instead of node ids
+                    inputs[name] = ['link', positions[value[0]], value[1]]
+                elif name not in batchable:
+                    inputs[name] = value
+                    if name == 'batch_size' and isinstance(value, int):
+                        batch_size = max(batch_size, value)
+            nodes.append([class_type, inputs])
+        try:
+            return json.dumps(nodes, sort_keys=True), batch_size
+        except TypeError:
+            return None, batch_size
+
+    def group(self, prompts: list[dict]) -> list[list[int]]:
+        '''Group the indices of prompts that can be merged. Prompts that cannot be merged are in their own groups.'''
+        groups = []
+        open_groups: dict[str, list[int]] = {}
+        for i, prompt in enumerate(prompts):
+            key, batch_size = self._key(prompt)
+            if key is None or batch_size == 0 or batch_size * 2 > self.max_batch_size:
+                groups.append([i])
+                continue
+            group = open_groups.get(key)
+            if group is None or (len(group) + 1) * batch_size > self.max_batch_size:
+                group = open_groups[key] = []
+                groups.append(group)
+            group.append(i)
+        return groups
+
+    def _batchable_values(self, prompt: dict) -> list[dict]:
+        # Links are compared by `_key()`
+        return [
+            {
+                name: value for name, value in node.get('inputs', {}).items()
+                if name in self.batchable_inputs.get(node['class_type'], ()) and not isinstance(value, list)
+            }
+            for node in prompt.values()
+        ]
+
+    def merge(self, prompts: list[dict]) -> Batch:
+        '''Merge prompts of a group returned by `group()`.'''
+        base = prompts[0]
+        node_ids = list(base)
+        positions = { node_id: i for i, node_id in enumerate(node_ids) }
+
+        # Branches, i.e. distinct batchable inputs
+        branch_values: list[list[dict]] = []
+        branches = []
+        for prompt in prompts:
+            values = self._batchable_values(prompt)
+            try:
+                branch = branch_values.index(values)
+            except ValueError:
+                branch = len(branch_values)
+                branch_values.append(values)
+            branches.append(branch)
+
+        # Links by node ids of `base`
+        links = []
+        for node_id, node in base.items():
+            for name, value in node.get('inputs', {}).items():
+                if isinstance(value, list) and len(value) == 2 and value[0] in positions:
+                    links.append((value[0], value[1], node_id, name))
+
+        varying = { node_ids[i] for i in range(len(node_ids)) if any(values[i] != branch_values[0][i] for values in branch_values[1:]) }
+        downstream = _reachable(varying, [(src, dst) for src, _, dst, _ in links])
+        upstream = _reachable(varying, [(dst, src) for src, _, dst, _ in links]) - varying
+        # Nodes of each branch, and nodes of the joined batch.
+        # Samplers sample a batch differently from its items one by one, even with the same seeds.
+        branched = varying | (downstream & upstream) | { node_id for node_id in downstream if base[node_id]['class_type'] in self.batchable_inputs }
+        batched = downstream - branched
+        changed = True
+        while changed:
+            changed = False
+            for src, slot, dst, _ in links:
+                if dst in batched and src in branched and slot not in self.latent_outputs.get(base[src]['class_type'], ()):
+                    # e.g. `NOISE` of `RandomNoise`
+                    batched.remove(dst)
+                    branched.add(dst)
+                    changed = True
+                elif dst in branched and src in batched:
+                    batched.remove(src)
+                    branched.add(src)
+                    changed = True
+
+        def branch_id(node_id: str, branch: int) -> str:
+            return f'{node_id}#{branch}'
+
+        merged = {}
+        joins: dict[tuple[str, int], list] = {}
+
+        def join(src: str, slot: int) -> list:
+            link = joins.get((src, slot))
+            if link is None:
+                link = [branch_id(src, 0), slot]
+                for branch in range(1, len(branch_values)):
+                    join_id = f'{src}#LatentBatch{slot}.{branch}'
+                    merged[join_id] = {'inputs': {'samples1': link, 'samples2': [branch_id(src, branch), slot]}, 'class_type': 'LatentBatch'}
+                    link = [join_id, 0]
+                joins[src, slot] = link
+            return link
+
+        for i, (node_id, node) in enumerate(base.items()):
+            if node_id in branched:
+                for branch, values in enumerate(branch_values):
+                    copied = copy.deepcopy(node)
+                    inputs = copied.setdefault('inputs', {})
+                    inputs.update(copy.deepcopy(values[i]))
+                    for name, value in inputs.items():
+                        if isinstance(value, list) and len(value) == 2 and value[0] in branched:
+                            inputs[name] = [branch_id(value[0], branch), value[1]]
+                    merged[branch_id(node_id, branch)] = copied
+            else:
+                copied = copy.deepcopy(node)
+                inputs = copied.get('inputs', {})
+                for name, value in inputs.items():
+                    if isinstance(value, list) and len(value) == 2 and value[0] in branched:
+                        inputs[name] = join(*value)
+                merged[node_id] = copied
+
+        id_maps = []
+        for prompt, branch in zip(prompts, branches):
+            id_map = {}
+            for node_id, prompt_node_id in zip(node_ids, prompt):
+                id_map[branch_id(node_id, branch) if node_id in branched else node_id] = prompt_node_id
+            id_maps.append(id_map)
+        return Batch(merged, id_maps, branches, frozenset(batched))
+
+def _reachable(start: set[str], edges: list[tuple[str, str]]) -> set[str]:
+    '''Nodes reachable from `start` by `edges`, including `start`.'''
+    adjacent: dict[str, list[str]] = {}
+    for src, dst in edges:
+        adjacent.setdefault(src, []).append(dst)
+    reachable = set(start)
+    stack = list(start)
+    while stack:
+        for node_id in adjacent.get(stack.pop(), ()):
+            if node_id not in reachable:
+                reachable.add(node_id)
+                stack.append(node_id)
+    return reachable
+
+__all__ = [
+    'Batch',
+    'Batcher',
+]
@@ -1,34 +1,156 @@
 from __future__ import annotations
 import asyncio
 import io
-from PIL import Image
+import mmap
+import os
+from pathlib import Path
+import sys
+from urllib.parse import urlsplit
+from PIL import Image, ImageFile
 
 from . import Result
 
 class ImageBatchResult(Result):
+    def __init__(self, output: dict | None, c: client.Client | None = None):
+        super().__init__(output)
+        self._client = c
+
+    def _get_client(self) -> client.Client:
+        return self._client if self._client is not None else client.client
+
+    max_concurrency: int = 8
+    '''The default maximum number of images downloaded concurrently by `wait()` and `await`.'''
+
+    local: bool = True
+    '''Read images from the local filesystem instead of `/view` if the server runs in the same process (e.g. standalone runtime), falling back to HTTP if the file cannot be found.'''
+    mmap: bool = False
+    '''Memory-map local files for `raw=True` instead of reading them. `mmap.mmap` objects are returned, which can be used as bytes-like objects.'''
+
+    @staticmethod
+    def _get_local_port() -> int | None:
+        '''The port of the ComfyUI server running in this process, if any.'''
+        server = sys.modules.get('server')
+        instance = getattr(getattr(server, 'PromptServer', None), 'instance', None)
+        port = getattr(instance, 'port', None)
+        if port is None:
+            cli_args = sys.modules.get('comfy.cli_args')
+            port = getattr(getattr(cli_args, 'args', None), 'port', None)
+        return port
+
+    @staticmethod
+    def _is_local(c: client.Client) -> bool:
+        '''Whether the client is connected to the server running in this process, instead of another server (which may also be local).'''
+        url = urlsplit(str(c.base_url))
+        if url.hostname not in ('127.0.0.1', 'localhost', '::1'):
+            return False
+        port = ImageBatchResult._get_local_port()
+        if port is None:
+            return False
+        return (url.port or (443 if url.scheme == 'https' else 80)) == port
+
+    @staticmethod
+    def _get_local_path(image: dict, c: client.Client) -> Path | None:
+        folder_paths = sys.modules.get('folder_paths')
+        if folder_paths is None or 'get_directory_by_type' not in vars(folder_paths):
+            return None
+        if not ImageBatchResult._is_local(c):
+            return None
+        dir = folder_paths.get_directory_by_type(image.get('type', 'output'))
+        if dir is None:
+            return None
+        dir = Path(dir).resolve()
+        path = (dir / image.get('subfolder', '') / image['filename']).resolve()
+        # See ComfyUI::server.view_image
+        if not path.is_relative_to(dir) or not path.is_file():
+            return None
+        return path
+
+    @staticmethod
+    def _read_local(path: Path) -> bytes | mmap.mmap:
+        if ImageBatchResult.mmap:
+            with open(path, 'rb') as f:
+                # Empty files cannot be mapped
+                if os.fstat(f.fileno()).st_size > 0:
+                    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return path.read_bytes()
+
+    @staticmethod
+    def _open_local(path: Path) -> Image.Image:
+        image = Image.open(path)
+        image.load()
+        return image
+
+    async def _get_image_bytes(self, image: dict) -> bytes | None:
+        if ImageBatchResult.local:
+            path = ImageBatchResult._get_local_path(image, self._get_client())
+            if path is not None:
+                return await asyncio.to_thread(ImageBatchResult._read_local, path)
+
+        c = self._get_client()
+        async with c.pooled_session() as session:
+            async with session.get(f'{c.base_url}view', params=image) as response:
+                if response.status == 200:
+                    return await response.read()
+                else:
+                    print(f'ComfyScript: Failed to get image: {await client.response_to_str(response)}')
+                    return
+
     # TODO: Lazy cell
     async def _get_image(self, image: dict) -> Image.Image | None:
-        async with client.client.session() as session:
-            async with session.get(f'{client.client.base_url}view', params=image) as response:
+        if ImageBatchResult.local:
+            path = ImageBatchResult._get_local_path(image, self._get_client())
+            if path is not None:
+                return await asyncio.to_thread(ImageBatchResult._open_local, path)
+
+        c = self._get_client()
+        async with c.pooled_session() as session:
+            async with session.get(f'{c.base_url}view', params=image) as response:
                 if response.status == 200:
-                    return Image.open(io.BytesIO(await response.read()))
+                    # Decode while downloading
+                    parser = ImageFile.Parser()
+                    chunks = []
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        chunks.append(chunk)
+                        if parser is not None:
+                            try:
+                                parser.feed(chunk)
+                            except Exception:
+                                parser = None
+                    if parser is not None:
+                        try:
+                            return parser.close()
+                        except Exception:
+                            pass
+                    # Formats not supported by the parser
+                    return Image.open(io.BytesIO(b''.join(chunks)))
                 else:
                     print(f'ComfyScript: Failed to get image: {await client.response_to_str(response)}')
                     return
-    
+
+    async def _get_images(self, *, raw: bool = False, concurrency: int | None = None) -> list[Image.Image | bytes | None]:
+        get = self._get_image_bytes if raw else self._get_image
+        semaphore = asyncio.Semaphore(concurrency or ImageBatchResult.max_concurrency)
+        async def get_limited(image: dict):
+            async with semaphore:
+                return await get(image)
+        return list(await asyncio.gather(*[get_limited(image) for image in self._output['images']]))
+
     def __await__(self) -> list[Image.Image | None]:
-        async def f(self):
-            return [await self._get_image(image) for image in self._output['images']]
-        return f(self).__await__()
+        return self._get_images().__await__()
     
-    def wait(self) -> list[Image.Image | None]:
-        return asyncio.run(self)
+    def wait(self, *, raw: bool = False, concurrency: int | None = None) -> list[Image.Image | bytes | None]:
+        '''
+        - `raw`: Return the encoded bytes (e.g. PNG) instead of decoding them, for callers that only need to save the images.
+        - `concurrency`: The maximum number of images downloaded concurrently. `max_concurrency` by default.
+        '''
+        return client.event_loop_thread.run(self._get_images(raw=raw, concurrency=concurrency))
     
-    async def get(self, i: int) -> Image.Image | None:
-        return await self._get_image(self._output['images'][i])
+    async def get(self, i: int, *, raw: bool = False) -> Image.Image | bytes | None:
+        image = self._output['images'][i]
+        return await (self._get_image_bytes(image) if raw else self._get_image(image))
     
     def __getitem__(self, i: int) -> Image.Image | None:
-        return asyncio.run(self.get(i))
+        return client.event_loop_thread.run(self.get(i))
     
     def display(self, rows: int | None = 1, cols: int | None = None, height: int | None = None, width: int | None = None, **kwds):
         Images(self).display(rows, cols, height, width, **kwds)
@@ -36,6 +158,26 @@ class ImageBatchResult(Result):
     def _ipython_display_(self):
         self.display()
 
+class SentImageBatchResult(ImageBatchResult):
+    '''Images sent over the websocket by `ComfyScriptSendImage` node, which are kept in memory instead of being saved to the server.'''
+
+    def _get_sent_image(self, i: int, raw: bool) -> Image.Image | bytes | None:
+        image: Image.Image | None = self._output['comfy_script_images'][i].get('image')
+        if image is None:
+            print(f'ComfyScript: Image {i} was not received')
+            return None
+        if raw:
+            f = io.BytesIO()
+            image.save(f, 'PNG')
+            return f.getvalue()
+        return image
+
+    async def _get_images(self, *, raw: bool = False, concurrency: int | None = None) -> list[Image.Image | bytes | None]:
+        return [self._get_sent_image(i, raw) for i in range(len(self._output['comfy_script_images']))]
+
+    async def get(self, i: int, *, raw: bool = False) -> Image.Image | bytes | None:
+        return self._get_sent_image(i, raw)
+
 # TODO: Deprecate this?
 from ...ui.ipy import ImageViewer as Images
 
@@ -43,5 +185,6 @@ from ... import client
 
 __all__ = [
     'ImageBatchResult',
+    'SentImageBatchResult',
     'Images',
 ]
\ No newline at end of file
@@ -1,26 +1,50 @@
 from __future__ import annotations
 import asyncio
 import builtins
+import hashlib
 import inspect
 import json
+from pathlib import PurePath
 from typing import Iterable
 
 from ... import client
 from .. import factory
 
 class IdManager:
-    def __init__(self):
+    content_addressed: bool = False
+    '''
+    The default of `content_addressed` for new `IdManager`s.
+
+    If `True`, node ids are derived from a stable recursive hash of the class type and inputs of the node, i.e. the same node always gets the same id across prompts, runs and processes. This maximizes cache hits on the server when different workflows share subgraphs. Nodes with the same content in one prompt are merged into one.
+
+    Example:
+    ```
+    from comfy_script.runtime.data import IdManager
+    IdManager.content_addressed = True
+    ```
+    '''
+
+    def __init__(self, content_addressed: bool | None = None):
         self._type_ids: dict[str, int] = {}
         self._objid_id_map = {}
         self._id_obj_map = {}
+        self.content_addressed = content_addressed if content_addressed is not None else IdManager.content_addressed
 
-    def assign_id(self, obj: object) -> str:
-        # Assign id by node types to utilize cache
-        # TODO: Hash inputs recursively to utlize cache better?
+    def assign_id(self, obj: object, prompt_inputs: dict | None = None) -> str:
+        '''
+        - `prompt_inputs`: The inputs of the node in API format, with links resolved. Required if `content_addressed`.
+        '''
         type = obj['class_type']
-        type_id = self._type_ids.get(type, -1) + 1
-        self._type_ids[type] = type_id
-        id = f'{type}.{type_id}'
+        hash = _hash_node(type, prompt_inputs) if self.content_addressed else None
+        if hash is not None:
+            # Links are already resolved to hashes of upstream nodes, so the hash covers the whole upstream graph
+            id = f'{type}.{hash}'
+        else:
+            # Nodes with inputs that cannot be hashed stably are not content-addressed
+            # Assign id by node types to utilize cache
+            type_id = self._type_ids.get(type, -1) + 1
+            self._type_ids[type] = type_id
+            id = f'{type}.{type_id}'
         
         self._objid_id_map[builtins.id(obj)] = id
         self._id_obj_map[id] = obj
@@ -35,6 +59,77 @@ class IdManager:
     def get_obj(self, id: str) -> object | None:
         return self._id_obj_map.get(id)
 
+    def _copy(self) -> IdManager:
+        id = IdManager(self.content_addressed)
+        id._type_ids = self._type_ids.copy()
+        id._objid_id_map = self._objid_id_map.copy()
+        id._id_obj_map = self._id_obj_map.copy()
+        return id
+
+def _hash_default(o):
+    if isinstance(o, PurePath):
+        return str(o)
+    # `repr()` may contain addresses, which are not stable across processes
+    raise TypeError
+
+_hash_encoder = json.JSONEncoder(sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=_hash_default)
+
+def _hash_node(class_type: str, prompt_inputs: dict) -> str | None:
+    '''`None` if any input cannot be hashed, e.g. an arbitrary object.'''
+    try:
+        s = _hash_encoder.encode([class_type, prompt_inputs])
+    except (TypeError, ValueError):
+        return None
+    return hashlib.sha256(s.encode('utf8', 'surrogatepass')).hexdigest()[:16]
+
+class NodeInputs(dict):
+    '''
+    Inputs of a node prompt. The prompt fragment of the node is cached on the inputs and modifications will invalidate it.
+    '''
+    __slots__ = ('_prompt_cache', '_version')
+
+    def __init__(self, *args, **kwds):
+        super().__init__(*args, **kwds)
+        self._prompt_cache: tuple[dict, list[tuple[str, NodeOutput]]] | None = None
+        self._version = 0
+        '''Incremented on modification, so that memoized prompts of downstream outputs can be validated.'''
+    
+    def _invalidate(self):
+        self._prompt_cache = None
+        self._version += 1
+
+    def __setitem__(self, k, v):
+        self._invalidate()
+        super().__setitem__(k, v)
+
+    def __delitem__(self, k):
+        self._invalidate()
+        super().__delitem__(k)
+
+    def __ior__(self, other):
+        self._invalidate()
+        return super().__ior__(other)
+
+    def update(self, *args, **kwds):
+        self._invalidate()
+        super().update(*args, **kwds)
+
+    def setdefault(self, k, default=None):
+        self._invalidate()
+        return super().setdefault(k, default)
+
+    def pop(self, *args):
+        self._invalidate()
+        return super().pop(*args)
+
+    def popitem(self):
+        self._invalidate()
+        return super().popitem()
+
+    def clear(self):
+        self._invalidate()
+        super().clear()
+
 class NodeOutput:
     '''
     - `task: Task | None`: The last task associated with the node output.
@@ -44,12 +139,37 @@ class NodeOutput:
         self.node_prompt = node_prompt
         self.output_slot = output_slot
         self.task = None
+        self._cache_key: str | tuple[str, dict] | None = None
+        '''Used by real mode to cache node outputs. The name and inputs of the call until the key is needed.'''
+        self._prompt_memo: tuple[list[tuple[dict, NodeInputs, int]], dict, IdManager] | None = None
+        '''The versions of the inputs of all upstream nodes, the prompt and the ids.'''
     
     def _get_prompt_and_id(self) -> (dict, IdManager):
+        '''
+        The prompt is memoized until the inputs of any upstream node are modified. Then the whole prompt is rebuilt, but only the modified nodes have their constant inputs mapped again (see `NodeInputs`). Each call still checks the versions of all upstream nodes and copies the prompt.
+        '''
+        # Nodes can only link to existing nodes, so the upstream graph can only change by modifying inputs of upstream nodes
+        memo = self._prompt_memo
+        if memo is not None and memo[2].content_addressed == IdManager.content_addressed and all(
+            node_prompt['inputs'] is inputs and inputs._version == version for node_prompt, inputs, version in memo[0]
+        ):
+            return _copy_prompt(memo[1]), memo[2]._copy()
+
         prompt = {}
         id = IdManager()
-        self._update_prompt(prompt, id)
-        return prompt, id
+        # Not `id._id_obj_map`, as nodes with the same content-addressed id are merged
+        visited = []
+        self._update_prompt(prompt, id, visited)
+        versions = []
+        for node_prompt in visited:
+            inputs = node_prompt['inputs']
+            if not isinstance(inputs, NodeInputs):
+                # Modifications cannot be tracked
+                versions = None
+                break
+            versions.append((node_prompt, inputs, inputs._version))
+        self._prompt_memo = (versions, prompt, id) if versions is not None else None
+        return _copy_prompt(prompt), id._copy()
 
     def api_format(self) -> dict:
         return self._get_prompt_and_id()[0]
@@ -57,21 +177,40 @@ class NodeOutput:
     def api_format_json(self) -> str:
         return json.dumps(self.api_format(), indent=2, cls=client.WorkflowJSONEncoder)
     
-    def _update_prompt(self, prompt: dict, id: IdManager) -> str:
+    def _update_prompt(self, prompt: dict, id: IdManager, visited: list[dict] | None = None) -> str:
+        '''
+        - `visited`: If given, node prompts of all upstream nodes are appended to it.
+        '''
         prompt_id = id.get_id(self.node_prompt)
         if prompt_id is not None:
             return prompt_id
 
         inputs = self.node_prompt['inputs']
-        prompt_inputs = {}
-        for k, v in inputs.items():
-            if isinstance(v, NodeOutput):
-                prompt_inputs[k] = [v._update_prompt(prompt, id), v.output_slot]
-            else:
-                # Other convertions are done in client.WorkflowJSONEncoder
-                prompt_inputs[k] = factory.RuntimeFactory._map_input(k, v, self.node_info)
+        cache = getattr(inputs, '_prompt_cache', None)
+        if cache is None:
+            # Links are resolved for each prompt as ids are assigned per prompt
+            consts = {}
+            links = []
+            for k, v in inputs.items():
+                if isinstance(v, NodeOutput):
+                    # Keep the order of inputs
+                    consts[k] = None
+                    links.append((k, v))
+                else:
+                    # Other convertions are done in client.WorkflowJSONEncoder
+                    consts[k] = factory.RuntimeFactory._map_input(k, v, self.node_info)
+            cache = (consts, links)
+            if isinstance(inputs, NodeInputs):
+                inputs._prompt_cache = cache
         
-        new_id = id.assign_id(self.node_prompt)
+        consts, links = cache
+        prompt_inputs = consts.copy()
+        for k, v in links:
+            prompt_inputs[k] = [v._update_prompt(prompt, id, visited), v.output_slot]
+        
+        new_id = id.assign_id(self.node_prompt, prompt_inputs)
+        if visited is not None:
+            visited.append(self.node_prompt)
         prompt[new_id] = {
             'inputs': prompt_inputs,
             'class_type': self.node_prompt['class_type'],
@@ -100,7 +239,14 @@ class NodeOutput:
         '''
         outer = inspect.currentframe().f_back
         source = ''.join(inspect.findsource(outer)[0])
-        return asyncio.run(self._wait(source))
+        return client.event_loop_thread.run(self._wait(source))
+
+def _copy_prompt(prompt: dict) -> dict:
+    '''Copy the node dicts, `inputs` dicts and links of a prompt, so that callers can modify it.'''
+    return {
+        node_id: node | {'inputs': { k: list(v) if isinstance(v, list) else v for k, v in node['inputs'].items() }}
+        for node_id, node in prompt.items()
+    }
 
 def _get_outputs_prompt_and_id(outputs: Iterable[NodeOutput]) -> (dict, IdManager):
     if not outputs:
@@ -132,10 +278,15 @@ class Result:
         return f'{self.__class__.__name__}({self._output.__str__()})'
 
     @classmethod
-    def from_output(cls, output: dict | None) -> Result:
+    def from_output(cls, output: dict | None, c: client.Client | None = None) -> Result:
+        '''
+        - `c`: The client of the server that generated the output, used to fetch images. `client.client` by default.
+        '''
         if isinstance(output, dict):
+            if 'comfy_script_images' in output:
+                return SentImageBatchResult(output)
             if 'images' in output:
-                return ImageBatchResult(output)
+                return ImageBatchResult(output, c)
         elif output is None:
             return EmptyResult(output)
         return Result(output)
@@ -154,11 +305,13 @@ class EmptyResult(Result):
     def _ipython_display_(self):
         pass
 
-from .Images import ImageBatchResult, Images
+from .Images import ImageBatchResult, SentImageBatchResult, Images
 
 __all__ = [
+    'NodeInputs',
     'NodeOutput',
     'Result',
     'ImageBatchResult',
+    'SentImageBatchResult',
     'Images',
 ]
\ No newline at end of file
@@ -0,0 +1,255 @@
+'''Events of the servers watched by `queue`.'''
+from __future__ import annotations
+from collections import deque
+from dataclasses import dataclass
+from functools import partial
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Literal
+
+import asyncio
+
+if TYPE_CHECKING:
+    from .. import client
+    from . import Task
+
+@dataclass
+class Event:
+    '''
+    A message from the websocket of a server.
+
+    Known types:
+    - `'status'`: `data['status']['exec_info']['queue_remaining']`
+    - `'execution_start'`
+    - `'execution_cached'`: `data['nodes']`
+    - `'executing'`: The task is finished if `node` is `None`.
+    - `'progress'`: `data['value']`, `data['max']`
+    - `'executed'`: `data['output']`
+    - `'execution_success'`
+    - `'execution_interrupted'`
+    - `'execution_error'`: `data['exception_message']`, `data['traceback']`
+    - `'preview'`: `data` is a `PIL.Image.Image` of the node being executed.
+
+    Other messages (e.g. sent by custom nodes) are passed through with their own types.
+    '''
+    type: str
+    data: Any
+    prompt_id: str | None
+    node: str | None
+    task: Task | None
+    '''`None` if the prompt is not queued by this process.'''
+    client: client.Client
+
+Overflow = Literal['drop_oldest', 'drop_newest', 'block']
+
+class LoopWaker:
+    '''
+    Run callbacks in event loops from other threads, e.g. to resolve futures from the watch thread.
+
+    There is at most one pending `call_soon_threadsafe()` per loop: callbacks scheduled before it runs are run in the same batch, so a burst of messages wakes each loop once instead of once per message.
+    '''
+
+    def __init__(self):
+        self._pending: dict[asyncio.AbstractEventLoop, list[Callable[[], None]]] = {}
+        self._lock = threading.Lock()
+        self.wakeups = 0
+        '''The number of `call_soon_threadsafe()` calls.'''
+        self.callbacks = 0
+
+    def call_soon(self, loop: asyncio.AbstractEventLoop, callback: Callable[[], None]) -> None:
+        with self._lock:
+            self.callbacks += 1
+            callbacks = self._pending.get(loop)
+            if callbacks is not None:
+                callbacks.append(callback)
+                return
+            self._pending[loop] = [callback]
+            self.wakeups += 1
+        try:
+            loop.call_soon_threadsafe(self._run, loop)
+        except RuntimeError:
+            # The loop is closed
+            with self._lock:
+                self._pending.pop(loop, None)
+
+    def _run(self, loop: asyncio.AbstractEventLoop) -> None:
+        with self._lock:
+            callbacks = self._pending.pop(loop, ())
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                loop.call_exception_handler({
+                    'message': 'ComfyScript: Exception in callback',
+                    'exception': e,
+                })
+
+waker = LoopWaker()
+'''The global waker used by tasks and event subscriptions.'''
+
+def _set_result(fut: asyncio.Future, result: Any = None) -> None:
+    if not fut.done():
+        fut.set_result(result)
+
+def _wake(waiter: tuple[asyncio.AbstractEventLoop, asyncio.Future] | None) -> None:
+    if waiter is None:
+        return
+    loop, fut = waiter
+    waker.call_soon(loop, partial(_set_result, fut))
+
+class EventSubscription:
+    '''
+    An async iterator of events with a bounded buffer. Created by `queue.subscribe()`.
+
+    Events are published by the watch thread and can be consumed in any event loop. Iteration stops after `close()`.
+    '''
+
+    def __init__(self, subscriptions: EventSubscriptions, types: Iterable[str] | None, prompt_ids: Iterable[str] | None, maxsize: int, overflow: Overflow):
+        self._subscriptions = subscriptions
+        self.types = frozenset(types) if types is not None else None
+        self.prompt_ids = frozenset(prompt_ids) if prompt_ids is not None else None
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        '''The number of events dropped because the buffer was full.'''
+        self.closed = False
+
+        self._buffer: deque[Event] = deque()
+        self._lock = threading.Lock()
+        self._getter: tuple[asyncio.AbstractEventLoop, asyncio.Future] | None = None
+        self._putters: deque[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+
+    def _accepts(self, type: str, prompt_id: str | None) -> bool:
+        return (self.types is None or type in self.types) and (self.prompt_ids is None or prompt_id in self.prompt_ids)
+
+    async def _put(self, event: Event) -> None:
+        while True:
+            putter = None
+            with self._lock:
+                if self.closed:
+                    return
+                if len(self._buffer) >= self.maxsize:
+                    if self.overflow == 'drop_newest':
+                        self.dropped += 1
+                        return
+                    elif self.overflow == 'drop_oldest':
+                        self._buffer.popleft()
+                        self.dropped += 1
+                    else:
+                        # Block the watcher until there is space, which in turn slows down reading the websocket
+                        loop = asyncio.get_running_loop()
+                        putter = (loop, loop.create_future())
+                        self._putters.append(putter)
+                if putter is None:
+                    self._buffer.append(event)
+                    getter, self._getter = self._getter, None
+            if putter is None:
+                _wake(getter)
+                return
+            await putter[1]
+
+    def __aiter__(self) -> EventSubscription:
+        return self
+
+    async def __anext__(self) -> Event:
+        while True:
+            with self._lock:
+                if self._buffer:
+                    event = self._buffer.popleft()
+                    putter = self._putters.popleft() if self._putters else None
+                    break
+                if self.closed:
+                    raise StopAsyncIteration
+                loop = asyncio.get_running_loop()
+                getter = self._getter = (loop, loop.create_future())
+            await getter[1]
+        _wake(putter)
+        return event
+
+    async def get(self) -> Event | None:
+        '''Return `None` if the subscription is closed.'''
+        try:
+            return await self.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def close(self) -> None:
+        '''Unsubscribe. Buffered events can still be iterated.'''
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            getter, self._getter = self._getter, None
+            putters = list(self._putters)
+            self._putters.clear()
+        self._subscriptions._remove(self)
+        _wake(getter)
+        for putter in putters:
+            _wake(putter)
+
+    async def __aenter__(self) -> EventSubscription:
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def __enter__(self) -> EventSubscription:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+class EventSubscriptions:
+    '''Subscriptions of a `TaskQueue`. Publishing is free if there are no subscriptions.'''
+
+    def __init__(self):
+        # Copy on write, so that publishing doesn't need the lock
+        self._all: tuple[EventSubscription, ...] = ()
+        '''Subscriptions of all prompts.'''
+        self._by_prompt: dict[str, tuple[EventSubscription, ...]] = {}
+        '''Subscriptions of specific prompts, so that routing an event to them is O(1) regardless of the number of subscriptions.'''
+        self._lock = threading.Lock()
+
+    def __bool__(self) -> bool:
+        return bool(self._all) or bool(self._by_prompt)
+
+    def subscribe(self, types: Iterable[str] | None = None, *, prompt_ids: Iterable[str] | None = None, maxsize: int = 1000, overflow: Overflow = 'drop_oldest') -> EventSubscription:
+        if maxsize < 1:
+            raise ValueError(f'ComfyScript: Invalid maxsize: {maxsize}')
+        subscription = EventSubscription(self, types, prompt_ids, maxsize, overflow)
+        with self._lock:
+            if subscription.prompt_ids is None:
+                self._all += (subscription,)
+            else:
+                for prompt_id in subscription.prompt_ids:
+                    self._by_prompt[prompt_id] = self._by_prompt.get(prompt_id, ()) + (subscription,)
+        return subscription
+
+    def _remove(self, subscription: EventSubscription) -> None:
+        with self._lock:
+            if subscription.prompt_ids is None:
+                self._all = tuple(s for s in self._all if s is not subscription)
+            else:
+                for prompt_id in subscription.prompt_ids:
+                    subscriptions = tuple(s for s in self._by_prompt.get(prompt_id, ()) if s is not subscription)
+                    if subscriptions:
+                        self._by_prompt[prompt_id] = subscriptions
+                    else:
+                        self._by_prompt.pop(prompt_id, None)
+
+    async def publish(self, c: client.Client, type: str, data: Any, prompt_id: str | None, node: str | None, task: Task | None) -> None:
+        subscriptions = self._all
+        if prompt_id is not None and self._by_prompt:
+            subscriptions += self._by_prompt.get(prompt_id, ())
+        event = None
+        for subscription in subscriptions:
+            if subscription._accepts(type, prompt_id):
+                if event is None:
+                    event = Event(type, data, prompt_id, node, task, c)
+                await subscription._put(event)
+
+__all__ = [
+    'Event',
+    'EventSubscription',
+    'LoopWaker',
+    'waker',
+]
@@ -1,7 +1,10 @@
 from __future__ import annotations
-from enum import Enum
+from enum import Enum, IntEnum
+import hashlib
+import json
 from pathlib import Path
 import textwrap
+import traceback
 import typing
 from typing import Any
 
@@ -73,9 +76,48 @@ def to_bool_enum(enum: list[str | bool], b: bool) -> str:
     else:
         return enum[1]
 
+_ENUM_CLASSES = {
+    'str': astutil.StrEnum,
+    'int': IntEnum,
+    'float': astutil.FloatEnum,
+}
+
+def _enum_to_descriptor(t: type[Enum]) -> list:
+    if issubclass(t, IntEnum):
+        kind = 'int'
+    elif issubclass(t, astutil.FloatEnum):
+        kind = 'float'
+    else:
+        kind = 'str'
+    # __members__ includes aliases
+    return ['enum', kind, t.__name__, { k: m.value for k, m in t.__members__.items() }]
+
+def _enum_from_descriptor(d: list) -> type[Enum]:
+    _, kind, id, members = d
+    return _ENUM_CLASSES[kind](id, members)
+
+def _write_type_stubs(path: Path, stubs: str) -> None:
+    '''Write type stubs only if they have changed, to avoid invalidating language servers' caches.'''
+    try:
+        if path.read_text(encoding='utf8') == stubs:
+            return
+    except (OSError, UnicodeDecodeError):
+        pass
+    with open(path, 'w', encoding='utf8') as f:
+        try:
+            f.write(stubs)
+        except UnicodeEncodeError:
+            # Replace invalid chars in type stubs with '�'
+            # e.g. #87
+            f.write(stubs.encode('utf8', 'surrogateescape').decode('utf8', 'replace'))
+
 class RuntimeFactory:
     '''RuntimeFactory is ignorant of runtime modes.'''
 
+    _DESCRIPTORS_VERSION = 1
+    '''Bump this if the output of the factory changes.'''
+    _DESCRIPTORS_CACHE_MAX_FILES = 8
+
     def __init__(self, *, hidden_inputs: bool = False, max_enum_values: int = 2000, import_fullname_types: bool = False):
         '''
         - `hidden_inputs`: Show hidden inputs.
@@ -95,6 +137,15 @@ class RuntimeFactory:
 
         self._import_modules = set() if import_fullname_types else None
         '''WIP.'''
+
+        self._init_var_ids = set()
+        self._node_descriptors: dict[str, tuple[str, dict, list[type], dict[str, Enum]]] = {}
+        self._type_stubs: str | None = None
+
+        self._reserved_nodes: dict[str, dict] = {}
+        '''Node infos keyed by class ids, see `reserve_node()`.'''
+        self._reserved_names: dict[str, str] = {}
+        '''Class ids keyed by node names.'''
     
     async def init(self) -> None:
         try:
@@ -115,6 +166,8 @@ class RuntimeFactory:
             self._enum_values[id] = embeddings
         except Exception as e:
             print(f'ComfyScript: Failed to get embeddings: {e}')
+        
+        self._init_var_ids = { id for id, v in self._vars.items() if v is not None }
 
     def _get_type_or_assign_id(self, raw_id: str, node: bool) -> type | str:
         '''
@@ -240,11 +293,87 @@ class RuntimeFactory:
     def new_node(self, info: dict, defaults: dict, output_types: list[type]):
         raise NotImplementedError
 
-    def add_node(self, info: dict) -> None:
+    _PRIMITIVE_INPUT_TYPES = ('*', 'COMBO', 'INT', 'FLOAT', 'STRING', 'BOOLEAN')
+
+    def reserve_node(self, info: dict) -> None:
+        '''
+        Assign ids for the node and create its input/output types, without creating the node itself. The node can be created on demand by `get_reserved()`.
+
+        The assigned ids are the same as calling `add_node()` for all nodes in the same order.
+        '''
         class_id = self._get_type_or_assign_id(info['name'], True)
         if not isinstance(class_id, str):
             print(f'ComfyScript: Node already exists: {info}')
             return
+        self._reserved_nodes[class_id] = info
+        self._reserved_names[info['name']] = class_id
+
+        # Same order as add_node()
+        for group in 'required', 'optional', 'hidden':
+            if group == 'hidden' and not self._hidden_inputs:
+                continue
+            group: dict = info['input'].get(group)
+            if group is None:
+                continue
+            for name, type_config in group.items():
+                type_info = type_config if isinstance(type_config, str) else type_config[0]
+                if isinstance(type_info, str) and type_info not in self._PRIMITIVE_INPUT_TYPES:
+                    self._get_node_output_type_or_new(type_info, name)
+        for type_info in info['output']:
+            if isinstance(type_info, str) and type_info not in ('*', 'COMBO'):
+                self._get_node_output_type_or_new(type_info, type_info)
+
+    def get_reserved(self, id: str) -> tuple[bool, Any]:
+        '''
+        Get a var by id, creating the reserved node if needed. Global enums will create the nodes that define them.
+
+        Returns `(found, var)`.
+        '''
+        info = self._reserved_nodes.pop(id, None)
+        if info is not None:
+            del self._reserved_names[info['name']]
+            try:
+                self.add_node(info, id)
+            except Exception as e:
+                print(f'ComfyScript: Failed to load node {info["name"]}')
+                traceback.print_exc()
+            return True, self._vars[id]
+
+        if id in self._vars and self._vars[id] is None:
+            for node_name, global_enum in self.GLOBAL_ENUMS.items():
+                if id in global_enum.values():
+                    class_id = self._reserved_names.get(node_name)
+                    if class_id is not None:
+                        self.get_reserved(class_id)
+            return True, self._vars[id]
+        
+        if id in self._vars and id not in self._reserved_nodes:
+            return True, self._vars[id]
+        return False, None
+
+    def get_reserved_node(self, name: str) -> Any | None:
+        '''Get a node by its raw name, creating it if reserved.'''
+        node = self.nodes.get(name)
+        if node is not None:
+            return node
+        class_id = self._reserved_names.get(name)
+        if class_id is None:
+            return None
+        return self.get_reserved(class_id)[1]
+
+    def materialized_vars(self) -> dict:
+        '''`vars()` without reserved nodes and unresolved global enums.'''
+        return { k: v for k, v in self._vars.items() if v is not None and k not in self._reserved_nodes }
+
+    def add_node(self, info: dict, class_id: str | None = None) -> None:
+        '''
+        - `class_id`: The id assigned by `reserve_node()`.
+        '''
+        if class_id is None:
+            class_id = self._get_type_or_assign_id(info['name'], True)
+            if not isinstance(class_id, str):
+                print(f'ComfyScript: Node already exists: {info}')
+                return
         enums = {}
         enum_type_stubs = ''
         input_defaults = {}
@@ -556,6 +685,10 @@ def {class_id}(
         
         self._node_type_stubs.append(c)
         
+        self._node_descriptors[info['name']] = (class_id, input_defaults, output_types, enums)
+        self._new_node_and_set_type(info, class_id, input_defaults, output_types, enums)
+
+    def _new_node_and_set_type(self, info: dict, class_id: str, input_defaults: dict, output_types: list[type], enums: dict[str, Enum]) -> None:
         node = self.new_node(info, input_defaults, output_types)
         for enum_id, enum in enums.items():
             setattr(node, enum_id, enum)
@@ -566,7 +699,155 @@ def {class_id}(
     def vars(self) -> dict:
         return self._vars
 
+    def _var_to_descriptor(self, v: Any) -> list:
+        if v is None:
+            return ['none']
+        if isinstance(v, type) and issubclass(v, Enum):
+            return _enum_to_descriptor(v)
+        raw_id = getattr(v, '_raw_id', None)
+        if raw_id is None:
+            raise TypeError(f'Unsupported var: {v}')
+        if getattr(v, '_node', None) is True:
+            if self.nodes.get(raw_id) is v:
+                return ['node', raw_id]
+            # The node failed to load
+            return ['placeholder', raw_id, True]
+        if isinstance(v, type) and issubclass(v, data.NodeOutput):
+            return ['data', raw_id]
+        return ['placeholder', raw_id, False]
+
+    def _output_type_to_descriptor(self, t: type) -> list:
+        if t is data.NodeOutput:
+            return ['any']
+        if t is bool:
+            return ['bool']
+        if self._vars.get(t.__name__) is t:
+            return ['var', t.__name__]
+        # Enum outputs
+        return ['output', t.__name__]
+
+    def descriptors(self) -> dict | None:
+        '''
+        Serialize the loaded nodes into a JSON-compatible dict, which can be restored by `load_descriptors()` without analyzing the nodes info and generating type stubs again.
+
+        `None` if not supported (`import_fullname_types`).
+        '''
+        if self._import_modules is not None:
+            return None
+        
+        vars = {}
+        for id, v in self._vars.items():
+            if id in self._init_var_ids:
+                continue
+            vars[id] = self._var_to_descriptor(v)
+        
+        nodes = {}
+        for name, (class_id, input_defaults, output_types, enums) in self._node_descriptors.items():
+            nodes[name] = {
+                'class_id': class_id,
+                'defaults': input_defaults,
+                'outputs': [self._output_type_to_descriptor(t) for t in output_types],
+                'enums': {
+                    enum_id: ['var', enum.__name__] if self._vars.get(enum.__name__) is enum else _enum_to_descriptor(enum)
+                    for enum_id, enum in enums.items()
+                },
+            }
+
+        return {
+            'vars': vars,
+            'nodes': nodes,
+            'type_stubs': self.type_stubs(),
+        }
+
+    def load_descriptors(self, descriptors: dict, nodes_info: dict) -> None:
+        '''
+        Restore the nodes from `descriptors()`. `nodes_info` must be the same as the one used to create the descriptors.
+        '''
+        vars_descriptors: dict[str, list] = descriptors['vars']
+
+        # Types must be created before nodes
+        for id, d in vars_descriptors.items():
+            kind = d[0]
+            if kind == 'none':
+                self._vars[id] = None
+            elif kind == 'enum':
+                self._vars[id] = _enum_from_descriptor(d)
+            elif kind == 'data':
+                self._set_type(d[1], id, type(id, (data.NodeOutput,), {}), False)
+            elif kind == 'placeholder':
+                self._vars[id] = type(id, (), { '_raw_id': d[1], '_node': d[2] })
+            elif kind == 'node':
+                # Keep the order of vars
+                self._vars[id] = type(id, (), { '_raw_id': d[1], '_node': True })
+        
+        for name, d in descriptors['nodes'].items():
+            output_types = []
+            for output in d['outputs']:
+                kind = output[0]
+                if kind == 'any':
+                    output_types.append(data.NodeOutput)
+                elif kind == 'bool':
+                    output_types.append(bool)
+                elif kind == 'var':
+                    output_types.append(self._vars[output[1]])
+                else:
+                    output_types.append(type(output[1], (data.NodeOutput,), {}))
+            
+            enums = {}
+            for enum_id, enum in d['enums'].items():
+                if enum[0] == 'var':
+                    enums[enum_id] = self._vars[enum[1]]
+                else:
+                    enums[enum_id] = _enum_from_descriptor(enum)
+            
+            self._new_node_and_set_type(nodes_info[name], d['class_id'], d['defaults'], output_types, enums)
+        
+        self._type_stubs = descriptors['type_stubs']
+
+    def _descriptors_cache_path(self, nodes_info_hash: str) -> Path:
+        from ..client.cache import cache_dir
+
+        key = hashlib.sha256('\n'.join([
+            str(self._DESCRIPTORS_VERSION),
+            type(self).__name__,
+            nodes_info_hash,
+            str(self._hidden_inputs),
+            str(self._max_enum_values),
+            *(self._enum_values.get('Embeddings') or []),
+        ]).encode('utf8')).hexdigest()
+        return cache_dir() / f'factory-{key[:16]}.json'
+
+    def read_descriptors_cache(self, nodes_info_hash: str) -> dict | None:
+        '''Must be called after `init()`.'''
+        try:
+            with open(self._descriptors_cache_path(nodes_info_hash), 'rb') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f'ComfyScript: Failed to read nodes cache: {e}')
+            return None
+
+    def write_descriptors_cache(self, nodes_info_hash: str) -> None:
+        from ..client.cache import _write_atomic
+
+        try:
+            descriptors = self.descriptors()
+            if descriptors is None:
+                return
+            path = self._descriptors_cache_path(nodes_info_hash)
+            _write_atomic(path, json.dumps(descriptors).encode('ascii'))
+
+            # Remove old caches
+            caches = sorted(path.parent.glob('factory-*.json'), key=lambda p: p.stat().st_mtime, reverse=True)
+            for old in caches[self._DESCRIPTORS_CACHE_MAX_FILES:]:
+                old.unlink(missing_ok=True)
+        except Exception as e:
+            print(f'ComfyScript: Failed to write nodes cache: {e}')
+
     def type_stubs(self) -> str:
+        if self._type_stubs is not None:
+            return self._type_stubs
         c = (
 '''from __future__ import annotations
 from typing import Any
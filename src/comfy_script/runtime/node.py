@@ -1,6 +1,33 @@
-from typing import Any
+from typing import Any, Callable
 
-nodes: dict[str, Any] = {}
+class LazyNodes(dict):
+    '''A dict that creates nodes on first access in lazy mode. Iterating it only yields the nodes that have been created.'''
+
+    resolver: Callable[[str], Any | None] | None = None
+    '''Create a node by its name. `None` if the node does not exist.'''
+    names: Callable[[str], bool] | None = None
+    '''Whether a node exists, without creating it.'''
+
+    def __missing__(self, name: str) -> Any:
+        if self.resolver is not None:
+            node = self.resolver(name)
+            if node is not None:
+                self[name] = node
+                return node
+        raise KeyError(name)
+
+    def get(self, name: str, default: Any = None) -> Any:
+        try:
+            return self[name]
+        except KeyError:
+            return default
+    
+    def __contains__(self, name: object) -> bool:
+        if super().__contains__(name):
+            return True
+        return self.names is not None and isinstance(name, str) and self.names(name)
+
+nodes: dict[str, Any] = LazyNodes()
 '''A dict of loaded nodes keyed by their raw names. Compared to `comfy_script.runtime.nodes` module, `nodes` is more suitable for programmatic access.
 
 Example:
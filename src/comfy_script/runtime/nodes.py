@@ -1,32 +1,165 @@
 # Do not import classes here. They may be overridden by custom nodes.
 from __future__ import annotations
+import asyncio
 import pathlib
+import threading
 import traceback
 import typing
 
 from . import factory
 from . import data
+from . import node
 
 class VirtualRuntimeFactory(factory.RuntimeFactory):
     def new_node(self, info: dict, defaults: dict, output_types: list[type]):
         return Node(info, defaults, output_types)
 
-async def load(nodes_info: dict, vars: dict | None, *, nodes: dict[str, typing.Any] | None = None) -> None:
+_lazy_factory: VirtualRuntimeFactory | None = None
+_lazy_nodes: node.LazyNodes | None = None
+_lazy_lock = threading.RLock()
+
+def _get_lazy(id: str) -> tuple[bool, typing.Any]:
+    with _lazy_lock:
+        fact = _lazy_factory
+        if fact is None:
+            return False, None
+        found, v = fact.get_reserved(id)
+        if found:
+            _export_vars(fact.materialized_vars())
+            if _lazy_nodes is not None:
+                # Only created nodes
+                dict.update(_lazy_nodes, fact.nodes)
+        return found, v
+
+def _get_lazy_node(name: str) -> typing.Any | None:
+    with _lazy_lock:
+        fact = _lazy_factory
+        if fact is None:
+            return None
+        node = fact.get_reserved_node(name)
+        if node is not None:
+            _export_vars(fact.materialized_vars())
+        return node
+
+def _has_lazy_node(name: str) -> bool:
+    with _lazy_lock:
+        fact = _lazy_factory
+        return fact is not None and (name in fact.nodes or name in fact._reserved_names)
+
+def _export_vars(vars: dict) -> None:
+    g = globals()
+    new = []
+    for k, v in vars.items():
+        if g.get(k) is not v:
+            g[k] = v
+            new.append(k)
+    _extend_all(new)
+
+def _extend_all(names: typing.Iterable[str]) -> None:
+    exported = set(__all__)
+    __all__.extend(name for name in names if name not in exported)
+
+def __getattr__(name: str) -> typing.Any:
+    '''Create nodes on first access in lazy mode.'''
+    found, v = _get_lazy(name)
+    if found:
+        return v
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def _write_type_stubs_in_background(nodes_info: dict, nodes_info_hash: str | None) -> None:
+    async def f():
+        fact = VirtualRuntimeFactory()
+        await fact.init()
+        for node_info in nodes_info.values():
+            try:
+                fact.add_node(node_info)
+            except Exception as e:
+                # Already printed by the lazy factory
+                pass
+        if nodes_info_hash is not None:
+            fact.write_descriptors_cache(nodes_info_hash)
+        factory._write_type_stubs(pathlib.Path(__file__).resolve().with_suffix('.pyi'), fact.type_stubs())
+    
+    threading.Thread(target=asyncio.run, args=(f(),), daemon=True).start()
+
+async def load(nodes_info: dict, vars: dict | None, *, nodes: dict[str, typing.Any] | None = None, nodes_info_hash: str | None = None, lazy: bool = False) -> None:
+    '''
+    - `nodes_info_hash`: The hash of `nodes_info`. If specified, the loaded nodes will be restored from or saved to the on-disk cache, keyed by the hash. See `RuntimeFactory.descriptors()` for details.
+
+    - `lazy`: Only assign ids for nodes, and create each node and its enums on first access, either by `getattr()` on this module (including `from comfy_script.runtime.nodes import KSampler`) or by `nodes`. Type stubs are taken from the cache or generated in a background thread.
+
+      Nodes are not included in `__all__` and `vars` until they are accessed, so `from comfy_script.runtime.nodes import *` only imports types and accessed nodes.
+    '''
+    global _lazy_factory, _lazy_nodes
+
     fact = VirtualRuntimeFactory()
     await fact.init()
-    
-    for node_info in nodes_info.values():
+
+    descriptors = None
+    if nodes_info_hash is not None:
+        descriptors = fact.read_descriptors_cache(nodes_info_hash)
+
+    if lazy:
+        for node_info in nodes_info.values():
+            try:
+                fact.reserve_node(node_info)
+            except Exception as e:
+                print(f'ComfyScript: Failed to load node {node_info["name"]}')
+                traceback.print_exc()
+        
+        with _lazy_lock:
+            _lazy_factory = fact
+            _lazy_nodes = nodes if isinstance(nodes, node.LazyNodes) else None
+        if isinstance(nodes, node.LazyNodes):
+            nodes.resolver = _get_lazy_node
+            nodes.names = _has_lazy_node
+        
+        vars_ = fact.materialized_vars()
+        globals().update(vars_)
+        _extend_all(vars_.keys())
+        if vars is not None:
+            vars.update(vars_)
+
+        # nodes.pyi
+        if descriptors is not None:
+            factory._write_type_stubs(pathlib.Path(__file__).resolve().with_suffix('.pyi'), descriptors['type_stubs'])
+        else:
+            _write_type_stubs_in_background(nodes_info, nodes_info_hash)
+        return
+
+    with _lazy_lock:
+        _lazy_factory = None
+        _lazy_nodes = None
+    if isinstance(nodes, node.LazyNodes):
+        nodes.resolver = None
+        nodes.names = None
+
+    if descriptors is not None:
         try:
-            fact.add_node(node_info)
+            fact.load_descriptors(descriptors, nodes_info)
         except Exception as e:
-            print(f'ComfyScript: Failed to load node {node_info["name"]}')
+            print(f'ComfyScript: Failed to load nodes from cache, rebuilding')
             traceback.print_exc()
+            descriptors = None
+            fact = VirtualRuntimeFactory()
+            await fact.init()
+    
+    if descriptors is None:
+        for node_info in nodes_info.values():
+            try:
+                fact.add_node(node_info)
+            except Exception as e:
+                print(f'ComfyScript: Failed to load node {node_info["name"]}')
+                traceback.print_exc()
+        
+        if nodes_info_hash is not None:
+            fact.write_descriptors_cache(nodes_info_hash)
 
     if nodes is not None:
         nodes.update(fact.nodes)
 
     globals().update(fact.vars())
-    __all__.extend(fact.vars().keys())
+    _extend_all(fact.vars().keys())
 
     # if vars is None:
     #     # TODO: Or __builtins__?
@@ -35,8 +168,7 @@ async def load(nodes_info: dict, vars: dict | None, *, nodes: dict[str, typing.A
         vars.update(fact.vars())
 
     # nodes.pyi
-    with open(pathlib.Path(__file__).resolve().with_suffix('.pyi'), 'w', encoding='utf8') as f:
-        f.write(fact.type_stubs())
+    factory._write_type_stubs(pathlib.Path(__file__).resolve().with_suffix('.pyi'), fact.type_stubs())
 
 def _positional_args_to_keyword(node: dict, args: tuple) -> dict:
     args = list(args)
@@ -74,7 +206,7 @@ class Node:
                 del inputs[k]
             elif isinstance(v, data.NodeOutput) and v.output_slot is None:
                 raise TypeError(f'Argument "{k}" is an empty output: {v}')
-        inputs = self.defaults | inputs
+        inputs = data.NodeInputs(self.defaults | inputs)
 
         node_prompt = {
             'inputs': inputs,
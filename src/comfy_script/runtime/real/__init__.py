@@ -1,5 +1,4 @@
 from __future__ import annotations
-import asyncio
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Callable, MutableMapping
@@ -33,7 +32,7 @@ def load(comfyui: Path | str = None, args: ComfyUIArgs | None = None, vars: dict
     elif config is None:
         config = RealModeConfig()
     node.nodes.clear()
-    asyncio.run(nodes.load(nodes_info, vars, config, nodes=node.nodes))
+    client.event_loop_thread.run(nodes.load(nodes_info, vars, config, nodes=node.nodes))
 
 class Workflow:
     # TODO: Thread-safe
@@ -45,7 +44,7 @@ class Workflow:
         cache: MutableMapping | Callable[[str], MutableMapping] | None = None
     ):
         '''
-        - `cache`: Use `dict` (`{}`) for simple unbounded cache. For advanced cache, [cachetools](https://github.com/tkem/cachetools) or other libraries can be used.
+        - `cache`: Use `dict` (`{}`) for simple unbounded cache. Use `NodeOutputCache` for LRU cache bounded by the size of outputs, with optional per-node-type budgets and TTL. [cachetools](https://github.com/tkem/cachetools) or other libraries can also be used.
 
           To use different cache for different types of nodes, pass a callable that accepts the node name and returns a cache. For example:
           ```
@@ -65,6 +64,13 @@ class Workflow:
         self._cache = cache
         self._node_cache = {}
 
+    @property
+    def cache_stats(self) -> NodeOutputCacheStats | None:
+        '''Hit/miss/eviction stats of the cache. Only available with `NodeOutputCache`.'''
+        if isinstance(self._cache, NodeOutputCache):
+            return self._cache.stats
+        return None
+
     def __enter__(self) -> Workflow:
         Workflow._instance = self
 
@@ -86,6 +92,12 @@ class Workflow:
     def _get_cache(self, node: str) -> MutableMapping | None:
         if self._cache is None:
             return None
+        elif isinstance(self._cache, NodeOutputCache):
+            cache = self._node_cache.get(node, None)
+            if cache is None:
+                cache = self._cache.for_node(node)
+                self._node_cache[node] = cache
+            return cache
         elif isinstance(self._cache, MutableMapping):
             return self._cache
         else:
@@ -175,12 +187,15 @@ from .. import ComfyUIArgs, start_comfyui
 from . import node
 from . import nodes
 from . import util
+from .cache import NodeOutputCache, NodeOutputCacheStats
 
 __all__ = [
     'load',
     'ComfyUIArgs',
     'RealModeConfig',
     'Workflow',
+    'NodeOutputCache',
+    'NodeOutputCacheStats',
     'node',
     'util'
 ]
\ No newline at end of file
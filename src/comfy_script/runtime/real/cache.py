@@ -0,0 +1,240 @@
+'''Caches of node outputs for real mode `Workflow`.'''
+from __future__ import annotations
+from collections import OrderedDict
+from dataclasses import dataclass
+import sys
+import threading
+import time
+from typing import Any, Callable, Iterator, MutableMapping
+
+def sizeof(obj: Any) -> int:
+    '''
+    Estimate the memory size of a node output in bytes.
+
+    Tensors are counted by their elements, models (e.g. `ModelPatcher`) by `model_size()`, and containers (e.g. latents, conditionings) by their items. Objects shared by multiple containers are only counted once.
+    '''
+    torch = sys.modules.get('torch')
+    seen = set()
+
+    def size(o) -> int:
+        # RealNodeOutputWrapper
+        o = getattr(o, '__wrapped__', o)
+        if id(o) in seen:
+            return 0
+        seen.add(id(o))
+
+        if torch is not None and isinstance(o, torch.Tensor):
+            return o.nelement() * o.element_size()
+        elif isinstance(o, dict):
+            return sys.getsizeof(o) + sum(size(v) for v in o.values())
+        elif isinstance(o, (list, tuple)):
+            return sys.getsizeof(o) + sum(size(v) for v in o)
+        model_size = getattr(o, 'model_size', None)
+        if callable(model_size):
+            try:
+                return int(model_size())
+            except Exception:
+                pass
+        return sys.getsizeof(o)
+
+    return size(obj)
+
+@dataclass
+class NodeOutputCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    '''Entries evicted to keep the cache within `max_bytes`, `max_items` or `node_max_bytes`.'''
+    expirations: int = 0
+    '''Entries removed because they had lived longer than `ttl`.'''
+    rejections: int = 0
+    '''Outputs not cached because they were larger than the budget.'''
+    items: int = 0
+    bytes: int = 0
+
+    def __str__(self) -> str:
+        return f'Hits: {self.hits}, misses: {self.misses}, evictions: {self.evictions}, expirations: {self.expirations}, rejections: {self.rejections}, items: {self.items}, bytes: {self.bytes}'
+
+class _Entry:
+    __slots__ = ('value', 'size', 'node', 'time')
+
+    def __init__(self, value, size: int, node: str | None, time: float):
+        self.value = value
+        self.size = size
+        self.node = node
+        self.time = time
+
+class NodeOutputCache(MutableMapping):
+    '''
+    A size-aware LRU cache for `Workflow(cache=...)`.
+
+    - `max_bytes`: The maximum total size of cached outputs, estimated by `getsizeof`. Least recently used outputs are evicted when it is exceeded.
+    - `max_items`: The maximum number of cached outputs.
+    - `node_max_bytes`: The maximum total size of outputs of specific types of nodes, e.g. `{'VAEDecode': 2 * 2**30}`.
+    - `ttl`: Outputs are expired after `ttl` seconds.
+    - `getsizeof`: Estimate the size of an output. `sizeof()` by default.
+
+    Example:
+    ```
+    with Workflow(cache=NodeOutputCache(max_bytes=8 * 2**30, node_max_bytes={'VAEDecode': 2 * 2**30}, ttl=3600)) as wf:
+        ...
+    print(wf.cache_stats)
+    ```
+    '''
+
+    def __init__(
+        self,
+        max_bytes: int | None = None,
+        *,
+        max_items: int | None = None,
+        node_max_bytes: dict[str, int] | None = None,
+        ttl: float | None = None,
+        getsizeof: Callable[[Any], int] = sizeof,
+    ):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.node_max_bytes = node_max_bytes or {}
+        self.ttl = ttl
+        self.getsizeof = getsizeof
+        self.stats = NodeOutputCacheStats()
+        self._entries: OrderedDict[Any, _Entry] = OrderedDict()
+        self._node_bytes: dict[str | None, int] = {}
+        self._lock = threading.RLock()
+
+    def for_node(self, node: str) -> MutableMapping:
+        '''A view of the cache that accounts the outputs to `node` for `node_max_bytes`. Used by `Workflow`.'''
+        return _NodeOutputCacheView(self, node)
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return self.ttl is not None and now - entry.time > self.ttl
+
+    def _remove(self, key) -> _Entry:
+        entry = self._entries.pop(key)
+        self.stats.bytes -= entry.size
+        self.stats.items -= 1
+        self._node_bytes[entry.node] -= entry.size
+        return entry
+
+    def _evict(self, node: str | None) -> None:
+        now = time.monotonic()
+        if self.ttl is not None:
+            # Entries are ordered by use, not by time
+            for key in [key for key, entry in self._entries.items() if self._expired(entry, now)]:
+                self._remove(key)
+                self.stats.expirations += 1
+
+        node_max_bytes = self.node_max_bytes.get(node)
+        if node_max_bytes is not None:
+            for key in [key for key, entry in self._entries.items() if entry.node == node]:
+                if self._node_bytes[node] <= node_max_bytes:
+                    break
+                self._remove(key)
+                self.stats.evictions += 1
+
+        while self._entries and (
+            (self.max_bytes is not None and self.stats.bytes > self.max_bytes)
+            or (self.max_items is not None and self.stats.items > self.max_items)
+        ):
+            self._remove(next(iter(self._entries)))
+            self.stats.evictions += 1
+
+    def _get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, time.monotonic()):
+                self._remove(key)
+                self.stats.expirations += 1
+                entry = None
+            if entry is None:
+                self.stats.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return entry.value
+
+    def _set(self, key, value, node: str | None) -> None:
+        size = self.getsizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            budget = min(
+                (b for b in (self.max_bytes, self.node_max_bytes.get(node)) if b is not None),
+                default=None
+            )
+            if budget is not None and size > budget:
+                self.stats.rejections += 1
+                return
+            self._entries[key] = _Entry(value, size, node, time.monotonic())
+            self.stats.bytes += size
+            self.stats.items += 1
+            self._node_bytes[node] = self._node_bytes.get(node, 0) + size
+            self._evict(node)
+
+    def get(self, key, default=None):
+        return self._get(key, default)
+
+    def __getitem__(self, key):
+        value = self._get(key, _missing)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value) -> None:
+        self._set(key, value, None)
+
+    def __delitem__(self, key) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not self._expired(entry, time.monotonic())
+
+    def __iter__(self) -> Iterator:
+        with self._lock:
+            return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._node_bytes.clear()
+            self.stats.items = 0
+            self.stats.bytes = 0
+
+_missing = object()
+
+class _NodeOutputCacheView(MutableMapping):
+    def __init__(self, cache: NodeOutputCache, node: str):
+        self._cache = cache
+        self._node = node
+
+    def get(self, key, default=None):
+        return self._cache._get(key, default)
+
+    def __getitem__(self, key):
+        return self._cache[key]
+
+    def __setitem__(self, key, value) -> None:
+        self._cache._set(key, value, self._node)
+
+    def __delitem__(self, key) -> None:
+        del self._cache[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self._cache
+
+    def __iter__(self) -> Iterator:
+        return iter(self._cache)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+__all__ = [
+    'sizeof',
+    'NodeOutputCacheStats',
+    'NodeOutputCache',
+]
@@ -1,6 +1,8 @@
 # Do not import classes here. They may be overridden by custom nodes.
 from __future__ import annotations
+import hashlib
 import inspect
+import json
 import pathlib
 import traceback
 import typing
@@ -9,7 +11,8 @@ import wrapt
 
 from .. import real
 from .. import factory
-from ..nodes import _positional_args_to_keyword, Node as VirtualNode
+from ..nodes import Node as VirtualNode
+from ..data import NodeOutput as VirtualNodeOutput
 
 _comfy_api_NodeOutput = None
 
@@ -45,17 +48,88 @@ async def load(nodes_info: dict, vars: dict | None, config: real.RealModeConfig,
         vars.update(fact.vars())
 
     # nodes.pyi
-    with open(pathlib.Path(__file__).resolve().with_suffix('.pyi'), 'w', encoding='utf8') as f:
-        stubs = fact.type_stubs()
-        try:
-            f.write(stubs)
-        except UnicodeEncodeError:
-            # Replace invalid chars in type stubs with '�'
-            # e.g. #87
-            f.write(stubs.encode('utf8', 'surrogateescape').decode('utf8', 'replace'))
+    factory._write_type_stubs(pathlib.Path(__file__).resolve().with_suffix('.pyi'), fact.type_stubs())
     
     _load_import()
 
+def _cache_key_default(o):
+    if isinstance(o, pathlib.PurePath):
+        return str(o)
+    raise TypeError
+
+_cache_key_encoder = json.JSONEncoder(sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=_cache_key_default)
+
+def _cache_key(name: str, virtual_kwds: dict) -> str | None:
+    '''
+    The cache key of a node call. Links are keyed by the keys of upstream nodes, so the key covers the whole upstream graph without walking it.
+
+    `None` if any input cannot be keyed, e.g. a tensor passed in by user code.
+    '''
+    inputs = {}
+    for k, v in virtual_kwds.items():
+        if isinstance(v, VirtualNodeOutput):
+            key = _get_cache_key(v)
+            if key is None:
+                return None
+            inputs[k] = [key, v.output_slot]
+        else:
+            inputs[k] = v
+    try:
+        s = _cache_key_encoder.encode([name, inputs])
+    except (TypeError, ValueError):
+        return None
+    return hashlib.sha256(s.encode('utf8', 'surrogatepass')).hexdigest()
+
+def _get_cache_key(output: VirtualNodeOutput) -> str | None:
+    '''The cache key of the call that created `output`. Keys are only computed when a cache needs them, as encoding the inputs is not free.'''
+    key = output._cache_key
+    if isinstance(key, tuple):
+        key = output._cache_key = _cache_key(*key)
+    return key
+
+class _CallPlan:
+    '''Per-node information used by each call, computed once when the node is loaded instead of on every call.'''
+    __slots__ = ('name', 'arg_names', 'bool_enums', 'hidden', 'valid_kwds')
+
+    _UNSET = object()
+
+    def __init__(self, info: dict):
+        self.name: str = info['name']
+        self.arg_names: list[str] = []
+        self.bool_enums: dict[str, tuple[str | bool, str | bool]] = {}
+        '''`{name: (false_value, true_value)}`. See `RuntimeFactory._map_input()`.'''
+        seen = set()
+        for group in 'required', 'optional':
+            group: dict = info['input'].get(group)
+            if group is None:
+                continue
+            for name, config in group.items():
+                self.arg_names.append(name)
+                # The first group takes precedence, the same as `_map_input()`
+                if name in seen:
+                    continue
+                seen.add(name)
+                input_type = config[0] if isinstance(config, (list, tuple)) and config else None
+                if isinstance(input_type, list) and factory.is_bool_enum(input_type):
+                    self.bool_enums[name] = (factory.to_bool_enum(input_type, False), factory.to_bool_enum(input_type, True))
+        self.hidden: dict | None = info['input'].get('hidden')
+        self.valid_kwds: set[str] | None = _CallPlan._UNSET
+        '''Set on the first call, because `FUNCTION` is only available on the instance.'''
+
+    def args_to_kwds(self, args: tuple) -> dict:
+        '''Equivalent to `_positional_args_to_keyword()`.'''
+        if len(args) > len(self.arg_names):
+            print(f'ComfyScript: {self.name} has more positional arguments than expected: {list(args[len(self.arg_names):])}')
+        return dict(zip(self.arg_names, args))
+
+    def map_inputs(self, kwds: dict) -> dict:
+        '''Equivalent to mapping `RuntimeFactory._map_input()` over `kwds`, in place.'''
+        for k, values in self.bool_enums.items():
+            v = kwds.get(k)
+            if v is True or v is False:
+                kwds[k] = values[v]
+        return kwds
+
 class RealNodeOutputWrapper(wrapt.ObjectProxy):
     def __repr__(self):
         return repr(self.__wrapped__)
@@ -97,9 +171,12 @@ class RealRuntimeFactory(factory.RuntimeFactory):
             if config.track_workflow:
                 virtual_node = VirtualNode(info, defaults, output_types, pack_single_output=True)
 
-            def new(cls, *args, _comfy_script_v=(orginal_new, cls, info, defaults, config, virtual_node), **kwds):
-                original_new, original_cls, info, defaults, config, virtual_node = _comfy_script_v
+            plan = _CallPlan(info)
+
+            def new(cls, *args, _comfy_script_v=(orginal_new, cls, info, defaults, config, virtual_node, plan), **kwds):
+                original_new, original_cls, info, defaults, config, virtual_node, plan = _comfy_script_v
                 config: real.RealModeConfig
+                plan: _CallPlan
 
                 # `new_node` will inject `create` method and factory will inject enums.
                 # These attrs may cause conflict (e.g. #112), so we create the instance with the original class.
@@ -111,20 +188,19 @@ class RealRuntimeFactory(factory.RuntimeFactory):
                 # args = tuple(map(self._map_arg, args))
                 # kwds = { k: self._map_arg(v) for k, v in kwds.items() }
 
-                # TODO: LazyCell
                 if config.args_to_kwds:
                     # kwds should take precedence over args
-                    kwds = _positional_args_to_keyword(info, args) | kwds
+                    kwds = plan.args_to_kwds(args) | kwds
                     args = ()
                     if config.map_inputs:
-                        kwds = { k: RealRuntimeFactory._map_input(k, v, info) for k, v in kwds.items() }
+                        kwds = plan.map_inputs(kwds)
                 
                 kwds_without_defaults = kwds
                 if config.use_config_defaults:
                     if config.args_to_kwds:
                         kwds = defaults | kwds
                     else:
-                        pos_kwds = _positional_args_to_keyword(info, args)
+                        pos_kwds = plan.args_to_kwds(args)
                         kwds = { k: v for k, v in defaults.items() if k not in pos_kwds } | kwds
                 
                 has_hidden_prompt_input = False
@@ -143,10 +219,15 @@ class RealRuntimeFactory(factory.RuntimeFactory):
                     except Exception as e:
                         print(f'ComfyScript: track_workflow: Failed to call {info["name"]}: {e}')
 
+                    if virtual_outputs is not None:
+                        # Computed by `_get_cache_key()` on demand
+                        call = (info['name'], virtual_kwds)
+                        for virtual_output in virtual_outputs:
+                            virtual_output._cache_key = call
+
                     if virtual_outputs is not None and config.trace_workflow_inject_inputs:
-                        hidden = info['input'].get('hidden')
+                        hidden = plan.hidden
                         if hidden is not None:
-                            # TODO: LazyCell
                             prompt, id = None, None
                             for k, v in hidden.items():
                                 if k in kwds_without_defaults:
@@ -173,16 +254,19 @@ class RealRuntimeFactory(factory.RuntimeFactory):
                         if not config.track_workflow:
                             warn('Workflow cache requires `track_workflow` to work')
                             cache = None
+                        elif virtual_outputs is None or (cache_key := _get_cache_key(virtual_outputs[0])) is None:
+                            cache = None
                         else:
-                            # TODO: Or FrozenDict?
-                            prompt = virtual_outputs[0].api_format_json()
-                            outputs = cache.get(prompt, None)
+                            for virtual_output in virtual_outputs:
+                                virtual_output._cache_key = cache_key
+                            outputs = cache.get(cache_key, None)
                             if outputs is not None:
                                 return outputs
 
                 # Filter out invalid kwds
-                # TODO: LazyCell
-                valid_kwds = self._get_valid_kwds(getattr(obj, obj.FUNCTION))
+                valid_kwds = plan.valid_kwds
+                if valid_kwds is _CallPlan._UNSET:
+                    valid_kwds = plan.valid_kwds = RealRuntimeFactory._get_valid_kwds(getattr(obj, obj.FUNCTION))
                 if valid_kwds is not None:
                     filtered_kwds = { k: v for k, v in kwds.items() if k in valid_kwds }
                     if len(filtered_kwds) != len(kwds) and not has_hidden_prompt_input:
@@ -213,7 +297,7 @@ class RealRuntimeFactory(factory.RuntimeFactory):
                             print(f"ComfyScript: {info['name']}: expand output: {expand}")
 
                         outputs = outputs['result']
-                    elif isinstance(outputs, _comfy_api_NodeOutput) and _comfy_api_NodeOutput is not None:
+                    elif _comfy_api_NodeOutput is not None and isinstance(outputs, _comfy_api_NodeOutput):
                         # v3 schema (#113)
                         if outputs.ui:
                             print(f"ComfyScript: {info['name']}: ui output: {outputs.ui}")
@@ -238,7 +322,7 @@ class RealRuntimeFactory(factory.RuntimeFactory):
                 
                 # Cache outputs
                 if cache is not None:
-                    cache[prompt] = outputs
+                    cache[cache_key] = outputs
                 
                 return outputs
             
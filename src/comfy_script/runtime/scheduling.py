@@ -0,0 +1,132 @@
+'''Client-side scheduling of prompts by job classes and tenants.'''
+from __future__ import annotations
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+import statistics
+import threading
+
+import asyncio
+
+@dataclass(eq=False)
+class _Pending:
+    '''A prompt held locally until the scheduler grants it a slot of `max_in_flight`.'''
+    job_class: str
+    tenant: str | None
+    loop: asyncio.AbstractEventLoop
+    future: asyncio.Future
+
+class LatencyStats:
+    '''Latencies in seconds of the recent tasks of a job class.'''
+
+    def __init__(self, maxlen: int = 1000):
+        self.waits: deque[float] = deque(maxlen=maxlen)
+        '''Time from `put()` to posting the prompt, i.e. how long the prompt is held locally.'''
+        self.latencies: deque[float] = deque(maxlen=maxlen)
+        '''Time from `put()` to the task being resolved.'''
+        self.count = 0
+        '''The number of resolved tasks.'''
+        self._lock = threading.Lock()
+
+    def _add_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.waits.append(seconds)
+
+    def _add_latency(self, seconds: float) -> None:
+        with self._lock:
+            self.latencies.append(seconds)
+            self.count += 1
+
+    def percentile(self, p: float, *, wait: bool = False) -> float | None:
+        '''
+        - `p`: 0 to 100.
+        - `wait`: Use `waits` instead of `latencies`.
+
+        `None` if there are no samples.
+        '''
+        with self._lock:
+            samples = sorted(self.waits if wait else self.latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+    def __str__(self) -> str:
+        with self._lock:
+            waits = list(self.waits)
+            latencies = list(self.latencies)
+        if not latencies:
+            return f'{self.count} tasks'
+        return f'{self.count} tasks, wait: mean {statistics.fmean(waits):.3f}s, p95 {self.percentile(95, wait=True):.3f}s, latency: mean {statistics.fmean(latencies):.3f}s, p50 {self.percentile(50):.3f}s, p95 {self.percentile(95):.3f}s'
+
+class Scheduler:
+    '''
+    Decide which prompt is posted next when `queue.max_in_flight` is reached:
+    - Job classes with higher priorities first.
+    - Within a job class, tenants take turns (round-robin), so one tenant's batch cannot starve the others.
+    - Within a tenant, first in, first out.
+
+    ComfyUI's queue is FIFO, so the scheduler only takes effect when prompts are held locally, i.e. `queue.max_in_flight` is set to a small window (e.g. 2) that is just enough to keep the server busy.
+
+    Methods other than `stats` are called by `TaskQueue` with its lock held.
+    '''
+
+    def __init__(self, classes: dict[str, int] | None = None):
+        '''
+        - `classes`: Priorities of job classes. Higher values are posted first. By default, `'interactive'` (1), `'default'` (0) and `'batch'` (-1).
+        '''
+        self.classes = dict(classes) if classes is not None else {'interactive': 1, 'default': 0, 'batch': -1}
+        self.stats: dict[str, LatencyStats] = {}
+        '''Latency stats of each job class.'''
+        self._queues: dict[str, OrderedDict[str | None, deque[_Pending]]] = {}
+        '''Pending prompts of each job class, grouped by tenants in round-robin order.'''
+        self._len = 0
+
+    def __len__(self) -> int:
+        '''The number of prompts held locally.'''
+        return self._len
+
+    def _check_class(self, job_class: str) -> None:
+        if job_class not in self.classes:
+            raise ValueError(f'ComfyScript: Unknown job class: {job_class!r}, expected one of {list(self.classes)}')
+
+    def _get_stats(self, job_class: str) -> LatencyStats:
+        stats = self.stats.get(job_class)
+        if stats is None:
+            stats = self.stats.setdefault(job_class, LatencyStats())
+        return stats
+
+    def _push(self, pending: _Pending) -> None:
+        tenants = self._queues.setdefault(pending.job_class, OrderedDict())
+        tenants.setdefault(pending.tenant, deque()).append(pending)
+        self._len += 1
+
+    def _pop(self) -> _Pending | None:
+        if not self._len:
+            return None
+        job_class = max((c for c, tenants in self._queues.items() if tenants), key=self.classes.__getitem__)
+        tenants = self._queues[job_class]
+        tenant, prompts = next(iter(tenants.items()))
+        pending = prompts.popleft()
+        if prompts:
+            # The tenant's turn is over
+            tenants.move_to_end(tenant)
+        else:
+            del tenants[tenant]
+        self._len -= 1
+        return pending
+
+    def _remove(self, pending: _Pending) -> bool:
+        '''Return `False` if the prompt is not pending, i.e. it has been granted a slot.'''
+        tenants = self._queues.get(pending.job_class)
+        prompts = tenants.get(pending.tenant) if tenants is not None else None
+        if prompts is None or pending not in prompts:
+            return False
+        prompts.remove(pending)
+        if not prompts:
+            del tenants[pending.tenant]
+        self._len -= 1
+        return True
+
+__all__ = [
+    'LatencyStats',
+    'Scheduler',
+]
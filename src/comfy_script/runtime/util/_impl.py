@@ -84,6 +84,8 @@ def get_images(value: 'Image | real.Image', *, save: bool = False) -> list[PIL.I
     util.get_images(EmptyImage(batch_size=2), save=True)
     ```
 
+    In virtual mode, if ComfyScript is installed as a custom node of the server, images are sent over the websocket by `ComfyScriptSendImage` without being saved to the disk, unless `save` is `True`.
+
     Required custom nodes:
     - Virtual mode: None
     - Real mode: ComfyUI_Ib_CustomNodes (installed with ComfyScript by default)
@@ -96,9 +98,10 @@ def get_images(value: 'Image | real.Image', *, save: bool = False) -> list[PIL.I
     if save:
         SaveImage: 'type[SaveImage]' = node.nodes['SaveImage']
         result = SaveImage(value).wait()
+    elif ComfyScriptSendImage := node.get('ComfyScriptSendImage'):
+        result = ComfyScriptSendImage(value).wait()
     else:
         # ComfyUI has no built-in API to get images without saving them to the disk (except for previews).
-        # TODO: ETNSendImageWebSocket
         PreviewImage: 'type[PreviewImage]' = node.nodes['PreviewImage']
         result = PreviewImage(value).wait()
     assert isinstance(result, data.ImageBatchResult), 'The value is not image'
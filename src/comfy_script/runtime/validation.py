@@ -0,0 +1,148 @@
+'''Client-side validation of API-format prompts against nodes info.'''
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any
+
+@dataclass
+class PromptError:
+    '''An error of a node in a prompt. `type` is one of the error types used by ComfyUI, e.g. `'required_input_missing'`.'''
+    node_id: str
+    class_type: str
+    type: str
+    message: str
+    input: str | None = None
+
+    def __str__(self) -> str:
+        return f'{self.node_id}: {self.message}'
+
+def _is_link(value: Any) -> bool:
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[1], int)
+
+def _types_match(received_type: str, input_type: str) -> bool:
+    # See ComfyUI::comfy_execution.validation.validate_node_input()
+    if received_type == input_type or received_type == '*' or input_type == '*':
+        return True
+    received_types = { t.strip() for t in received_type.split(',') }
+    input_types = { t.strip() for t in input_type.split(',') }
+    return not received_types.isdisjoint(input_types)
+
+class _NodeValidator:
+    '''Input specs of a node type, compiled for `PromptValidator`.'''
+
+    __slots__ = ('required', 'link_types', 'numbers', 'enums', 'output_types')
+
+    def __init__(self, info: dict):
+        self.required: tuple[str, ...] = ()
+        self.link_types: dict[str, str] = {}
+        self.numbers: dict[str, tuple[type, float | None, float | None]] = {}
+        self.enums: dict[str, frozenset] = {}
+        self.output_types: list = list(info.get('output') or [])
+
+        custom_validated = compat._get_custom_validated(info)
+        if custom_validated is None:
+            return
+
+        required = []
+        for group, name, type_info, config in compat._iter_input_specs(info):
+            if group == 'required':
+                required.append(name)
+            if type_info is None:
+                continue
+
+            if isinstance(type_info, (list, tuple)) or type_info == 'COMBO':
+                if name in custom_validated:
+                    continue
+                enum = compat._get_enum(type_info, config)
+                if enum is not None:
+                    self.enums[name] = enum
+            elif type_info in ('INT', 'FLOAT'):
+                if name in custom_validated:
+                    continue
+                self.numbers[name] = (int if type_info == 'INT' else float, config.get('min'), config.get('max'))
+            elif isinstance(type_info, str) and 'input_types' not in custom_validated:
+                self.link_types[name] = type_info
+        self.required = tuple(required)
+
+class PromptValidator:
+    '''
+    Validate API-format prompts against nodes info before posting them, like the validation of ComfyUI:
+    - Required inputs are given.
+    - Linked outputs exist and their types match the inputs.
+    - Numbers are within `min` and `max`.
+    - Enum values are in the lists.
+
+    Node types are compiled on first use, so validating a prompt only costs a few dict lookups per input.
+    '''
+
+    def __init__(self, nodes_info: dict):
+        self._nodes_info = nodes_info
+        self._validators: dict[str, _NodeValidator] = {}
+
+    def _get_validator(self, class_type: str) -> _NodeValidator | None:
+        validator = self._validators.get(class_type)
+        if validator is None:
+            info = self._nodes_info.get(class_type)
+            if info is None:
+                return None
+            validator = self._validators[class_type] = _NodeValidator(info)
+        return validator
+
+    def validate(self, prompt: dict) -> list[PromptError]:
+        '''Return the errors of the prompt. An empty list is returned if the prompt is valid.'''
+        errors = []
+        for node_id, node in prompt.items():
+            class_type = node['class_type']
+            validator = self._get_validator(class_type)
+            if validator is None:
+                errors.append(PromptError(node_id, class_type, 'node_not_found', f'Node {class_type} does not exist'))
+                continue
+            inputs = node.get('inputs', {})
+
+            for name in validator.required:
+                if name not in inputs:
+                    errors.append(PromptError(node_id, class_type, 'required_input_missing', f'Required input is missing: {name}', name))
+
+            for name, value in inputs.items():
+                if _is_link(value):
+                    input_type = validator.link_types.get(name)
+                    if input_type is None:
+                        continue
+                    source_id, slot = value
+                    source = prompt.get(source_id)
+                    source_validator = self._get_validator(source['class_type']) if source is not None else None
+                    if source_validator is None:
+                        errors.append(PromptError(node_id, class_type, 'bad_linked_input', f'{name} is linked to a missing node: {source_id}', name))
+                    elif not 0 <= slot < len(source_validator.output_types):
+                        errors.append(PromptError(node_id, class_type, 'bad_linked_input', f'{name} is linked to a missing output: {value}', name))
+                    else:
+                        received_type = source_validator.output_types[slot]
+                        # Enum outputs
+                        if isinstance(received_type, str) and not _types_match(received_type, input_type):
+                            errors.append(PromptError(node_id, class_type, 'return_type_mismatch', f'{name} expects {input_type}, but {source_id} returns {received_type}', name))
+                    continue
+
+                number = validator.numbers.get(name)
+                if number is not None:
+                    number_type, min, max = number
+                    try:
+                        value = number_type(value)
+                    except (TypeError, ValueError):
+                        errors.append(PromptError(node_id, class_type, 'invalid_input_type', f'{name} expects {number_type.__name__.upper()}, got {value!r}', name))
+                        continue
+                    if min is not None and value < min:
+                        errors.append(PromptError(node_id, class_type, 'value_smaller_than_min', f'{name} {value} is smaller than min {min}', name))
+                    elif max is not None and value > max:
+                        errors.append(PromptError(node_id, class_type, 'value_bigger_than_max', f'{name} {value} is bigger than max {max}', name))
+                    continue
+
+                enum = validator.enums.get(name)
+                if enum is not None and not compat._in_enum(value, enum):
+                    errors.append(PromptError(node_id, class_type, 'value_not_in_list', f'{name} {value!r} is not in the list', name))
+        return errors
+
+from ..client import compat
+
+__all__ = [
+    'PromptError',
+    'PromptValidator',
+]
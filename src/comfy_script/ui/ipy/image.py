@@ -27,7 +27,7 @@ class ImageViewer:
             return await images
         
         if isinstance(images, Iterable):
-            return [*itertools.chain(*[await ImageViewer._flatten(image) for image in images])]
+            return [*itertools.chain(*await asyncio.gather(*[ImageViewer._flatten(image) for image in images]))]
     
         raise TypeError(f'Invalid image type: {type(images)}')
 
@@ -0,0 +1,55 @@
+'''python tests/benchmarks/bench_queue_put.py
+
+Measure the round-trip overhead of `queue.put()` against a minimal local server that only accepts prompts, comparing running each call by `asyncio.run()` with running on the long-lived event loop.
+'''
+import asyncio
+import threading
+import time
+
+from aiohttp import web
+
+from comfy_script import client
+from comfy_script.runtime import queue
+from comfy_script.runtime.data import NodeInputs, NodeOutput
+
+def start_server(port: int) -> None:
+    number = 0
+
+    async def prompt(request: web.Request) -> web.Response:
+        nonlocal number
+        await request.json()
+        number += 1
+        return web.json_response({'prompt_id': str(number), 'number': number, 'node_errors': {}})
+
+    app = web.Application()
+    app.router.add_post('/prompt', prompt)
+    runner = web.AppRunner(app)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', port).start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+def bench(put, number: int = 1000) -> float:
+    for _ in range(10):
+        put()
+    start = time.perf_counter()
+    for _ in range(number):
+        put()
+    return (time.perf_counter() - start) / number
+
+if __name__ == '__main__':
+    port = 18188
+    start_server(port)
+    client.client = client.Client(f'http://127.0.0.1:{port}/')
+
+    output = NodeOutput({'input': {}}, {
+        'inputs': NodeInputs({'width': 512, 'height': 512, 'batch_size': 1}),
+        'class_type': 'EmptyLatentImage',
+    }, 0)
+
+    for name, put in {
+        'asyncio.run()': lambda: asyncio.run(queue._put(output, '')),
+        'event_loop_thread.run()': lambda: queue.put(output, ''),
+    }.items():
+        print(f'{name}: {bench(put) * 1e6:,.0f} µs/put')
+        queue._tasks.clear()
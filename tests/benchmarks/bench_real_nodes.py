@@ -0,0 +1,67 @@
+'''python tests/benchmarks/bench_real_nodes.py
+
+Measure the overhead of calling nodes in real mode, without ComfyUI.
+'''
+import timeit
+
+from comfy_script.runtime import real
+from comfy_script.runtime.real.nodes import RealRuntimeFactory
+
+class KSampler:
+    @classmethod
+    def INPUT_TYPES(s):
+        return KSAMPLER_INFO['input']
+
+    RETURN_TYPES = ('LATENT',)
+    FUNCTION = 'sample'
+
+    def sample(self, model, seed, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, denoise=1.0, add_noise='enable'):
+        return (latent_image,)
+
+KSAMPLER_INFO = {
+    'input': {
+        'required': {
+            'model': ['MODEL'],
+            'seed': ['INT', {'default': 0, 'min': 0, 'max': 0xffffffffffffffff}],
+            'steps': ['INT', {'default': 20, 'min': 1, 'max': 10000}],
+            'cfg': ['FLOAT', {'default': 8.0, 'min': 0.0, 'max': 100.0}],
+            'sampler_name': [['euler', 'euler_ancestral', 'dpmpp_2m']],
+            'scheduler': [['normal', 'karras', 'exponential']],
+            'positive': ['CONDITIONING'],
+            'negative': ['CONDITIONING'],
+            'latent_image': ['LATENT'],
+            'denoise': ['FLOAT', {'default': 1.0, 'min': 0.0, 'max': 1.0}],
+        },
+        'optional': {
+            'add_noise': [['enable', 'disable']],
+        },
+    },
+    'output': ['LATENT'],
+    'output_is_list': [False],
+    'output_name': ['LATENT'],
+    'name': 'KSampler',
+    'display_name': 'KSampler',
+    'description': '',
+    'category': 'sampling',
+    'output_node': False,
+    '_cls': KSampler,
+}
+
+def bench(config: real.RealModeConfig, number: int = 100_000) -> float:
+    fact = RealRuntimeFactory(config)
+    fact.add_node(KSAMPLER_INFO)
+    node = fact.vars()['KSampler']
+    latent = {'samples': None}
+
+    def call():
+        node(None, 123, 20, 8.0, 'euler', 'normal', [], [], latent, add_noise=True)
+
+    seconds = min(timeit.repeat(call, number=number, repeat=5))
+    return number / seconds
+
+if __name__ == '__main__':
+    for name, config in {
+        'default': real.RealModeConfig(),
+        'track_workflow=False': real.RealModeConfig(track_workflow=False),
+    }.items():
+        print(f'{name}: {bench(config):,.0f} calls/s')
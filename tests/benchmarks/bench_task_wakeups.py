@@ -0,0 +1,42 @@
+'''python tests/benchmarks/bench_task_wakeups.py
+
+Measure resolving many tasks from the watch thread while they are waited in another event loop, and how many cross-thread wakeups are needed.
+'''
+import asyncio
+import threading
+import time
+
+from comfy_script import client
+from comfy_script.runtime import Task
+from comfy_script.runtime.data import IdManager
+from comfy_script.runtime.events import waker
+
+def bench(n: int) -> None:
+    async def create_tasks() -> list[Task]:
+        return [Task(str(i), i, IdManager()) for i in range(n)]
+    # Tasks are created on the long-lived loop, like `queue.put()`
+    tasks = client.event_loop_thread.run(create_tasks())
+
+    async def wait_all() -> float:
+        waiting = asyncio.gather(*(task._wait() for task in tasks))
+        await asyncio.sleep(0)
+
+        async def resolve_all():
+            for task in tasks:
+                await task._set_result_threadsafe('0', {'text': ['']})
+                await task._set_results_threadsafe({})
+        watch_thread = threading.Thread(target=asyncio.run, args=(resolve_all(),))
+        start = time.perf_counter()
+        watch_thread.start()
+        await waiting
+        elapsed = time.perf_counter() - start
+        watch_thread.join()
+        return elapsed
+
+    wakeups, callbacks = waker.wakeups, waker.callbacks
+    elapsed = asyncio.run(wait_all())
+    print(f'{n:,} tasks: {elapsed * 1e3:,.1f} ms, {n / elapsed:,.0f} tasks/s, {waker.wakeups - wakeups:,} wakeups for {waker.callbacks - callbacks:,} callbacks')
+
+if __name__ == '__main__':
+    for n in (100, 1000, 10000):
+        bench(n)
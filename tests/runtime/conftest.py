@@ -0,0 +1,196 @@
+import asyncio
+import io
+import json
+import struct
+
+from aiohttp import web
+from PIL import Image
+import pytest
+
+class FakeServer:
+    '''
+    A fake ComfyUI server that accepts prompts and sends the messages of the `class_type` of their first nodes to the websockets.
+
+    Node types other than the ones in `_execute()` are never finished.
+    '''
+
+    def __init__(self, nodes_info: dict = {}):
+        self.prompts: list[dict] = []
+        self.nodes_info = nodes_info
+        self.object_info_requests = 0
+        self.etag: str | None = None
+        '''If set, `/object_info` is sent with `ETag` and answers `If-None-Match` with 304.'''
+        self.delay = 0
+        '''Seconds before responding to `/prompt`.'''
+        self.reject = False
+        '''Reject all prompts. Prompts of `'Reject'` are always rejected.'''
+        self.websockets: list[web.WebSocketResponse] = []
+        self.queue_remaining = 0
+        self.max_queue_remaining = 0
+        self.history_requests = 0
+        self.view_delay = 0
+        '''Seconds before responding to `/view`.'''
+        self.viewing = 0
+        self.max_viewing = 0
+
+    def _status(self) -> dict:
+        return {'type': 'status', 'data': {'status': {'exec_info': {'queue_remaining': self.queue_remaining}}}}
+
+    async def _object_info(self, request: web.Request) -> web.Response:
+        self.object_info_requests += 1
+        node_class = request.match_info.get('node_class')
+        if node_class is not None:
+            return web.json_response({node_class: self.nodes_info[node_class]})
+        if self.etag is None:
+            return web.json_response(self.nodes_info)
+        if request.headers.get('If-None-Match') == self.etag:
+            return web.Response(status=304, headers={'ETag': self.etag})
+        return web.json_response(self.nodes_info, headers={'ETag': self.etag})
+
+    async def _prompt(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.delay)
+        body = await request.json()
+        prompt = body['prompt']
+        if self.reject or next(iter(prompt.values()))['class_type'] == 'Reject':
+            return web.json_response({'error': {'type': 'invalid_prompt', 'message': 'Rejected'}, 'node_errors': {}}, status=400)
+        self.prompts.append(body)
+        # Unique across servers
+        prompt_id = f'{id(self)}-{len(self.prompts)}'
+        self.queue_remaining += 1
+        self.max_queue_remaining = max(self.max_queue_remaining, self.queue_remaining)
+        for ws in self.websockets:
+            await ws.send_json(self._status())
+        if next(iter(prompt.values()))['class_type'] == 'Cached':
+            # Finished before the response
+            await self._execute(prompt_id, prompt)
+            await asyncio.sleep(0.05)
+        else:
+            asyncio.create_task(self._execute(prompt_id, prompt))
+        return web.json_response({'prompt_id': prompt_id, 'number': len(self.prompts), 'node_errors': {}})
+
+    async def _execute(self, prompt_id: str, prompt: dict) -> None:
+        class_type = next(iter(prompt.values()))['class_type']
+        if class_type != 'Cached':
+            await asyncio.sleep(0.05)
+        messages = [{'type': 'execution_start', 'data': {'prompt_id': prompt_id}}]
+        frames: list[bytes] = []
+        if class_type == 'Error':
+            messages.append({'type': 'execution_error', 'data': {
+                'prompt_id': prompt_id, 'node_id': '0', 'node_type': 'Error', 'executed': [],
+                'exception_message': 'Allocation on device', 'exception_type': 'torch.OutOfMemoryError',
+                'traceback': ['  File "execution.py", line 1\n'],
+            }})
+        elif class_type == 'Interrupt':
+            messages.append({'type': 'execution_interrupted', 'data': {'prompt_id': prompt_id, 'node_id': '0', 'node_type': 'Interrupt', 'executed': []}})
+        elif class_type.startswith('Text'):
+            # e.g. 'Text2' has 2 output nodes, finished after 0.02 * 2 seconds
+            n = int(class_type[4:])
+            await asyncio.sleep(0.02 * n)
+            messages += [{'type': 'executed', 'data': {'prompt_id': prompt_id, 'node': str(i), 'output': {'text': [str(i)]}}} for i in range(n)]
+            messages.append({'type': 'executing', 'data': {'prompt_id': prompt_id, 'node': None}})
+        elif class_type == 'Images':
+            for node_id, node in prompt.items():
+                inputs = node['inputs']
+                images = [{'filename': f'{inputs["seed"]}_{i}.png', 'subfolder': '', 'type': 'output'} for i in range(inputs['batch_size'])]
+                messages.append({'type': 'executed', 'data': {'prompt_id': prompt_id, 'node': node_id, 'output': {'images': images}}})
+            messages.append({'type': 'executing', 'data': {'prompt_id': prompt_id, 'node': None}})
+        elif class_type == 'SendImage':
+            # See `comfy_script.nodes.image.ComfyScriptSendImage`
+            images = [Image.new('RGB', (2, 1), (255, 0, 0)), Image.new('L', (1, 2), 128)]
+            for i, (image, format) in enumerate(zip(images, ['raw', 'png'])):
+                frames.append(self._image_frame(prompt_id, '0', i, image, format))
+            output = {'comfy_script_images': [{'index': i, 'width': image.width, 'height': image.height} for i, image in enumerate(images)]}
+            messages.append({'type': 'executed', 'data': {'prompt_id': prompt_id, 'node': '0', 'output': output}})
+            messages.append({'type': 'executing', 'data': {'prompt_id': prompt_id, 'node': None}})
+        elif class_type == 'PartiallyCached':
+            # Only output nodes have `executed` messages
+            messages += [
+                {'type': 'execution_cached', 'data': {'prompt_id': prompt_id, 'nodes': ['0', '1']}},
+                {'type': 'executed', 'data': {'prompt_id': prompt_id, 'node': '0', 'output': {'text': ['cached']}}},
+                {'type': 'executing', 'data': {'prompt_id': prompt_id, 'node': None}},
+            ]
+        elif class_type == 'Cached':
+            messages += [
+                {'type': 'execution_cached', 'data': {'prompt_id': prompt_id, 'nodes': ['0']}},
+                {'type': 'executed', 'data': {'prompt_id': prompt_id, 'node': '0', 'output': {'text': ['cached']}}},
+                {'type': 'executing', 'data': {'prompt_id': prompt_id, 'node': None}},
+            ]
+        self.queue_remaining -= 1
+        # No `executing` with `node: None` for errors
+        messages.insert(-1 if messages[-1]['type'] == 'executing' else len(messages), self._status())
+        for ws in self.websockets:
+            await ws.send_json(messages[0])
+            for frame in frames:
+                await ws.send_bytes(frame)
+            for message in messages[1:]:
+                await ws.send_json(message)
+
+    @staticmethod
+    def _image_frame(prompt_id: str, node: str, index: int, image: Image.Image, format: str) -> bytes:
+        '''A binary event of `ComfyScriptSendImage`.'''
+        if format == 'png':
+            f = io.BytesIO()
+            image.save(f, 'PNG')
+            payload = f.getvalue()
+        else:
+            payload = image.tobytes()
+        header = json.dumps({
+            'prompt_id': prompt_id,
+            'node': node,
+            'index': index,
+            'format': format,
+            'width': image.width,
+            'height': image.height,
+            'channels': len(image.getbands()),
+        }).encode('utf8')
+        return struct.pack('>I', 0x43530001) + struct.pack('>I', len(header)) + header + payload
+
+    async def _history(self, request: web.Request) -> web.Response:
+        self.history_requests += 1
+        return web.json_response({})
+
+    async def _view(self, request: web.Request) -> web.Response:
+        '''Images are 1x1 PNGs of the gray level in their file names, e.g. `'3_0.png'`. `'missing_*.png'` are not found.'''
+        self.viewing += 1
+        self.max_viewing = max(self.max_viewing, self.viewing)
+        try:
+            await asyncio.sleep(self.view_delay)
+            filename = request.query['filename']
+            if filename.startswith('missing'):
+                return web.Response(status=404)
+            f = io.BytesIO()
+            Image.new('L', (1, 1), int(filename.split('_')[0])).save(f, 'PNG')
+            return web.Response(body=f.getvalue(), content_type='image/png')
+        finally:
+            self.viewing -= 1
+
+    async def _ws(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.websockets.append(ws)
+        async for _ in ws:
+            pass
+        return ws
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post('/prompt', self._prompt)
+        app.router.add_get('/ws', self._ws)
+        app.router.add_get('/history/{prompt_id}', self._history)
+        app.router.add_get('/view', self._view)
+        app.router.add_get('/object_info', self._object_info)
+        app.router.add_get('/object_info/{node_class}', self._object_info)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        return f'http://127.0.0.1:{port}/'
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+
+@pytest.fixture
+def fake_server() -> type[FakeServer]:
+    '''The `FakeServer` class. Servers are started and stopped by the tests.'''
+    return FakeServer
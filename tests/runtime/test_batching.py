@@ -0,0 +1,71 @@
+'''hatch env run -e test pytest tests/runtime/test_batching.py'''
+from comfy_script.runtime.batching import Batcher
+
+def prompt(seed: int, text: str = 'cat', batch_size: int = 1, prefix: str = '') -> dict:
+    return {
+        f'{prefix}CheckpointLoaderSimple.0': {'inputs': {'ckpt_name': 'a.safetensors'}, 'class_type': 'CheckpointLoaderSimple'},
+        f'{prefix}CLIPTextEncode.0': {'inputs': {'text': text, 'clip': [f'{prefix}CheckpointLoaderSimple.0', 1]}, 'class_type': 'CLIPTextEncode'},
+        f'{prefix}EmptyLatentImage.0': {'inputs': {'width': 512, 'height': 512, 'batch_size': batch_size}, 'class_type': 'EmptyLatentImage'},
+        f'{prefix}KSampler.0': {'inputs': {
+            'model': [f'{prefix}CheckpointLoaderSimple.0', 0], 'seed': seed, 'positive': [f'{prefix}CLIPTextEncode.0', 0],
+            'latent_image': [f'{prefix}EmptyLatentImage.0', 0],
+        }, 'class_type': 'KSampler'},
+        f'{prefix}SaveImage.0': {'inputs': {'images': [f'{prefix}KSampler.0', 0]}, 'class_type': 'SaveImage'},
+    }
+
+def test_group():
+    batcher = Batcher(max_batch_size=4)
+    prompts = [prompt(seed) for seed in range(5)] + [prompt(0, 'dog'), prompt(0, batch_size=4), prompt(1, 'dog')]
+    assert batcher.group(prompts) == [[0, 1, 2, 3], [4], [5, 7], [6]]
+
+    # Node ids may differ, e.g. content-addressed ids
+    assert batcher.group([prompt(0), prompt(1, prefix='x')]) == [[0, 1]]
+    # No batch_size
+    assert batcher.group([{'0': {'inputs': {'seed': 0}, 'class_type': 'KSampler'}}] * 2) == [[0], [1]]
+
+def test_merge_and_split():
+    batcher = Batcher()
+    prompts = [prompt(0, batch_size=2), prompt(1, batch_size=2, prefix='x'), prompt(0, batch_size=2, prefix='y')]
+    batch = batcher.merge(prompts)
+    assert len(batch) == 3 and batch.branches == [0, 1, 0]
+    # One sampler per seed, joined before the shared nodes
+    assert [(node['class_type'], node['inputs'].get('seed')) for node in batch.prompt.values() if node['class_type'] in ('KSampler', 'LatentBatch')] == [('KSampler', 0), ('KSampler', 1), ('LatentBatch', None)]
+    assert batch.prompt['EmptyLatentImage.0']['inputs']['batch_size'] == 2
+    assert batch.prompt['SaveImage.0']['inputs']['images'] == ['KSampler.0#LatentBatch0.1', 0]
+    assert batch.batched == {'SaveImage.0'}
+    # Not modified
+    assert prompts[1]['xKSampler.0']['inputs']['seed'] == 1
+
+    outputs = {
+        'SaveImage.0': {'images': [{'filename': f'{i}.png'} for i in range(4)], 'animated': [False, False]},
+        'KSampler.0#1': {'text': ['1']},
+    }
+    assert batch.split(outputs, 1) == {
+        'xSaveImage.0': {'images': [{'filename': '2.png'}, {'filename': '3.png'}], 'animated': [False]},
+        'xKSampler.0': {'text': ['1']},
+    }
+    assert batch.split(outputs, 2) == {'ySaveImage.0': {'images': [{'filename': '0.png'}, {'filename': '1.png'}], 'animated': [False]}}
+
+def test_merge_branches():
+    def prompt(seed: int) -> dict:
+        return {
+            'RandomNoise.0': {'inputs': {'noise_seed': seed}, 'class_type': 'RandomNoise'},
+            'EmptyLatentImage.0': {'inputs': {'batch_size': 1}, 'class_type': 'EmptyLatentImage'},
+            'SamplerCustomAdvanced.0': {'inputs': {'noise': ['RandomNoise.0', 0], 'latent_image': ['EmptyLatentImage.0', 0]}, 'class_type': 'SamplerCustomAdvanced'},
+            'VAEDecode.0': {'inputs': {'samples': ['SamplerCustomAdvanced.0', 1]}, 'class_type': 'VAEDecode'},
+            'SaveImage.0': {'inputs': {'images': ['VAEDecode.0', 0]}, 'class_type': 'SaveImage'},
+        }
+    batch = Batcher().merge([prompt(0), prompt(1)])
+    # `NOISE` cannot be joined
+    assert batch.prompt['SamplerCustomAdvanced.0#1']['inputs']['noise'] == ['RandomNoise.0#1', 0]
+    assert batch.prompt['VAEDecode.0']['inputs']['samples'] == ['SamplerCustomAdvanced.0#LatentBatch1.1', 0]
+    assert batch.batched == {'VAEDecode.0', 'SaveImage.0'}
+
+    # Samplers downstream are branched, even with the same seeds
+    p = prompt(0) | {'KSampler.0': {'inputs': {'seed': 0, 'latent_image': ['SamplerCustomAdvanced.0', 0]}, 'class_type': 'KSampler'}}
+    p['SaveImage.0']['inputs']['images'] = ['KSampler.0', 0]
+    q = prompt(1) | {'KSampler.0': p['KSampler.0']}
+    q['SaveImage.0'] = p['SaveImage.0']
+    batch = Batcher().merge([p, q])
+    assert batch.prompt['KSampler.0#1']['inputs']['latent_image'] == ['SamplerCustomAdvanced.0#1', 0]
+    assert batch.batched == {'VAEDecode.0', 'SaveImage.0'}
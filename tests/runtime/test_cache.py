@@ -0,0 +1,109 @@
+'''hatch env run -e test pytest tests/runtime/test_cache.py'''
+import asyncio
+import json
+
+from comfy_script.client import Client
+from comfy_script.client.cache import NodesInfoCache
+
+nodes_info = {'EmptyLatentImage': {'input': {'required': {'width': ['INT', {'default': 512}]}}}}
+
+async def revalidated(cache: NodesInfoCache, n: int) -> None:
+    '''Wait for `n` revalidations in the background.'''
+    for _ in range(500):
+        if cache.stats.unchanged + cache.stats.changed >= n:
+            return
+        await asyncio.sleep(0.01)
+    assert False, cache.stats
+
+def test_hit_and_miss(fake_server, tmp_path):
+    async def f():
+        server = fake_server(nodes_info)
+        c = Client(await server.start())
+        try:
+            cache = NodesInfoCache(tmp_path)
+            assert await cache.get(c) == nodes_info
+            assert (cache.stats.hits, cache.stats.misses) == (0, 1)
+            assert server.object_info_requests == 1
+
+            # Persistent across caches
+            cache = NodesInfoCache(tmp_path)
+            assert await cache.get(c) == nodes_info
+            assert (cache.stats.hits, cache.stats.misses) == (1, 0)
+            await revalidated(cache, 1)
+            assert server.object_info_requests == 2
+            # Downloaded without `ETag`
+            assert (cache.stats.unchanged, cache.stats.bytes_saved) == (1, 0)
+
+            cache = NodesInfoCache(tmp_path)
+            await cache.get(c, refresh=True)
+            assert (cache.stats.hits, cache.stats.misses) == (0, 1)
+
+            # Other servers
+            assert NodesInfoCache(tmp_path).load('http://127.0.0.1:1/') is None
+        finally:
+            await c._close()
+            await server.stop()
+    asyncio.run(f())
+
+def test_revalidate(fake_server, tmp_path):
+    async def f():
+        server = fake_server(nodes_info)
+        c = Client(await server.start())
+        try:
+            cache = NodesInfoCache(tmp_path)
+            await cache.get(c)
+
+            # The snapshot is used until revalidated
+            server.nodes_info = nodes_info | {'LoadImage': {'input': {}}}
+            assert await cache.get(c) == nodes_info
+            await revalidated(cache, 1)
+            assert cache.stats.changed == 1
+            assert await cache.get(c) == server.nodes_info
+            await revalidated(cache, 2)
+            assert cache.stats.unchanged == 1
+        finally:
+            await c._close()
+            await server.stop()
+    asyncio.run(f())
+
+def test_etag(fake_server, tmp_path):
+    async def f():
+        server = fake_server(nodes_info)
+        server.etag = '"1"'
+        c = Client(await server.start())
+        try:
+            cache = NodesInfoCache(tmp_path)
+            await cache.get(c)
+            assert cache.last_snapshot.etag == '"1"'
+            await cache.get(c)
+            await revalidated(cache, 1)
+            assert (cache.stats.unchanged, cache.stats.bytes_saved) == (1, cache.last_snapshot.size)
+        finally:
+            await c._close()
+            await server.stop()
+    asyncio.run(f())
+
+def test_invalid(tmp_path):
+    cache = NodesInfoCache(tmp_path)
+    base_url = 'http://127.0.0.1:8188/'
+    cache.save(base_url, json.dumps(nodes_info).encode('utf8'))
+    path, meta_path = cache._paths(base_url)
+    assert cache.load(base_url).nodes_info == nodes_info
+
+    # Modified content
+    path.write_bytes(b'{}')
+    assert cache.load(base_url) is None
+
+    # Corrupted meta
+    cache.save(base_url, json.dumps(nodes_info).encode('utf8'))
+    meta_path.write_bytes(b'{')
+    assert cache.load(base_url) is None
+
+    # Meta of another server, e.g. a hash collision of file names
+    cache.save(base_url, json.dumps(nodes_info).encode('utf8'))
+    meta = json.loads(meta_path.read_bytes())
+    meta_path.write_text(json.dumps(meta | {'base_url': 'http://127.0.0.1:8189/'}))
+    assert cache.load(base_url) is None
+
+    meta_path.unlink()
+    assert cache.load(base_url) is None
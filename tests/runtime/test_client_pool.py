@@ -0,0 +1,178 @@
+'''hatch env run -e test pytest tests/runtime/test_client_pool.py'''
+import asyncio
+from pathlib import PurePath
+
+from comfy_script.client import Client, ClientPool, NodeSet
+from comfy_script.runtime import QueueError, queue
+from comfy_script.runtime.data import IdManager
+
+def nodes_info(ckpt_names: list[str]) -> dict:
+    return {
+        'EmptyLatentImage': {'input': {'required': {'width': ['INT', {'default': 512}]}}},
+        'CheckpointLoaderSimple': {'input': {'required': {'ckpt_name': [ckpt_names]}}},
+    }
+
+def test_least_loaded():
+    pool = ClientPool(['http://127.0.0.1:8188/', 'http://127.0.0.1:8189/'])
+    a, b = pool.clients
+    assert pool.primary is a
+    assert pool.least_loaded() is a
+
+    pool._set_queue_remaining(a, 2)
+    assert pool.least_loaded() is b
+    pool._set_dispatched(b)
+    pool._set_dispatched(b)
+    # Ties are broken by order
+    assert pool.least_loaded() is a
+    pool._set_dispatched(a)
+    assert pool.least_loaded() is b
+
+    pool._set_queue_remaining(b, 0)
+    assert pool.load(b) == 0
+    assert pool.least_loaded([a]) is a
+
+def test_dispatch(fake_server):
+    async def f():
+        servers = [fake_server(nodes_info(['a.safetensors'])), fake_server(nodes_info(['a.safetensors']))]
+        urls = [await server.start() for server in servers]
+        pool = ClientPool([Client(url) for url in urls])
+        old_pool = queue.pool
+        queue.pool = pool
+        tasks = []
+        try:
+            pool._set_queue_remaining(pool.clients[0], 3)
+            tasks += [await queue._post_prompt({'EmptyLatentImage.0': {'inputs': {}, 'class_type': 'EmptyLatentImage'}}, IdManager()) for _ in range(5)]
+            assert [task.client for task in tasks] == [pool.clients[1]] * 3 + [pool.clients[0], pool.clients[1]]
+            assert [len(server.prompts) for server in servers] == [1, 4]
+        finally:
+            queue.pool = old_pool
+            for task in tasks:
+                queue._tasks.pop(task.prompt_id, None)
+            for c in pool.clients:
+                await c._close()
+            for server in servers:
+                await server.stop()
+    asyncio.run(f())
+
+def test_dispatch_concurrent(fake_server):
+    async def f():
+        servers = [fake_server(nodes_info(['a.safetensors'])), fake_server(nodes_info(['a.safetensors']))]
+        urls = [await server.start() for server in servers]
+        pool = ClientPool([Client(url) for url in urls], check_prompts=False)
+        old_pool = queue.pool
+        queue.pool = pool
+        tasks = []
+        try:
+            for server in servers:
+                server.delay = 0.1
+            prompt = {'EmptyLatentImage.0': {'inputs': {}, 'class_type': 'EmptyLatentImage'}}
+            # All clients are chosen before any response
+            tasks += await asyncio.gather(*[queue._post_prompt(prompt, IdManager()) for _ in range(6)])
+            assert [len(server.prompts) for server in servers] == [3, 3]
+            assert [pool.load(c) for c in pool.clients] == [3, 3]
+
+            # Reservations are rolled back on failure
+            servers[1].reject = True
+            pool._set_queue_remaining(pool.clients[0], 5)
+            try:
+                await queue._post_prompt(prompt, IdManager())
+                assert False
+            except QueueError:
+                pass
+            assert pool.load(pool.clients[1]) == 3
+        finally:
+            queue.pool = old_pool
+            for task in tasks:
+                queue._tasks.pop(task.prompt_id, None)
+            for c in pool.clients:
+                await c._close()
+            for server in servers:
+                await server.stop()
+    asyncio.run(f())
+
+def test_node_set():
+    a = NodeSet(nodes_info(['a.safetensors', 'b.safetensors']))
+    assert a.fingerprint == NodeSet(nodes_info(['b.safetensors', 'a.safetensors'])).fingerprint
+    assert a.fingerprint != NodeSet(nodes_info(['a.safetensors'])).fingerprint
+    assert 'EmptyLatentImage' in a and len(a) == 2
+
+    prompt = {
+        '0': {'inputs': {'ckpt_name': 'b.safetensors'}, 'class_type': 'CheckpointLoaderSimple'},
+        '1': {'inputs': {'width': 512, 'model': ['0', 0]}, 'class_type': 'EmptyLatentImage'},
+    }
+    assert a.check_prompt(prompt) == []
+    prompt['0']['inputs']['ckpt_name'] = 'c.safetensors'
+    prompt['2'] = {'inputs': {}, 'class_type': 'Missing'}
+    assert [(i.node_id, i.input) for i in a.check_prompt(prompt)] == [('0', 'ckpt_name'), ('2', None)]
+
+    # Paths and inputs validated by the node itself
+    class LoadImage:
+        @classmethod
+        def VALIDATE_INPUTS(s, image):
+            return True
+    b = NodeSet(nodes_info(['a.safetensors']) | {
+        'LoadImage': {'input': {'required': {'image': [['a.png']], 'mask': ['COMBO', {'options': ['a.png']}]}}, '_cls': LoadImage},
+    })
+    prompt = {
+        '0': {'inputs': {'ckpt_name': PurePath('a.safetensors')}, 'class_type': 'CheckpointLoaderSimple'},
+        '1': {'inputs': {'image': 'b.png', 'mask': 'b.png'}, 'class_type': 'LoadImage'},
+    }
+    assert [(i.node_id, i.input) for i in b.check_prompt(prompt)] == [('1', 'mask')]
+
+def test_dispatch_compatible(fake_server):
+    async def f():
+        servers = [fake_server(nodes_info(['a.safetensors'])), fake_server(nodes_info(['b.safetensors']))]
+        urls = [await server.start() for server in servers]
+        pool = ClientPool([Client(url) for url in urls])
+        old_pool = queue.pool
+        queue.pool = pool
+        tasks = []
+        try:
+            prompt = {'0': {'inputs': {'ckpt_name': 'b.safetensors'}, 'class_type': 'CheckpointLoaderSimple'}}
+            tasks += [await queue._post_prompt(prompt, IdManager()) for _ in range(2)]
+            assert [len(server.prompts) for server in servers] == [0, 2]
+
+            # Enum values are refreshed on mismatch
+            servers[0].nodes_info = nodes_info(['a.safetensors', 'b.safetensors'])
+            pool.clients[0].node_set.refresh_interval = 0
+            requests = servers[0].object_info_requests
+            tasks.append(await queue._post_prompt(prompt, IdManager()))
+            assert servers[0].object_info_requests == requests + 1
+            assert [len(server.prompts) for server in servers] == [1, 2]
+
+            try:
+                await queue._post_prompt({'0': {'inputs': {}, 'class_type': 'Missing'}}, IdManager())
+                assert False
+            except QueueError as e:
+                assert e.node_errors['0']['errors'][0]['type'] == 'node_not_found'
+            assert [len(server.prompts) for server in servers] == [1, 2]
+        finally:
+            queue.pool = old_pool
+            for task in tasks:
+                queue._tasks.pop(task.prompt_id, None)
+            for c in pool.clients:
+                await c._close()
+            for server in servers:
+                await server.stop()
+    asyncio.run(f())
+
+def test_stale_sessions_closed():
+    c = Client('http://127.0.0.1:8188/')
+
+    async def get_session():
+        return c._get_pooled_session()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(get_session())
+        finally:
+            loop.close()
+
+    old = run()
+    new = run()
+    # The session of the closed loop is pruned and closed
+    assert old.closed and not new.closed
+    assert list(c._sessions.values()) == [new]
+    c.close()
+    assert new.closed
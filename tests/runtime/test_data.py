@@ -0,0 +1,138 @@
+'''hatch env run -e test pytest tests/runtime/test_data.py'''
+import asyncio
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from comfy_script.client import Client
+
+from comfy_script.runtime.data import IdManager, ImageBatchResult, NodeInputs, NodeOutput
+
+def new_node(class_type: str, inputs: dict, output_slot: int = 0) -> NodeOutput:
+    return NodeOutput({'input': {}}, {
+        'inputs': NodeInputs(inputs),
+        'class_type': class_type,
+    }, output_slot)
+
+def new_workflow(seed: int) -> NodeOutput:
+    model = new_node('CheckpointLoaderSimple', {'ckpt_name': 'v1-5-pruned-emaonly.ckpt'})
+    latent = new_node('EmptyLatentImage', {'width': 512, 'height': 512, 'batch_size': 1})
+    return new_node('KSampler', {'model': model, 'seed': seed, 'latent_image': latent})
+
+@pytest.fixture
+def content_addressed():
+    IdManager.content_addressed = True
+    yield
+    IdManager.content_addressed = False
+
+def test_sequential_ids():
+    prompt = new_workflow(123).api_format()
+    assert set(prompt) == {'CheckpointLoaderSimple.0', 'EmptyLatentImage.0', 'KSampler.0'}
+
+def test_content_addressed_ids(content_addressed):
+    prompt = new_workflow(123).api_format()
+    assert prompt == new_workflow(123).api_format()
+
+    prompt2 = new_workflow(456).api_format()
+    shared = {id for id in prompt if not id.startswith('KSampler.')}
+    assert len(shared) == 2
+    assert shared < prompt2.keys()
+    assert prompt.keys() - shared != prompt2.keys() - shared
+
+def test_content_addressed_ids_upstream(content_addressed):
+    output = new_workflow(123)
+    prompt = output.api_format()
+    output.node_prompt['inputs']['latent_image'].node_prompt['inputs']['width'] = 768
+    prompt2 = output.api_format()
+    assert prompt.keys() & prompt2.keys() == {id for id in prompt if id.startswith('CheckpointLoaderSimple.')}
+
+def test_content_addressed_ids_merge(content_addressed):
+    a = new_node('EmptyLatentImage', {'width': 512, 'height': 512, 'batch_size': 1})
+    b = new_node('EmptyLatentImage', {'width': 512, 'height': 512, 'batch_size': 1})
+    prompt = new_node('LatentBatch', {'samples1': a, 'samples2': b}).api_format()
+    assert len(prompt) == 2
+
+def test_prompt_memo_merged(content_addressed):
+    a = new_node('EmptyLatentImage', {'width': 512, 'height': 512, 'batch_size': 1})
+    b = new_node('EmptyLatentImage', {'width': 512, 'height': 512, 'batch_size': 1})
+    output = new_node('LatentBatch', {'samples1': a, 'samples2': b})
+    assert len(output.api_format()) == 2
+    # Both merged nodes invalidate the memo
+    b.node_prompt['inputs']['width'] = 768
+    assert len(output.api_format()) == 3
+    a.node_prompt['inputs']['width'] = 768
+    assert len(output.api_format()) == 2
+
+def test_prompt_memo():
+    output = new_workflow(123)
+    prompt, id = output._get_prompt_and_id()
+    # Modifying the returned prompt does not affect later prompts
+    prompt['KSampler.0']['inputs']['seed'] = 456
+    prompt['KSampler.0']['inputs']['model'][1] = 2
+    prompt2, id2 = output._get_prompt_and_id()
+    assert prompt2['KSampler.0']['inputs']['seed'] == 123
+    assert prompt2['KSampler.0']['inputs']['model'] == ['CheckpointLoaderSimple.0', 0]
+    assert id2 is not id
+
+    # Only outputs downstream of modified inputs are rebuilt
+    other = new_node('SaveImage', {'images': new_node('LoadImage', {'image': 'a.png'})})
+    other_memo = (other._get_prompt_and_id(), other._prompt_memo)[1]
+    output.node_prompt['inputs']['latent_image'].node_prompt['inputs']['width'] = 768
+    assert output._get_prompt_and_id()[0]['EmptyLatentImage.0']['inputs']['width'] == 768
+    other._get_prompt_and_id()
+    assert other._prompt_memo is other_memo
+
+def test_content_addressed_ids_unhashable(content_addressed):
+    class Foo:
+        pass
+    prompt = new_node('Node', {'foo': Foo()}).api_format()
+    # Falls back to sequential ids instead of hashing `repr()`
+    assert list(prompt) == ['Node.0']
+
+def test_local_images(monkeypatch, tmp_path):
+    assert not ImageBatchResult._is_local(Client('http://127.0.0.1:8188/'))
+    # The server running in this process
+    monkeypatch.setitem(sys.modules, 'server', SimpleNamespace(PromptServer=SimpleNamespace(instance=SimpleNamespace(port=8188))))
+    assert ImageBatchResult._is_local(Client('http://127.0.0.1:8188/'))
+    assert not ImageBatchResult._is_local(Client('http://127.0.0.1:8189/'))
+    assert not ImageBatchResult._is_local(Client('http://192.168.1.2:8188/'))
+
+    monkeypatch.setattr(ImageBatchResult, 'mmap', True)
+    empty = tmp_path / 'empty.png'
+    empty.write_bytes(b'')
+    assert ImageBatchResult._read_local(empty) == b''
+    image = tmp_path / 'image.png'
+    image.write_bytes(b'png')
+    assert ImageBatchResult._read_local(image)[:] == b'png'
+
+def test_images(fake_server):
+    async def f():
+        server = fake_server()
+        c = Client(await server.start())
+        try:
+            server.view_delay = 0.05
+            result = ImageBatchResult({'images': [{'filename': f'{i}_0.png', 'subfolder': '', 'type': 'output'} for i in range(6)]}, c)
+
+            # Downloaded concurrently
+            images = await result._get_images()
+            assert [image.getpixel((0, 0)) for image in images] == list(range(6))
+            assert server.max_viewing == 6
+
+            server.max_viewing = 0
+            images = await asyncio.to_thread(result.wait, raw=True, concurrency=2)
+            assert all(isinstance(image, bytes) and image.startswith(b'\x89PNG') for image in images)
+            assert server.max_viewing == 2
+
+            assert (await result.get(3)).getpixel((0, 0)) == 3
+            assert await result.get(3, raw=True) == images[3]
+
+            # Failed images are None instead of failing the others
+            result._output['images'][1]['filename'] = 'missing_0.png'
+            images = await result._get_images()
+            assert images[1] is None and images[2].getpixel((0, 0)) == 2
+            assert (await result._get_images(raw=True))[1] is None
+        finally:
+            await c._close()
+            await server.stop()
+    asyncio.run(f())
@@ -0,0 +1,62 @@
+'''hatch env run -e test pytest tests/runtime/test_events.py'''
+import asyncio
+import threading
+
+from comfy_script.client import Client
+from comfy_script.runtime.events import EventSubscriptions
+
+c = Client()
+
+def publish_all(subscriptions: EventSubscriptions, n: int) -> threading.Thread:
+    '''Publish in another thread, like the watch thread.'''
+    async def f():
+        for i in range(n):
+            await subscriptions.publish(c, 'progress', {'value': i}, 'a' if i % 2 else 'b', None, None)
+    thread = threading.Thread(target=asyncio.run, args=(f(),))
+    thread.start()
+    return thread
+
+def test_filter():
+    subscriptions = EventSubscriptions()
+    assert not subscriptions
+    events = subscriptions.subscribe(['progress'], prompt_ids=['a'])
+    other = subscriptions.subscribe(['executed'])
+    publish_all(subscriptions, 6).join()
+    other.close()
+    events.close()
+    assert not subscriptions
+
+    async def f():
+        return [event.data['value'] async for event in events]
+    assert asyncio.run(f()) == [1, 3, 5]
+    assert asyncio.run(other.get()) is None
+
+def test_overflow():
+    subscriptions = EventSubscriptions()
+    oldest = subscriptions.subscribe(maxsize=2)
+    newest = subscriptions.subscribe(maxsize=2, overflow='drop_newest')
+    publish_all(subscriptions, 5).join()
+    oldest.close()
+    newest.close()
+
+    async def f(events):
+        return [event.data['value'] async for event in events]
+    assert asyncio.run(f(oldest)) == [3, 4] and oldest.dropped == 3
+    assert asyncio.run(f(newest)) == [0, 1] and newest.dropped == 3
+
+def test_block():
+    subscriptions = EventSubscriptions()
+    events = subscriptions.subscribe(maxsize=2, overflow='block')
+    thread = publish_all(subscriptions, 100)
+
+    async def f():
+        values = []
+        async for event in events:
+            assert len(events._buffer) <= 2
+            values.append(event.data['value'])
+            if len(values) == 100:
+                events.close()
+        return values
+    assert asyncio.run(f()) == list(range(100))
+    thread.join()
+    assert events.dropped == 0
@@ -0,0 +1,94 @@
+'''hatch env run -e test pytest tests/runtime/test_nodes.py'''
+import asyncio
+from enum import Enum
+
+import pytest
+
+from comfy_script.runtime import node, nodes
+
+nodes_info = {
+    'CheckpointLoaderSimple': {
+        'name': 'CheckpointLoaderSimple', 'display_name': 'Load Checkpoint', 'description': '', 'category': 'loaders', 'output_node': False,
+        'input': {'required': {'ckpt_name': [['a.safetensors', 'b.safetensors']]}},
+        'output': ['MODEL', 'CLIP', 'VAE'], 'output_is_list': [False, False, False], 'output_name': ['MODEL', 'CLIP', 'VAE'],
+    },
+    'EmptyLatentImage': {
+        'name': 'EmptyLatentImage', 'display_name': 'Empty Latent Image', 'description': '', 'category': 'latent', 'output_node': False,
+        'input': {'required': {'width': ['INT', {'default': 512}]}},
+        'output': ['LATENT'], 'output_is_list': [False], 'output_name': ['LATENT'],
+    },
+}
+
+@pytest.fixture
+def lazy_nodes():
+    '''Load `nodes_info` lazily, and restore the module afterwards.'''
+    module_vars = vars(nodes).copy()
+    all = list(nodes.__all__)
+    ns = node.LazyNodes()
+    asyncio.run(nodes.load(nodes_info, None, nodes=ns, lazy=True))
+    yield ns
+    nodes.__all__[:] = all
+    vars(nodes).clear()
+    vars(nodes).update(module_vars)
+
+def star_import() -> dict:
+    g = {}
+    exec('from comfy_script.runtime.nodes import *', g)
+    return g
+
+def test_lazy(lazy_nodes):
+    # Types are created, nodes are not
+    assert 'Latent' in nodes.__all__
+    assert 'EmptyLatentImage' not in nodes.__all__ and 'EmptyLatentImage' not in star_import()
+
+    # Membership does not create nodes
+    assert 'EmptyLatentImage' in lazy_nodes and 'Missing' not in lazy_nodes
+    assert list(lazy_nodes) == []
+
+    # Created on first access
+    EmptyLatentImage = nodes.EmptyLatentImage
+    assert isinstance(EmptyLatentImage, nodes.Node)
+    assert nodes.EmptyLatentImage is EmptyLatentImage
+    assert list(lazy_nodes) == ['EmptyLatentImage']
+    assert star_import()['EmptyLatentImage'] is EmptyLatentImage
+
+    assert lazy_nodes['CheckpointLoaderSimple'] is nodes.CheckpointLoaderSimple
+    assert node.get('Missing') is None
+    with pytest.raises(AttributeError):
+        nodes.Missing
+
+    assert len(nodes.__all__) == len(set(nodes.__all__))
+
+def summary(fact: nodes.VirtualRuntimeFactory) -> tuple[dict, str]:
+    vars = {}
+    for id, v in fact.vars().items():
+        if isinstance(v, type) and issubclass(v, Enum):
+            vars[id] = [(member.name, member.value) for member in v]
+        elif isinstance(v, nodes.Node):
+            vars[id] = (v.info['name'], v.defaults, [t.__name__ for t in v.output_types])
+        else:
+            vars[id] = getattr(v, '__name__', v)
+    return vars, fact.type_stubs()
+
+def test_descriptors_cache(monkeypatch, tmp_path):
+    monkeypatch.setenv('COMFY_SCRIPT_CACHE_DIR', str(tmp_path))
+    async def f():
+        built = nodes.VirtualRuntimeFactory()
+        await built.init()
+        for info in nodes_info.values():
+            built.add_node(info)
+        built.write_descriptors_cache('a')
+
+        loaded = nodes.VirtualRuntimeFactory()
+        await loaded.init()
+        # Keyed by the hash of the nodes info
+        assert loaded.read_descriptors_cache('b') is None
+        descriptors = loaded.read_descriptors_cache('a')
+        assert descriptors is not None
+        loaded.load_descriptors(descriptors, nodes_info)
+
+        assert summary(loaded) == summary(built)
+        assert loaded.nodes.keys() == built.nodes.keys()
+        EmptyLatentImage = loaded.nodes['EmptyLatentImage']
+        assert EmptyLatentImage(768).node_prompt['inputs'] == built.nodes['EmptyLatentImage'](768).node_prompt['inputs']
+    asyncio.run(f())
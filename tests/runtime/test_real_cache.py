@@ -0,0 +1,47 @@
+'''hatch env run -e test pytest tests/runtime/test_real_cache.py'''
+import pytest
+
+from comfy_script.runtime.real.cache import NodeOutputCache
+
+def test_lru_max_bytes():
+    cache = NodeOutputCache(max_bytes=30, getsizeof=len)
+    cache['a'] = 'x' * 10
+    cache['b'] = 'x' * 10
+    cache['c'] = 'x' * 10
+    assert cache.get('a') is not None
+    cache['d'] = 'x' * 10
+    assert set(cache) == {'a', 'c', 'd'}
+    assert cache.stats.bytes == 30
+    assert cache.stats.evictions == 1
+    assert cache.stats.hits == 1
+
+def test_rejection():
+    cache = NodeOutputCache(max_bytes=10, getsizeof=len)
+    cache['a'] = 'x' * 11
+    assert 'a' not in cache
+    assert cache.stats.rejections == 1
+
+def test_node_max_bytes():
+    cache = NodeOutputCache(node_max_bytes={'VAEDecode': 20}, getsizeof=len)
+    decode = cache.for_node('VAEDecode')
+    sample = cache.for_node('KSampler')
+    sample['s'] = 'x' * 100
+    decode['a'] = 'x' * 10
+    decode['b'] = 'x' * 10
+    decode['c'] = 'x' * 10
+    assert set(cache) == {'s', 'b', 'c'}
+    assert cache.stats.bytes == 120
+
+def test_ttl(monkeypatch):
+    import time
+    now = 0.0
+    monkeypatch.setattr(time, 'monotonic', lambda: now)
+    cache = NodeOutputCache(ttl=10, getsizeof=len)
+    cache['a'] = 'x'
+    now = 5.0
+    assert cache['a'] == 'x'
+    now = 11.0
+    with pytest.raises(KeyError):
+        cache['a']
+    assert cache.stats.expirations == 1
+    assert cache.stats.items == 0
@@ -0,0 +1,121 @@
+'''hatch env run -e test pytest tests/runtime/test_real_nodes.py'''
+from pathlib import PurePath
+
+from comfy_script.runtime import real
+from comfy_script.runtime.data import NodeOutput
+from comfy_script.runtime.factory import RuntimeFactory
+from comfy_script.runtime.nodes import _positional_args_to_keyword
+from comfy_script.runtime.real.nodes import RealRuntimeFactory, _CallPlan, _cache_key, _get_cache_key
+
+class Loader:
+    FUNCTION = 'load'
+
+    def load(self, ckpt_name):
+        return (ckpt_name,)
+
+LOADER_INFO = {
+    'input': {'required': {'ckpt_name': [['a.safetensors', 'b.safetensors']]}},
+    'output': ['MODEL'],
+    'output_is_list': [False],
+    'output_name': ['MODEL'],
+    'name': 'Loader',
+    'display_name': 'Loader',
+    'description': '',
+    'category': 'loaders',
+    'output_node': False,
+    '_cls': Loader,
+}
+
+def output(name: str, kwds: dict) -> NodeOutput:
+    output = NodeOutput({}, {'inputs': kwds, 'class_type': name}, 0)
+    output._cache_key = (name, kwds)
+    return output
+
+def test_cache_key():
+    def sample(ckpt_name: str, seed: int) -> str | None:
+        return _cache_key('KSampler', {'model': output('Loader', {'ckpt_name': ckpt_name}), 'seed': seed})
+
+    assert sample('a.safetensors', 1) == sample('a.safetensors', 1)
+    assert sample('a.safetensors', 1) != sample('a.safetensors', 2)
+    # Upstream changes
+    assert sample('a.safetensors', 1) != sample('b.safetensors', 1)
+
+    # Inputs that cannot be keyed
+    unkeyed = output('Loader', {'ckpt_name': object()})
+    assert _get_cache_key(unkeyed) is None
+    assert _cache_key('KSampler', {'model': unkeyed, 'seed': 1}) is None
+
+def test_cache_key_lazy():
+    fact = RealRuntimeFactory(real.RealModeConfig())
+    fact.add_node(LOADER_INFO)
+    model = fact.vars()['Loader']('a.safetensors')
+    assert model == 'a.safetensors'
+    # Not computed without a cache
+    virtual_output = model._self_virtual_output
+    assert isinstance(virtual_output._cache_key, tuple)
+    assert _get_cache_key(virtual_output) == _cache_key('Loader', {'ckpt_name': 'a.safetensors'})
+    assert isinstance(virtual_output._cache_key, str)
+
+class Sampler:
+    FUNCTION = 'sample'
+
+    def sample(self, **kwds):
+        return (kwds,)
+
+SAMPLER_INFO = {
+    'input': {
+        'required': {
+            'model': ['MODEL'],
+            'seed': ['INT', {'default': 0}],
+            'sampler_name': [['euler', 'dpmpp_2m']],
+            'add_noise': [['enable', 'disable']],
+        },
+        'optional': {
+            'denoise': ['FLOAT', {'default': 1.0}],
+            'tiled': [['disable', 'enable']],
+            'image': [['a.png', 'b.png']],
+        },
+    },
+    'output': ['LATENT'],
+    'output_is_list': [False],
+    'output_name': ['LATENT'],
+    'name': 'Sampler',
+    'display_name': 'Sampler',
+    'description': '',
+    'category': 'sampling',
+    'output_node': False,
+    '_cls': Sampler,
+}
+
+def test_call_plan():
+    plan = _CallPlan(SAMPLER_INFO)
+
+    def old(args: tuple, kwds: dict) -> dict:
+        kwds = _positional_args_to_keyword(SAMPLER_INFO, args) | kwds
+        return { k: RuntimeFactory._map_input(k, v, SAMPLER_INFO) for k, v in kwds.items() }
+
+    def new(args: tuple, kwds: dict) -> dict:
+        return plan.map_inputs(plan.args_to_kwds(args) | kwds)
+
+    model = object()
+    for args, kwds in [
+        ((model, 1, 'euler', True), {}),
+        ((model, 1, 'euler', False, 0.5, True, PurePath('a.png')), {}),
+        # Optional inputs
+        ((model,), {'seed': 1, 'add_noise': False, 'denoise': 0.5, 'tiled': True}),
+        # kwds take precedence
+        ((model, 1), {'seed': 2, 'sampler_name': 'dpmpp_2m', 'add_noise': 'disable'}),
+        # Extra inputs are passed through
+        ((), {'model': model, 'extra': True, 'path': PurePath('b.png')}),
+    ]:
+        assert new(args, dict(kwds)) == old(args, kwds), (args, kwds)
+
+def test_call_plan_node():
+    fact = RealRuntimeFactory(real.RealModeConfig(track_workflow=False))
+    fact.add_node(SAMPLER_INFO)
+    model = object()
+    kwds = fact.vars()['Sampler'](model, 1, 'euler', True, tiled=True, extra=1)
+    assert kwds == {
+        'model': model, 'seed': 1, 'sampler_name': 'euler', 'add_noise': 'enable',
+        'denoise': 1.0, 'tiled': 'enable', 'image': 'a.png', 'extra': 1,
+    }
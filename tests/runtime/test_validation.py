@@ -0,0 +1,84 @@
+'''hatch env run -e test pytest tests/runtime/test_validation.py'''
+from pathlib import PurePath
+
+from comfy_script.client import NodeSet
+from comfy_script.runtime.validation import PromptValidator
+
+nodes_info = {
+    'CheckpointLoaderSimple': {
+        'input': {'required': {'ckpt_name': [['a.safetensors', 'b.safetensors']]}},
+        'output': ['MODEL', 'CLIP', 'VAE'],
+    },
+    'EmptyLatentImage': {
+        'input': {'required': {
+            'width': ['INT', {'default': 512, 'min': 16, 'max': 16384}],
+            'height': ['INT', {'default': 512, 'min': 16, 'max': 16384}],
+        }},
+        'output': ['LATENT'],
+    },
+    'VAEDecode': {
+        'input': {'required': {'samples': ['LATENT'], 'vae': ['VAE']}},
+        'output': ['IMAGE'],
+    },
+    'SaveImage': {
+        'input': {
+            'required': {'images': ['IMAGE'], 'filename_prefix': ['STRING', {'default': 'ComfyUI'}]},
+            'optional': {'format': ['COMBO', {'options': ['png', 'webp']}]},
+        },
+        'output': [],
+    },
+}
+
+def prompt() -> dict:
+    return {
+        '0': {'inputs': {'ckpt_name': 'a.safetensors'}, 'class_type': 'CheckpointLoaderSimple'},
+        '1': {'inputs': {'width': 512, 'height': 512}, 'class_type': 'EmptyLatentImage'},
+        '2': {'inputs': {'samples': ['1', 0], 'vae': ['0', 2]}, 'class_type': 'VAEDecode'},
+        '3': {'inputs': {'images': ['2', 0], 'filename_prefix': 'ComfyUI', 'format': 'webp'}, 'class_type': 'SaveImage'},
+    }
+
+def errors(p: dict) -> list[tuple[str, str]]:
+    return [(e.node_id, e.type) for e in PromptValidator(nodes_info).validate(p)]
+
+def test_valid():
+    assert errors(prompt()) == []
+
+def test_invalid():
+    p = prompt()
+    p['0']['inputs']['ckpt_name'] = 'c.safetensors'
+    p['1']['inputs']['width'] = 8
+    p['1']['inputs']['height'] = 'x'
+    p['2']['inputs']['vae'] = ['0', 1]
+    del p['3']['inputs']['filename_prefix']
+    p['3']['inputs']['format'] = 'jpg'
+    assert errors(p) == [
+        ('0', 'value_not_in_list'),
+        ('1', 'value_smaller_than_min'),
+        ('1', 'invalid_input_type'),
+        ('2', 'return_type_mismatch'),
+        ('3', 'required_input_missing'),
+        ('3', 'value_not_in_list'),
+    ]
+
+def test_links():
+    p = prompt()
+    p['2']['inputs']['samples'] = ['9', 0]
+    p['2']['inputs']['vae'] = ['0', 3]
+    p['4'] = {'inputs': {}, 'class_type': 'Missing'}
+    assert errors(p) == [('2', 'bad_linked_input'), ('2', 'bad_linked_input'), ('4', 'node_not_found')]
+
+def test_same_as_node_set():
+    class LoadImage:
+        @classmethod
+        def VALIDATE_INPUTS(s, image):
+            return True
+    info = nodes_info | {'LoadImage': {'input': {'required': {'image': [['a.png']]}}, 'output': ['IMAGE'], '_cls': LoadImage}}
+    node_set = NodeSet(info)
+    for ckpt_name, image in [
+        (PurePath('a.safetensors'), 'b.png'),
+        (PurePath('c.safetensors'), 'a.png'),
+    ]:
+        p = prompt()
+        p['0']['inputs']['ckpt_name'] = ckpt_name
+        p['4'] = {'inputs': {'image': image}, 'class_type': 'LoadImage'}
+        assert [(e.node_id, e.input) for e in PromptValidator(info).validate(p)] == [(i.node_id, i.input) for i in node_set.check_prompt(p)]
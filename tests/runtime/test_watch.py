@@ -0,0 +1,309 @@
+'''hatch env run -e test pytest tests/runtime/test_watch.py'''
+import asyncio
+import io
+import time
+
+from PIL import Image
+
+from comfy_script import client
+from comfy_script.runtime import ExecutionError, QueueError, queue
+from comfy_script.runtime.batching import Batcher
+from comfy_script.runtime.data import IdManager, Result, SentImageBatchResult
+
+async def watch_server(server) -> tuple[client.Client, asyncio.Task]:
+    c = client.Client(await server.start())
+    client.client = c
+    watch = asyncio.create_task(queue._watch(c))
+    while not server.websockets:
+        await asyncio.sleep(0.01)
+    return c, watch
+
+def test_execution_error(fake_server):
+    async def f():
+        server = fake_server()
+        old_client = client.client
+        c, watch = await watch_server(server)
+        try:
+
+            task = await queue._post_prompt({'0': {'inputs': {}, 'class_type': 'Error'}}, IdManager())
+            try:
+                await asyncio.wait_for(task._wait(), 5)
+                assert False
+            except ExecutionError as e:
+                assert (e.node_id, e.node_type, e.exception_type) == ('0', 'Error', 'torch.OutOfMemoryError')
+                assert e.task is task and task.error is e
+            assert task.status == 'error'
+            assert task.prompt_id not in queue._tasks
+
+            task = await queue._post_prompt({'0': {'inputs': {}, 'class_type': 'Interrupt'}}, IdManager())
+            assert await asyncio.wait_for(task._wait(), 5) == []
+            assert task.status == 'interrupted'
+            assert task.prompt_id not in queue._tasks
+        finally:
+            watch.cancel()
+            client.client = old_client
+            await c._close()
+            await server.stop()
+    asyncio.run(f())
+
+def test_early_messages(fake_server):
+    async def f():
+        server = fake_server()
+        old_client = client.client
+        c, watch = await watch_server(server)
+        try:
+            task = await queue._post_prompt({'0': {'inputs': {}, 'class_type': 'Cached'}}, IdManager())
+            results = await asyncio.wait_for(task._wait(), 5)
+            assert results[0]._output == {'text': ['cached']}
+            assert task.status == 'success' and task.cached_nodes == ['0']
+            assert not queue._early_messages
+
+            # Wait in other threads and loops
+            task = await queue._post_prompt({'0': {'inputs': {}, 'class_type': 'Interrupt'}}, IdManager())
+            assert await asyncio.to_thread(task.wait) == []
+        finally:
+            watch.cancel()
+            client.client = old_client
+            await c._close()
+            await server.stop()
+    asyncio.run(f())
+
+def test_gather_and_stream(fake_server):
+    async def f():
+        server = fake_server()
+        old_client = client.client
+        c, watch = await watch_server(server)
+        try:
+            async def put(*class_types):
+                return [await queue._post_prompt({'0': {'inputs': {}, 'class_type': class_type}}, IdManager()) for class_type in class_types]
+
+            tasks = await put('Text3', 'Text1', 'Error')
+            results = await asyncio.wait_for(queue._gather(tasks + [None], return_exceptions=True), 5)
+            assert [len(r) for r in results[:2]] == [3, 1]
+            assert isinstance(results[2], ExecutionError) and results[3] is None
+
+            tasks = await put('Text3', 'Text1')
+            assert [task async for task in queue._as_completed(tasks)] == tasks[::-1]
+
+            tasks = await put('Text2', 'Error', 'Text1')
+            streamed = [(task, node_id, type(result)) async for task, node_id, result in queue._stream(tasks, return_exceptions=True)]
+            assert sorted(streamed, key=lambda x: (tasks.index(x[0]), x[1])) == [
+                (tasks[0], '0', Result), (tasks[0], '1', Result),
+                (tasks[1], '0', ExecutionError),
+                (tasks[2], '0', Result),
+            ]
+            try:
+                async for _ in queue._stream(tasks):
+                    pass
+                assert False
+            except ExecutionError:
+                pass
+
+            # Sync APIs in other threads
+            tasks = await put('Text1', 'Text2')
+            results = await asyncio.to_thread(queue.gather, tasks)
+            assert [len(r) for r in results] == [1, 2]
+            assert await asyncio.to_thread(lambda: [node_id for _, node_id, _ in queue.stream(tasks)]) == ['0', '0', '1']
+        finally:
+            watch.cancel()
+            client.client = old_client
+            await c._close()
+            await server.stop()
+    asyncio.run(f())
+
+def test_max_in_flight(fake_server):
+    async def f():
+        server = fake_server()
+        old_client = client.client
+        c, watch = await watch_server(server)
+        queue.max_in_flight = 3
+        try:
+            workflows = [{'0': {'inputs': {}, 'class_type': 'Text1'}} for _ in range(12)]
+            tasks = await asyncio.wait_for(asyncio.gather(*[queue._post_prompt(prompt, IdManager()) for prompt in workflows]), 10)
+            assert server.max_queue_remaining <= 3
+            await asyncio.wait_for(queue._gather(tasks), 5)
+            assert queue.in_flight == 0 and not len(queue.scheduler)
+        finally:
+            queue.max_in_flight = None
+            watch.cancel()
+            client.client = old_client
+            await c._close()
+            await server.stop()
+    asyncio.run(f())
+
+def test_scheduler(fake_server):
+    async def f():
+        server = fake_server()
+        old_client = client.client
+        c, watch = await watch_server(server)
+        queue.max_in_flight = 1
+        try:
+            def put(job_class, tenant=None):
+                return asyncio.create_task(queue._post_prompt({'0': {'inputs': {}, 'class_type': 'Text1'}}, IdManager(), job_class=job_class, tenant=tenant))
+
+            batch = [put('batch', tenant) for tenant in 'aaab']
+            await asyncio.sleep(0.01)
+            tasks = await asyncio.wait_for(asyncio.gather(*batch, put('interactive')), 10)
+            # Interactive prompts first, then tenants take turns
+            assert [task.tenant or task.job_class for task in sorted(tasks, key=lambda task: task.number)] == ['a', 'interactive', 'a', 'b', 'a']
+
+            await asyncio.wait_for(queue._gather(tasks), 5)
+            stats = queue.scheduler.stats['interactive']
+            assert stats.count >= 1 and stats.percentile(50, wait=True) > 0
+        finally:
+            queue.max_in_flight = None
+            watch.cancel()
+            client.client = old_client
+            await c._close()
+            await server.stop()
+    asyncio.run(f())
+
+def test_batching(fake_server):
+    async def f():
+        server = fake_server()
+        old_client = client.client
+        c, watch = await watch_server(server)
+        queue.batcher = Batcher(max_batch_size=4, batchable_inputs={'Images': {'seed'}})
+        stats = queue.scheduler._get_stats('default')
+        count = stats.count
+        try:
+            prompts = [{'0': {'inputs': {'seed': seed, 'batch_size': 1}, 'class_type': 'Images'}} for seed in range(6)]
+            # `_put_many()` with API-format prompts
+            queue._get_prompt_and_id, get_prompt_and_id = (lambda prompt: (prompt, IdManager())), queue._get_prompt_and_id
+            try:
+                tasks = await queue._put_many(prompts + [{}], return_exceptions=False)
+            finally:
+                queue._get_prompt_and_id = get_prompt_and_id
+            assert len(server.prompts) == 2 and tasks[-1] is None
+            assert len({task.prompt_id for task in tasks[:4]}) == 1
+
+            # Outputs are split as they are executed
+            streamed = [(tasks.index(task), node_id, result._output['images'][0]['filename']) async for task, node_id, result in queue._stream(tasks[:-1])]
+            assert sorted(streamed) == [(seed, '0', f'{seed}_0.png') for seed in range(6)]
+
+            results = await asyncio.wait_for(queue._gather(tasks[:-1]), 5)
+            assert [[image['filename'] for image in r[0]._output['images']] for r in results] == [[f'{seed}_0.png'] for seed in range(6)]
+            assert all(task.status == 'success' for task in tasks[:-1])
+            # Latencies of the workflows instead of the merged prompts
+            assert stats.count == count + 6
+        finally:
+            queue.batcher = None
+            watch.cancel()
+            client.client = old_client
+            await c._close()
+            await server.stop()
+    asyncio.run(f())
+
+def test_put_many(fake_server):
+    async def f():
+        server = fake_server()
+        old_client = client.client
+        c, watch = await watch_server(server)
+        server.delay = 0.01
+        try:
+            prompts = [{'0': {'inputs': {'i': i}, 'class_type': 'Reject' if i == 3 else 'Text1'}} for i in range(8)]
+            queue._get_prompt_and_id, get_prompt_and_id = (lambda prompt: (prompt, IdManager())), queue._get_prompt_and_id
+            try:
+                tasks = await asyncio.to_thread(queue.put_many, prompts, 3, source='')
+            finally:
+                queue._get_prompt_and_id = get_prompt_and_id
+
+            # The failure is returned in place of its task, without losing the others
+            assert isinstance(tasks[3], QueueError)
+            assert len(server.prompts) == 7
+            for i, task in enumerate(tasks):
+                if i != 3:
+                    # prompt_id is `f'{id(server)}-{n}'`
+                    assert server.prompts[int(task.prompt_id.split('-')[1]) - 1]['prompt']['0']['inputs']['i'] == i
+            await asyncio.wait_for(queue._gather(tasks[:3] + tasks[4:]), 5)
+        finally:
+            watch.cancel()
+            client.client = old_client
+            await c._close()
+            await server.stop()
+    asyncio.run(f())
+
+def test_partially_cached(fake_server):
+    async def f():
+        server = fake_server()
+        old_client = client.client
+        c, watch = await watch_server(server)
+        try:
+            task = await queue._post_prompt({
+                '0': {'inputs': {'text': ['1', 0]}, 'class_type': 'PartiallyCached'},
+                '1': {'inputs': {}, 'class_type': 'Loader'},
+            }, IdManager())
+            results = await asyncio.wait_for(task._wait(), 5)
+            assert [result._output for result in results] == [{'text': ['cached']}]
+            # The cached loader has no outputs, so the history is not needed
+            assert server.history_requests == 0
+        finally:
+            watch.cancel()
+            client.client = old_client
+            await c._close()
+            await server.stop()
+    asyncio.run(f())
+
+def test_sent_images(fake_server):
+    async def f():
+        server = fake_server()
+        old_client = client.client
+        c, watch = await watch_server(server)
+        try:
+            frame = server._image_frame('1', '0', 1, Image.new('L', (1, 2), 128), 'raw')
+            sent = client.BinaryEvent.from_bytes(frame).to_object()
+            assert (sent.prompt_id, sent.node, sent.index, sent.image.mode, sent.image.size) == ('1', '0', 1, 'L', (1, 2))
+
+            # Routed to the task by `_handle_binary()` and attached to the output of the node
+            task = await queue._post_prompt({'0': {'inputs': {}, 'class_type': 'SendImage'}}, IdManager())
+            results = await asyncio.wait_for(task._wait(), 5)
+            assert isinstance(results[0], SentImageBatchResult) and not task._sent_images
+            images = await results[0]
+            assert [(image.mode, image.size, image.getpixel((0, 0))) for image in images] == [('RGB', (2, 1), (255, 0, 0)), ('L', (1, 2), 128)]
+            raw = await results[0]._get_images(raw=True)
+            assert Image.open(io.BytesIO(raw[0])).getpixel((1, 0)) == (255, 0, 0)
+
+            # Not received
+            assert await Result.from_output({'comfy_script_images': [{'index': 0}]}) == [None]
+        finally:
+            watch.cancel()
+            client.client = old_client
+            await c._close()
+            await server.stop()
+    asyncio.run(f())
+
+def test_event_loop_thread(fake_server, monkeypatch):
+    server = fake_server()
+    old_client = client.client
+    loop = client.event_loop_thread.loop
+    c = client.Client(client.event_loop_thread.run(server.start()))
+    client.client = c
+    other_loop = asyncio.new_event_loop()
+    new_loops = []
+    new_event_loop = asyncio.events.new_event_loop
+    monkeypatch.setattr(asyncio.events, 'new_event_loop', lambda: new_loops.append(new_event_loop()) or new_loops[-1])
+    monkeypatch.setattr(queue, '_get_prompt_and_id', lambda prompt: (prompt, IdManager()))
+    queue.start_watch(False, False, False)
+    try:
+        while not server.websockets:
+            time.sleep(0.01)
+
+        def put_and_wait() -> list[Result]:
+            task = queue.put({'0': {'inputs': {}, 'class_type': 'Text2'}}, '')
+            assert task.get_loop() is loop
+            return task.wait()
+
+        # From sync code
+        assert [r._output for r in put_and_wait()] == [{'text': ['0']}, {'text': ['1']}]
+        # From a running loop
+        async def f():
+            return put_and_wait()
+        assert [r._output for r in other_loop.run_until_complete(f())] == [{'text': ['0']}, {'text': ['1']}]
+        assert not new_loops
+    finally:
+        queue._watch_future.cancel()
+        queue._watch_future = None
+        client.client = old_client
+        client.event_loop_thread.run(c._close())
+        client.event_loop_thread.run(server.stop())
+        other_loop.close()